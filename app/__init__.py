@@ -1,11 +1,27 @@
-from flask import Flask, render_template
-from flask_cors import CORS
-from .config import Config
-from .extensions import limiter
+import hmac
+from time import perf_counter
+
+from .utils.logs import configure_logging
+from .utils.metrics import CONTENT_TYPE, REGISTRY
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time to produce a response (streamed bodies excluded).",
+    ("blueprint", "route", "method", "status"))
+
+# Who may read /metrics when no METRICS_TOKEN is set.
+LOOPBACK_ADDRESSES = ("127.0.0.1", "::1")
 
 def create_app():
+    # Imported here so the CLI (app.cli) can use the services without loading the web stack.
+    from flask import Flask, Response, g, render_template, request
+    from flask_cors import CORS
+    from .config import Config
+    from .extensions import CodecJSONProvider, limiter
+
     app = Flask(__name__, static_folder="static", template_folder="templates")
+    app.json = CodecJSONProvider(app)
     app.config.from_object(Config)
+    configure_logging()
 
     # CORS
     CORS(app, origins=app.config.get("CORS_ORIGINS", "*"))
@@ -17,6 +33,10 @@ def create_app():
     if default:
         limiter._default_limits = [default] if isinstance(default, str) else default
 
+    # Expire finished jobs and key tokens in the background
+    from .services.store import start_sweeper
+    start_sweeper()
+
     # Register blueprints
     from .routes.api import api_bp
     app.register_blueprint(api_bp, url_prefix="/api")
@@ -25,4 +45,30 @@ def create_app():
     def index():
         return render_template("index.html")
 
+    @app.before_request
+    def _start_timer():
+        g.request_started = perf_counter()
+
+    @app.after_request
+    def _record_latency(response):
+        started = g.pop('request_started', None)
+        if started is not None and request.url_rule is not None:
+            REQUEST_LATENCY.observe(perf_counter() - started, blueprint=request.blueprint or "",
+                                    route=request.url_rule.rule, method=request.method,
+                                    status=str(response.status_code))
+        return response
+
+    if app.config.get("METRICS_ENABLED"):
+        @app.route("/metrics")
+        @limiter.exempt
+        def metrics():
+            token = app.config.get("METRICS_TOKEN")
+            if token:
+                allowed = hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")
+            else:
+                allowed = request.remote_addr in LOOPBACK_ADDRESSES
+            if not allowed:
+                return Response("Forbidden\n", status=403, content_type="text/plain")
+            return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
     return app
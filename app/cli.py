@@ -0,0 +1,199 @@
+"""
+Organize exports from the command line, without the web server.
+
+    python -m app.cli conversations.json other-account.zip --mode year -o results/
+    OPENAI_API_KEY=sk-... python -m app.cli conversations.json --mode category --format csv
+
+Each export is read, organized and written to ``<output>/<name>.<mode>.<format>``
+by its own worker process (one file runs in this process), so several
+exports, e.g. one per account, are parsed and grouped in parallel. The
+results are the same documents the API returns; ``ndjson`` and ``csv`` go
+through the same writers as the download endpoint.
+
+Only what the chosen mode needs is imported: time grouping never loads the
+OpenAI SDK or numpy, and nothing here loads Flask. Categorization reads the
+key from ``OPENAI_API_KEY`` and uses the label cache and pre-classifier like
+a job does; there are no checkpoints (re-running is cheap through the cache).
+"""
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from time import perf_counter
+from typing import Dict, List, Optional
+
+from .services.results import category_result, cluster_result, time_result
+from .services.time_grouping import GRANULARITIES
+from .utils.logs import configure_logging
+
+logger = logging.getLogger(__name__)
+
+MODES = tuple(GRANULARITIES) + ("category", "cluster")
+FORMATS = ("json", "ndjson", "csv")
+
+
+def _time_result(path: str, mode: str) -> dict:
+    from .services.export_reader import iter_conversations
+    from .services.time_grouping import group_conversations_by_date
+
+    return time_result(group_conversations_by_date(iter_conversations(path), mode=mode), mode)
+
+
+def _cluster_result(path: str) -> dict:
+    from .services.clustering import ConversationClusterer
+    from .services.export_reader import iter_conversations
+
+    stats = {}
+    categorized = ConversationClusterer().cluster(iter_conversations(path), stats=stats)
+    return cluster_result(categorized, stats)
+
+
+def _category_result(path: str, categories: Optional[List[str]], batch_size: int, max_concurrency: int,
+                     bulk: bool) -> dict:
+    from .services.label_cache import get_label_cache
+    from .services.preclassifier import PRECLASSIFIER_ENABLED, NaiveBayesModel, Preclassifier
+
+    if bulk:
+        from .services.bulk_categorizer import BulkCategorizer as categorizer_cls
+    else:
+        from .services.chatgpt_categorizer import ChatGPTCategorizer as categorizer_cls
+
+    categorizer = categorizer_cls(api_key=os.getenv("OPENAI_API_KEY", ""))
+    cache = get_label_cache()
+    preclassifier = None
+    if PRECLASSIFIER_ENABLED:
+        labels = categories or categorizer.default_categories
+        model = NaiveBayesModel.from_cache(cache, labels) if cache is not None else None
+        preclassifier = Preclassifier(labels, model=model)
+    stats = {}
+    categorized = categorizer.process_export(path, custom_categories=categories, batch_size=batch_size,
+                                             max_concurrency=max_concurrency, cache=cache, stats=stats,
+                                             preclassifier=preclassifier)
+    return category_result(categorized, stats)
+
+
+def write_result(result: dict, dest: str, fmt: str) -> None:
+    """Write ``result`` to ``dest`` as ``fmt`` (one of FORMATS)."""
+    tmp = f"{dest}.tmp"
+    if fmt == "json":
+        from .utils import codec
+        with open(tmp, "wb") as fh:
+            fh.write(codec.dumps(result))
+    else:
+        import tempfile
+        from .services.result_export import stream_export
+        from .services.result_index import build_index
+
+        with tempfile.TemporaryDirectory(prefix="organizer-cli-") as index_dir:
+            index = build_index("cli", result, index_dir=index_dir)
+            with open(tmp, "wb") as fh:
+                for chunk in stream_export(index, fmt, None):
+                    fh.write(chunk)
+    os.replace(tmp, dest)
+
+
+def organize_file(path: str, dest: str, mode: str, fmt: str = "json", categories: Optional[List[str]] = None,
+                  batch_size: int = 25, max_concurrency: int = 4, bulk: bool = False) -> dict:
+    """Organize one export and write the result to ``dest``. Returns its summary."""
+    if mode in GRANULARITIES:
+        result = _time_result(path, mode)
+    elif mode == "cluster":
+        result = _cluster_result(path)
+    else:
+        result = _category_result(path, categories, batch_size, max_concurrency, bulk)
+    write_result(result, dest, fmt)
+    return result["summary"]
+
+
+def output_paths(paths: List[str], output_dir: str, mode: str, fmt: str) -> Dict[str, str]:
+    """Destination per export; exports with the same file name get -2, -3, … suffixes."""
+    dests, taken = {}, set()
+    for path in paths:
+        stem = os.path.basename(path).split(".", 1)[0] or "export"
+        name, n = stem, 1
+        while name in taken:
+            n += 1
+            name = f"{stem}-{n}"
+        taken.add(name)
+        dests[path] = os.path.join(output_dir, f"{name}.{mode}.{fmt}")
+    return dests
+
+
+def _describe(summary: dict) -> str:
+    groups = summary.get("total_groups", summary.get("total_categories", 0))
+    kind = "periods" if "total_groups" in summary else "categories"
+    return f"{summary['total_conversations']} conversations in {groups} {kind}"
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli",
+                                     description="Organize ChatGPT exports (.json, .json.gz or .zip) into files.")
+    parser.add_argument("exports", nargs="+", help="export files to organize")
+    parser.add_argument("--mode", choices=MODES, default="month")
+    parser.add_argument("-o", "--output-dir", default=".", help="where results are written (default: .)")
+    parser.add_argument("--format", choices=FORMATS, default="json")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes organizing exports at once (default: one per export, up to the CPU count)")
+    parser.add_argument("--categories", help="comma-separated categories (category mode)")
+    parser.add_argument("--batch-size", type=int, default=25, help="conversations per request (category mode)")
+    parser.add_argument("--max-concurrency", type=int, default=4,
+                        help="requests in flight per export (category mode)")
+    parser.add_argument("--bulk", action="store_true", help="send categorization through the Batch API")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    missing = [p for p in args.exports if not os.path.isfile(p)]
+    if missing:
+        parser.error(f"no such file: {', '.join(missing)}")
+    if args.mode == "category" and not os.getenv("OPENAI_API_KEY", "").startswith("sk-"):
+        parser.error("category mode needs a valid key in OPENAI_API_KEY")
+    if args.bulk and args.mode != "category":
+        parser.error("--bulk only applies to category mode")
+    configure_logging()
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    categories = [c.strip() for c in args.categories.split(",") if c.strip()] if args.categories else None
+    dests = output_paths(args.exports, args.output_dir, args.mode, args.format)
+    run = partial(organize_file, mode=args.mode, fmt=args.format, categories=categories,
+                  batch_size=args.batch_size, max_concurrency=args.max_concurrency, bulk=args.bulk)
+    workers = max(1, min(args.workers or os.cpu_count() or 1, len(dests)))
+    started = perf_counter()
+    failed = 0
+
+    def report(path, summary=None, error=None):
+        nonlocal failed
+        if error is not None:
+            failed += 1
+            print(f"{path}: failed: {error}", file=sys.stderr)
+        else:
+            print(f"{path}: {_describe(summary)} -> {dests[path]}", file=sys.stderr)
+
+    if workers == 1:
+        # No pool for one worker: the run starts as fast as the imports allow.
+        for path, dest in dests.items():
+            try:
+                report(path, run(path, dest))
+            except Exception as e:
+                logger.debug("Organizing %s failed", path, exc_info=True)
+                report(path, error=e)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run, path, dest): path for path, dest in dests.items()}
+            for future in as_completed(futures):
+                try:
+                    report(futures[future], future.result())
+                except Exception as e:
+                    report(futures[future], error=e)
+
+    print(f"Organized {len(dests) - failed}/{len(dests)} exports in {perf_counter() - started:.2f}s",
+          file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
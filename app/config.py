@@ -7,6 +7,10 @@ class Config:
     RATELIMIT_STORAGE_URI = os.getenv("RATELIMIT_STORAGE_URI", "memory://")
     # CORS
     CORS_ORIGINS = os.getenv("CORS_ORIGINS", "*")
+    # Prometheus text-format metrics at /metrics (off by default). Scrapers send
+    # "Authorization: Bearer <METRICS_TOKEN>"; without a token only loopback clients get an answer.
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0").lower() not in ("0", "false", "no", "")
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
     # Server
     HOST = os.getenv("HOST", "0.0.0.0")
     PORT = int(os.getenv("PORT", "5000"))
@@ -1,8 +1,33 @@
+from flask.json.provider import DefaultJSONProvider
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
+from .utils import codec
+
 # Initialized without app; will be bound in create_app
 limiter = Limiter(
     key_func=get_remote_address,
     default_limits=[]  # We'll pass from app.config in init_app
 )
+
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """``jsonify`` and ``request.get_json`` through utils.codec (orjson when installed)."""
+
+    def dumps(self, obj, **kwargs):
+        if "indent" in kwargs:
+            # Pretty output (debug mode) stays with the standard library.
+            return super().dumps(obj, **kwargs)
+        return codec.dumps_str(obj, sort_keys=kwargs.get("sort_keys", self.sort_keys),
+                               default=kwargs.get("default", self.default))
+
+    def loads(self, s, **kwargs):
+        return codec.loads(s)
+
+    def response(self, *args, **kwargs):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        # Bytes straight from the encoder: no intermediate str for large results.
+        return self._app.response_class(codec.dumps(obj, self.sort_keys, self.default) + b"\n",
+                                        mimetype=self.mimetype)
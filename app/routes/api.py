@@ -1,14 +1,27 @@
+import hashlib
 import json
+import os
 import tempfile
 import uuid
-from time import time
+from time import sleep, time
 from secrets import token_urlsafe
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, send_file, stream_with_context
 from cryptography.fernet import InvalidToken
 
 from ..utils.keys import FERNET
-from ..services.store import KEY_STORE, KEY_TTL_SECONDS, JOBS, is_token_expired
-from ..services.jobs import process_job
+from ..services.store import FINISHED_STATUSES, KEY_STORE, KEY_TTL_SECONDS, JOBS, is_token_expired
+from ..services.jobs import (
+    JOB_DEDUPE_SECONDS, PRIORITIES, cancel_job, default_priority, hold_job_key, job_fingerprint, pause_job,
+    resume_job, submit_job
+)
+from ..services.export_reader import save_upload
+from ..services.incremental import validate_previous_result
+from ..services.result_index import DEFAULT_PAGE_SIZE, ensure_index, query_conversations
+from ..services.result_export import FORMATS, choose_encoding, stream_export
+from ..services.uploads import UPLOADS, UploadError
+from ..services.time_grouping import GRANULARITIES
+from ..utils import codec
+from ..utils.profiler import JOB_PROFILING, profile_path
 from ..extensions import limiter
 
 api_bp = Blueprint("api", __name__)
@@ -45,28 +58,56 @@ def register_key():
 def categorize():
     try:
         organize_mode = request.form.get('organize_mode', 'category')
-        if organize_mode not in ('category', 'month', 'year'):
+        if organize_mode not in ('category', 'cluster') and organize_mode not in GRANULARITIES:
             organize_mode = 'category'
 
-        api_key = None
+        key_token = None
         if organize_mode == 'category':
             key_token = request.headers.get('X-Key-Token', '')
             if not key_token:
                 return jsonify({'error': 'Missing key token. Register your key first.'}), 401
-            api_key = resolve_api_key_from_token(key_token)
-            if not api_key:
+            if not resolve_api_key_from_token(key_token):
                 return jsonify({'error': 'Key token invalid or expired. Please re-enter your key.'}), 401
 
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file uploaded'}), 400
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
+        # Either a multipart file, or a finished chunked upload (see /uploads).
+        upload_id = request.form.get('upload_id')
+        file = None
+        if not upload_id:
+            if 'file' not in request.files:
+                return jsonify({'error': 'No file uploaded'}), 400
+            file = request.files['file']
+            if file.filename == '':
+                return jsonify({'error': 'No file selected'}), 400
 
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as temp_file:
-            content = file.read().decode('utf-8')
-            temp_file.write(content)
-            temp_path = temp_file.name
+        previous_result = None
+        previous_job_id = request.form.get('previous_job_id')
+        if previous_job_id:
+            prev_job = JOBS.get(previous_job_id)
+            if not prev_job or prev_job['status'] != 'done':
+                return jsonify({'error': 'Previous job not found or not finished'}), 404
+            previous_result = prev_job['result']
+        elif 'previous_result' in request.files and request.files['previous_result'].filename:
+            try:
+                previous_result = codec.loads(request.files['previous_result'].stream.read())
+            except Exception:
+                return jsonify({'error': 'Previous result is not valid JSON'}), 400
+        if previous_result is not None:
+            problem = validate_previous_result(previous_result, organize_mode)
+            if problem:
+                return jsonify({'error': problem}), 400
+
+        if upload_id:
+            try:
+                temp_path, content_sha256 = UPLOADS.claim(upload_id)
+            except UploadError as e:
+                return _upload_error(e)
+        else:
+            # Stream to disk in chunks (hashing as we go); never hold the whole export in memory.
+            digest = hashlib.sha256()
+            with tempfile.NamedTemporaryFile(mode='wb', suffix='.json', delete=False) as temp_file:
+                save_upload(file.stream, temp_file, digest=digest)
+                temp_path = temp_file.name
+            content_sha256 = digest.hexdigest()
 
         custom_categories = request.form.get('categories')
         if custom_categories:
@@ -86,44 +127,117 @@ def categorize():
         except Exception:
             max_concurrency = 4
 
+        try:
+            token_budget = int(request.form.get('token_budget', 0)) or None
+        except Exception:
+            token_budget = None
+
         batch_size = max(5, min(100, batch_size))
         max_concurrency = max(1, min(8, max_concurrency))
+        if token_budget is not None:
+            token_budget = max(1000, min(128000, token_budget))
+
+        # Send every batch as one OpenAI Batch job (cheaper, finishes within 24h).
+        bulk = organize_mode == 'category' and request.form.get('bulk') in ('1', 'true')
+
+        # Sampling profiler, only when the server allows it (JOB_PROFILING=1).
+        profile = JOB_PROFILING and request.form.get('profile') in ('1', 'true')
+
+        priority = request.form.get('priority') or default_priority(organize_mode)
+        if priority not in PRIORITIES:
+            priority = default_priority(organize_mode)
 
         job_id = str(uuid.uuid4())
         JOBS[job_id] = {
-            'status': 'processing',
+            'status': 'queued',
             'progress': 0,
             'processed': 0,
             'total': 1,
             'message': 'Queued',
             'result': None,
-            'error': None
+            'error': None,
+            'priority': priority
         }
 
-        import threading
-        t = threading.Thread(
-            target=process_job,
-            args=(job_id, api_key, temp_path, organize_mode, custom_categories, batch_size, max_concurrency),
-            daemon=True
-        )
-        t.start()
+        if JOB_DEDUPE_SECONDS:
+            # Single-flight: a double-click or a second tab gets the job already doing this work.
+            previous = previous_job_id or previous_result
+            key = job_fingerprint(content_sha256, organize_mode, custom_categories, previous, bulk=bulk)
+            holder = JOBS.attach(key, job_id, max_age=JOB_DEDUPE_SECONDS)
+            if holder != job_id:
+                JOBS.pop(job_id)
+                os.remove(temp_path)
+                return jsonify({'job_id': holder, 'deduplicated': True})
+
+        if key_token and not hold_job_key(job_id, key_token):
+            JOBS.pop(job_id)
+            os.remove(temp_path)
+            return jsonify({'error': 'Key token invalid or expired. Please re-enter your key.'}), 401
+        # Only the job id crosses into the worker; it decrypts the held key itself.
+        submit_job(job_id, None, temp_path, organize_mode, custom_categories, batch_size, max_concurrency,
+                   previous_result=previous_result, token_budget=token_budget, priority=priority, profile=profile,
+                   key_token=key_token, bulk=bulk)
 
         return jsonify({'job_id': job_id})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@api_bp.route("/progress/<job_id>", methods=["GET"])
-def progress(job_id):
-    job = JOBS.get(job_id)
-    if not job:
-        return jsonify({'error': 'Unknown job id'}), 404
-    return jsonify({
+def _progress_payload(job):
+    payload = {
         'status': job['status'],
         'progress': job['progress'],
         'processed': job['processed'],
         'total': job['total'],
         'message': job.get('message', '')
-    })
+    }
+    if job['status'] == 'queued' and job.get('queue_position'):
+        payload['queue_position'] = job['queue_position']
+    if job.get('phase'):
+        # Bulk jobs: preparing -> submitting -> remote (batch status/counts) -> ingesting.
+        payload['phase'] = job['phase']
+        if job.get('remote'):
+            payload['remote'] = job['remote']
+    return payload
+
+@api_bp.route("/progress/<job_id>", methods=["GET"])
+def progress(job_id):
+    job = JOBS.get(job_id, include_result=False)
+    if not job:
+        return jsonify({'error': 'Unknown job id'}), 404
+    return jsonify(_progress_payload(job))
+
+# At most one SSE update per this many seconds; bursts of progress callbacks
+# in between are coalesced into the latest state.
+SSE_MIN_INTERVAL_SECONDS = 0.25
+SSE_HEARTBEAT_SECONDS = 15.0
+
+@api_bp.route("/progress/<job_id>/stream", methods=["GET"])
+def progress_stream(job_id):
+    job = JOBS.get(job_id, include_result=False)
+    if not job:
+        return jsonify({'error': 'Unknown job id'}), 404
+
+    def events(job):
+        version = None
+        while True:
+            if job is None:
+                yield "event: error\ndata: {\"error\": \"Unknown job id\"}\n\n"
+                return
+            if job.get('version') != version:
+                version = job.get('version')
+                yield f"data: {codec.dumps_str(_progress_payload(job))}\n\n"
+                if job['status'] in FINISHED_STATUSES:
+                    return
+                sleep(SSE_MIN_INTERVAL_SECONDS)
+            else:
+                yield ": keep-alive\n\n"
+            job = JOBS.wait_for_update(job_id, version, timeout=SSE_HEARTBEAT_SECONDS)
+
+    return Response(
+        stream_with_context(events(job)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @api_bp.route("/result/<job_id>", methods=["GET"])
 def result(job_id):
@@ -132,6 +246,153 @@ def result(job_id):
         return jsonify({'error': 'Unknown job id'}), 404
     if job['status'] == 'error':
         return jsonify({'error': job.get('error', 'Unknown error')}), 500
+    if job['status'] == 'cancelled':
+        return jsonify({'error': 'Job was cancelled'}), 409
     if job['status'] != 'done':
         return jsonify({'error': 'Job not finished'}), 409
     return jsonify(job['result'])
+
+_JOB_ACTIONS = {'cancel': cancel_job, 'pause': pause_job, 'resume': resume_job}
+
+@api_bp.route("/jobs/<job_id>/<action>", methods=["POST"])
+def control_job(job_id, action):
+    """Cancel, pause or resume a queued or running job."""
+    if action not in _JOB_ACTIONS:
+        return jsonify({'error': 'Unknown action'}), 404
+    job = JOBS.get(job_id, include_result=False)
+    if not job:
+        return jsonify({'error': 'Unknown job id'}), 404
+    if job['status'] in FINISHED_STATUSES:
+        return jsonify({'error': f"Job already {job['status']}"}), 409
+    _JOB_ACTIONS[action](job_id)
+    return jsonify(_progress_payload(JOBS.get(job_id, include_result=False))), 202
+
+@api_bp.route("/jobs/<job_id>/profile", methods=["GET"])
+def job_profile(job_id):
+    """The job's sampled stacks in collapsed format (flamegraph.pl / speedscope)."""
+    job = JOBS.get(job_id, include_result=False)
+    if not job:
+        return jsonify({'error': 'Unknown job id'}), 404
+    path = profile_path(job_id)
+    if not job.get('profile') or not os.path.exists(path):
+        return jsonify({'error': 'No profile for this job (start it with profile=1 and JOB_PROFILING=1)'}), 404
+    return send_file(path, mimetype='text/plain', as_attachment=True, download_name=f"{job_id}.folded")
+
+def _finished_job_error(job_id):
+    """Error response unless ``job_id`` is a successfully finished job."""
+    job = JOBS.get(job_id, include_result=False)
+    if not job:
+        return jsonify({'error': 'Unknown job id'}), 404
+    if job['status'] == 'error':
+        return jsonify({'error': job.get('error', 'Unknown error')}), 500
+    if job['status'] == 'cancelled':
+        return jsonify({'error': 'Job was cancelled'}), 409
+    if job['status'] != 'done':
+        return jsonify({'error': 'Job not finished'}), 409
+    return None
+
+def _job_index(job_id):
+    return ensure_index(job_id, lambda: (JOBS.get(job_id) or {}).get('result'))
+
+@api_bp.route("/result/<job_id>/conversations", methods=["GET"])
+def result_conversations(job_id):
+    problem = _finished_job_error(job_id)
+    if problem:
+        return problem
+
+    args = request.args
+    try:
+        cursor = int(args['cursor']) if args.get('cursor') else None
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'cursor and limit must be integers'}), 400
+
+    path = _job_index(job_id)
+    if path is None:
+        return jsonify({'error': 'Result not available'}), 404
+    return jsonify(query_conversations(
+        path, cursor=cursor, limit=limit,
+        category=args.get('category'), period=args.get('period'),
+        since=args.get('since'), until=args.get('until'), q=args.get('q')
+    ))
+
+@api_bp.route("/result/<job_id>/export", methods=["GET"])
+def result_export(job_id):
+    problem = _finished_job_error(job_id)
+    if problem:
+        return problem
+
+    fmt = request.args.get('format', 'json')
+    if fmt not in FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(FORMATS)}"}), 400
+    try:
+        encoding = choose_encoding(request.args.get('compression'), request.headers.get('Accept-Encoding', ''))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    path = _job_index(job_id)
+    if path is None:
+        return jsonify({'error': 'Result not available'}), 404
+    mimetype, ext = FORMATS[fmt]
+    headers = {
+        'Content-Disposition': f'attachment; filename="categorized_chats.{ext}"',
+        'Vary': 'Accept-Encoding',
+    }
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return Response(stream_export(path, fmt, encoding), mimetype=mimetype, headers=headers)
+
+# ----- Chunked, resumable uploads -----
+def _upload_error(e):
+    body = {'error': str(e)}
+    if e.received is not None:
+        body['received'] = e.received
+    return jsonify(body), e.status
+
+@api_bp.route("/uploads", methods=["POST"])
+def create_upload():
+    data = request.get_json(silent=True) or {}
+    try:
+        size = int(data['size']) if data.get('size') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'size must be an integer'}), 400
+    try:
+        return jsonify(UPLOADS.create(data.get('filename', ''), size, data.get('sha256'))), 201
+    except UploadError as e:
+        return _upload_error(e)
+
+@api_bp.route("/uploads/<upload_id>", methods=["GET"])
+def upload_status(upload_id):
+    try:
+        return jsonify(UPLOADS.status(upload_id))
+    except UploadError as e:
+        return _upload_error(e)
+
+@api_bp.route("/uploads/<upload_id>", methods=["PUT"])
+def append_upload(upload_id):
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({'error': 'offset query parameter is required'}), 400
+    try:
+        return jsonify(UPLOADS.append(upload_id, offset, request.stream, request.headers.get('X-Chunk-SHA256')))
+    except UploadError as e:
+        return _upload_error(e)
+
+@api_bp.route("/uploads/<upload_id>/finalize", methods=["POST"])
+def finalize_upload(upload_id):
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify(UPLOADS.finalize(upload_id, data.get('sha256')))
+    except UploadError as e:
+        return _upload_error(e)
+
+@api_bp.route("/uploads/<upload_id>", methods=["DELETE"])
+def delete_upload(upload_id):
+    try:
+        found = UPLOADS.delete(upload_id)
+    except UploadError as e:
+        return _upload_error(e)
+    if not found:
+        return jsonify({'error': 'Unknown upload id'}), 404
+    return '', 204
@@ -0,0 +1,411 @@
+"""
+Offline bulk categorization through OpenAI's Batch API.
+
+Instead of one synchronous chat completion per batch, every batch request
+is written to a JSONL file, uploaded and submitted as a single Batch job,
+which OpenAI runs within its completion window at a lower price. The job
+polls until the batch finishes, streams the output file and maps each
+answer back to its conversations. Batches with no usable answer (failed
+lines, a reply that doesn't line up) are re-sent synchronously, split as
+usual, but only up to ``BULK_FALLBACK_MAX_FRACTION`` of the requests: when
+more than that is missing (a failed or expired batch), the job fails
+instead of quietly paying full price for the whole upload. Answers that
+did arrive are kept in the cache and checkpoint, so a re-run only sends
+the rest.
+
+Summaries and cache keys are kept in a local sidecar file next to the
+request file rather than in memory; both are deleted when the job ends,
+and the uploaded and output files are deleted from OpenAI.
+
+With ``detach`` the batch isn't waited for: once it is running remotely,
+the conversations seen so far go to a third file and ``BatchPending``
+carries what is needed to finish later (``pending``), so a job can give
+its worker back for the hours the batch may take.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .chatgpt_categorizer import (ChatGPTCategorizer, ControlCB, ProgressCB, _BatchMismatch, sort_categorized,
+                                  summarize_batch_stats)
+from .checkpoints import JobCheckpoint
+from .conversation import estimate_tokens
+from .label_cache import LabelCache
+from .preclassifier import Preclassifier, features
+from ..utils import codec
+
+logger = logging.getLogger(__name__)
+
+BULK_POLL_SECONDS = float(os.getenv("BULK_POLL_SECONDS", "30"))
+# Largest share of a batch's requests that may be re-sent synchronously at full price.
+BULK_FALLBACK_MAX_FRACTION = float(os.getenv("BULK_FALLBACK_MAX_FRACTION", "0.1"))
+BULK_COMPLETION_WINDOW = "24h"
+BULK_COMPLETION_WINDOW_SECONDS = 24 * 3600
+BULK_ENDPOINT = "/v1/chat/completions"
+# Batch statuses after which nothing more will be written to the output file.
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+# Called with the phase ("preparing", "submitting", "remote", "ingesting") and
+# details such as the remote batch's status and request counts.
+PhaseCB = Optional[Callable[[str, dict], None]]
+
+
+class BatchPending(Exception):
+    """
+    Raised by ``process_conversations(detach=True)`` once the batch runs
+    remotely. ``state`` is JSON-safe; pass it back as ``parked`` once the
+    batch is final. Until then the job's work files stay on disk.
+    """
+
+    def __init__(self, state: dict):
+        super().__init__(f"Batch {state['batch_id']} is still running")
+        self.state = state
+
+
+def remote_info(batch, requests: int) -> dict:
+    """What /api/progress reports about a remote batch."""
+    rc = batch.request_counts
+    return {"batch_id": batch.id, "status": batch.status, "requests": requests,
+            "completed": rc.completed if rc else 0, "failed": rc.failed if rc else 0}
+
+
+class BulkCategorizer(ChatGPTCategorizer):
+    """A ChatGPTCategorizer that sends all of its model batches as one Batch job."""
+    poll_seconds = BULK_POLL_SECONDS
+    fallback_max_fraction = BULK_FALLBACK_MAX_FRACTION
+
+    def _submit(self, request_path: str) -> Tuple[str, str]:
+        """Upload the request file and start the batch: (input file id, batch id)."""
+        with open(request_path, "rb") as f:
+            uploaded = self._with_backoff(self._client.files.create, file=f, purpose="batch")
+        try:
+            batch = self._with_backoff(self._client.batches.create, input_file_id=uploaded.id,
+                                       endpoint=BULK_ENDPOINT, completion_window=BULK_COMPLETION_WINDOW)
+        except BaseException:
+            # The file holds every summary; don't leave it with the provider.
+            self._delete_files(uploaded.id)
+            raise
+        return uploaded.id, batch.id
+
+    def batch_status(self, pending: dict):
+        """The remote batch of a ``BatchPending`` state."""
+        return self._with_backoff(self._client.batches.retrieve, batch_id=pending["batch_id"])
+
+    def discard_pending(self, pending: dict) -> None:
+        """Abandon a ``BatchPending`` state: cancel the batch and delete its files, remote and local."""
+        try:
+            self._client.batches.cancel(pending["batch_id"])
+        except Exception as e:
+            logger.warning("Could not cancel batch %s: %s", pending["batch_id"], self._sanitize_error(e))
+        self._delete_files(pending["input_file_id"])
+        shutil.rmtree(pending["workdir"], ignore_errors=True)
+
+    def _wait(self, batch_id: str, on_poll: Callable[[object], None], control_cb: ControlCB, once: bool = False):
+        """
+        Poll until the batch reaches a final status (with ``once``, poll just
+        once); cancel it remotely if the job is abandoned.
+        """
+        try:
+            while True:
+                batch = self._with_backoff(self._client.batches.retrieve, batch_id=batch_id)
+                on_poll(batch)
+                if batch.status in FINAL_STATUSES or once:
+                    return batch
+                time.sleep(self.poll_seconds)
+                if control_cb:
+                    control_cb()
+        except BaseException:
+            try:
+                self._client.batches.cancel(batch_id)
+            except Exception as e:
+                logger.warning("Could not cancel batch %s: %s", batch_id, self._sanitize_error(e))
+            raise
+
+    def _read_output(self, file_id: str, categories: List[str], batch_stats: list) -> Dict[str, List[str]]:
+        """Stream the output file: custom_id -> labels for every answer that lines up."""
+        answers = {}
+        with self._client.files.with_streaming_response.content(file_id) as resp:
+            for line in resp.iter_lines():
+                if not line.strip():
+                    continue
+                try:
+                    row = codec.loads(line)
+                    response = row.get("response") or {}
+                    body = response.get("body") or {}
+                    usage = body.get("usage") or {}
+                except Exception:
+                    continue
+                entry = {"size": None, "bulk": True, "retries": 0, "latency_ms": None,
+                         "prompt_tokens": usage.get("prompt_tokens"),
+                         "completion_tokens": usage.get("completion_tokens"),
+                         "cached_tokens": (usage.get("prompt_tokens_details") or {}).get("cached_tokens"),
+                         "ok": False}
+                batch_stats.append(entry)
+                if response.get("status_code") != 200:
+                    continue
+                try:
+                    entry["size"] = expected = int(row["custom_id"].rsplit("-", 1)[1])
+                    content = body["choices"][0]["message"]["content"]
+                    answers[row["custom_id"]] = self._decode_answers(content, categories, expected)
+                except (_BatchMismatch, KeyError, IndexError, TypeError, ValueError):
+                    continue
+                entry["ok"] = True
+        return answers
+
+    def _delete_files(self, *file_ids: Optional[str]) -> None:
+        for file_id in file_ids:
+            if not file_id:
+                continue
+            try:
+                self._client.files.delete(file_id)
+            except Exception as e:
+                logger.warning("Could not delete file %s: %s", file_id, self._sanitize_error(e))
+
+    def process_conversations(
+        self,
+        conversations: Iterable[dict],
+        custom_categories: Optional[List[str]] = None,
+        batch_size: int = 25,
+        max_concurrency: int = 4,
+        progress_cb: ProgressCB = None,
+        total: int = 0,
+        cache: Optional[LabelCache] = None,
+        stats: Optional[dict] = None,
+        token_budget: Optional[int] = None,
+        preclassifier: Optional[Preclassifier] = None,
+        control_cb: ControlCB = None,
+        checkpoint: Optional[JobCheckpoint] = None,
+        phase_cb: PhaseCB = None,
+        detach: bool = False,
+        parked: Optional[dict] = None
+    ):
+        """
+        Categorize like ``ChatGPTCategorizer.process_conversations``, but send
+        the model batches as one Batch job.
+
+        Cache hits, checkpointed labels and confident preclassifications are
+        resolved while the request file is written, exactly as in the
+        synchronous path. ``phase_cb`` is told about each phase and, while
+        the batch runs remotely, its status and request counts.
+        ``control_cb`` runs between polls: pausing stops polling (the remote
+        batch keeps running), cancelling also cancels the remote batch.
+        With ``detach``, BatchPending is raised instead of waiting for a
+        batch still running after its first poll; ``parked`` (its state)
+        then skips straight to reading the finished batch, ignoring
+        ``conversations``.
+        Batches re-sent synchronously use up to ``max_concurrency`` workers;
+        if more than ``fallback_max_fraction`` of them would be, a
+        RuntimeError is raised instead.
+        """
+        def phase(name, **info):
+            if phase_cb:
+                phase_cb(name, info)
+
+        if parked is None:
+            if progress_cb:
+                progress_cb(0, total)
+            phase("preparing")
+
+        categories = custom_categories or self.default_categories
+        token_budget = token_budget or self.default_token_budget
+        overhead = self.prompt_overhead_tokens(categories)
+        per_conv_completion = self.completion_tokens_per_conversation
+        items = self._iter_items(conversations, list(categories) if cache is not None else None)
+        resumed = checkpoint.labels if checkpoint is not None else {}
+        # seq -> [info, category]; category is filled in as answers arrive.
+        rows: List[list] = []
+        counts = {"hits": 0, "misses": 0, "resumed": 0, "remote": 0}
+        batch_stats: List[dict] = []
+        processed = 0
+        requests = 0
+
+        workdir = tempfile.mkdtemp(prefix="bulk-") if parked is None else parked["workdir"]
+        request_path = os.path.join(workdir, "requests.jsonl")
+        sidecar_path = os.path.join(workdir, "batches.jsonl")
+        rows_path = os.path.join(workdir, "rows.jsonl")
+        input_file_id = output_file_id = error_file_id = None
+        detached = False
+        try:
+            if parked is None:
+                with open(request_path, "w", encoding="utf-8") as requests_out, \
+                        open(sidecar_path, "w", encoding="utf-8") as sidecar_out:
+                    pending: List[tuple] = []  # (seq, summary, key)
+                    pending_tokens = overhead
+
+                    def flush():
+                        nonlocal requests, pending_tokens
+                        if not pending:
+                            return
+                        # The batch size rides in the custom_id, so output rows can be checked alone.
+                        custom_id = f"b{requests}-{len(pending)}"
+                        summaries = [summary for _, summary, _ in pending]
+                        requests_out.write(codec.dumps_str({"custom_id": custom_id, "method": "POST",
+                                                            "url": BULK_ENDPOINT,
+                                                            "body": self._request_body(summaries, categories)}) + "\n")
+                        sidecar_out.write(codec.dumps_str({"id": custom_id, "seqs": [s for s, _, _ in pending],
+                                                           "keys": [k for _, _, k in pending],
+                                                           "summaries": summaries}) + "\n")
+                        requests += 1
+                        counts["remote"] += len(pending)
+                        pending.clear()
+                        pending_tokens = overhead
+
+                    while True:
+                        chunk = list(islice(items, batch_size))
+                        if not chunk:
+                            break
+                        hits = cache.get_many(k for (_, _, k) in chunk) if cache is not None else {}
+                        for summary, info, key in chunk:
+                            seq = len(rows)
+                            if key in hits:
+                                rows.append([info, hits[key]])
+                                counts["hits"] += 1
+                                processed += 1
+                                continue
+                            if seq in resumed:
+                                rows.append([info, resumed[seq]])
+                                counts["resumed"] += 1
+                                processed += 1
+                                continue
+                            counts["misses"] += 1
+                            local = preclassifier.classify(summary) if preclassifier is not None else None
+                            rows.append([info, local])
+                            if local:
+                                processed += 1
+                                continue
+                            tokens = estimate_tokens(summary) + 8
+                            if pending and (len(pending) >= batch_size or pending_tokens + tokens > token_budget or
+                                            per_conv_completion * (len(pending) + 1) > self.completion_budget):
+                                flush()
+                            pending.append((seq, summary, key))
+                            pending_tokens += tokens
+                    flush()
+            else:
+                with open(rows_path, encoding="utf-8") as rows_in:
+                    rows = [codec.loads(line) for line in rows_in]
+                counts, requests, processed = parked["counts"], parked["requests"], parked["processed"]
+                input_file_id = parked["input_file_id"]
+            if progress_cb:
+                progress_cb(processed, max(total, len(rows)))
+
+            batch = None
+            answers: Dict[str, List[str]] = {}
+            if requests:
+                if parked is None:
+                    phase("submitting", requests=requests)
+                    if control_cb:
+                        control_cb()
+                    input_file_id, batch_id = self._submit(request_path)
+                else:
+                    batch_id = parked["batch_id"]
+                resolved_locally = processed
+
+                def on_poll(remote):
+                    info = remote_info(remote, requests)
+                    phase("remote", **info)
+                    if progress_cb:
+                        remote_done = counts["remote"] * (info["completed"] + info["failed"]) // max(requests, 1)
+                        progress_cb(resolved_locally + remote_done, max(total, len(rows)))
+
+                batch = self._wait(batch_id, on_poll, control_cb, once=detach and parked is None)
+                if batch.status not in FINAL_STATUSES:
+                    # Still running remotely: keep the work files and let the caller come back.
+                    with open(rows_path, "w", encoding="utf-8") as rows_out:
+                        for row in rows:
+                            rows_out.write(codec.dumps_str(row) + "\n")
+                    detached = True
+                    raise BatchPending({
+                        "workdir": workdir, "batch_id": batch_id, "input_file_id": input_file_id,
+                        "requests": requests, "processed": processed, "counts": counts,
+                        "preclassified": preclassifier.summary() if preclassifier is not None else None,
+                    })
+                output_file_id, error_file_id = batch.output_file_id, batch.error_file_id
+                phase("ingesting", batch_id=batch.id, status=batch.status)
+                if output_file_id:
+                    answers = self._read_output(output_file_id, categories, batch_stats)
+
+            def apply(entry, labels):
+                nonlocal processed
+                labelled = list(zip(entry["seqs"], entry["keys"], entry["summaries"], labels))
+                for s, _, _, category in labelled:
+                    rows[s][1] = category
+                processed += len(labelled)
+                good = [(s, key, category, summary) for s, key, summary, category in labelled
+                        if category != "Uncategorized"]
+                if checkpoint is not None:
+                    checkpoint.record((s, category) for s, _, category, _ in good)
+                if cache is not None:
+                    cache.put_many((key, category) for _, key, category, _ in good)
+                    cache.add_term_counts((category, features(summary)) for _, _, category, summary in good)
+                if progress_cb:
+                    progress_cb(processed, max(total, processed))
+
+            # Match answers to conversations by walking the sidecar; re-send what has no answer.
+            retry = []
+            with open(sidecar_path, encoding="utf-8") as sidecar_in:
+                for line in sidecar_in:
+                    entry = codec.loads(line)
+                    labels = answers.pop(entry["id"], None)
+                    if labels is None:
+                        retry.append(entry)
+                    else:
+                        apply(entry, labels)
+            if len(retry) > requests * self.fallback_max_fraction:
+                status = batch.status if batch is not None else "unknown"
+                raise RuntimeError(
+                    f"OpenAI batch {status}: {len(retry)} of {requests} requests came back without a usable "
+                    f"answer, more than the {self.fallback_max_fraction:.0%} re-sent synchronously at full "
+                    f"price. Labels that did arrive are cached; run the job again to send the rest.")
+            if retry:
+                logger.info("Re-sending %s of %s batches synchronously", len(retry), requests)
+                if control_cb:
+                    control_cb()
+
+                def run(entry):
+                    local_stats: List[dict] = []
+                    return self._categorize_summaries(entry["summaries"], categories, local_stats), local_stats
+
+                with ThreadPoolExecutor(max_workers=max(1, int(max_concurrency or 1))) as pool:
+                    for entry, (labels, local_stats) in zip(retry, pool.map(run, retry)):
+                        batch_stats.extend(local_stats)
+                        apply(entry, labels)
+        finally:
+            if not detached:
+                self._delete_files(input_file_id, output_file_id, error_file_id)
+                for path in (request_path, sidecar_path, rows_path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                os.rmdir(workdir)
+
+        categorized: Dict[str, List[dict]] = {}
+        for info, category in rows:
+            info_out = dict(info)
+            info_out["category"] = category
+            categorized.setdefault(category, []).append(info_out)
+
+        if stats is not None:
+            stats["cache_hits"] = counts["hits"]
+            stats["cache_misses"] = counts["misses"]
+            if checkpoint is not None:
+                stats["resumed"] = counts["resumed"]
+            stats["batches"] = batch_stats
+            stats["usage"] = summarize_batch_stats(batch_stats)
+            stats["bulk"] = {
+                "batch_id": batch.id if batch is not None else None,
+                "status": batch.status if batch is not None else None,
+                "requests": requests,
+                "conversations": counts["remote"],
+                "fallback_requests": len(retry),
+            }
+            if preclassifier is not None:
+                stats["preclassified"] = preclassifier.summary()
+            elif parked is not None and parked["preclassified"] is not None:
+                stats["preclassified"] = parked["preclassified"]
+        return sort_categorized(categorized)
@@ -1,13 +1,59 @@
-import json
+import logging
 import time
+import random
 import re
+import threading
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
-from typing import Any, Callable, Dict, List, Tuple, Optional
+from functools import lru_cache
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple, Optional
 
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, APIStatusError, RateLimitError
+
+from .conversation import SUMMARY_MAX_TOKENS, estimate_tokens, parse_conversation, summarize
+from .export_reader import count_conversations, iter_conversations
+from .checkpoints import JobCheckpoint
+from .label_cache import LabelCache
+from .openai_clients import connections_opened
+from .preclassifier import Preclassifier, features
+from ..utils import codec
+
+logger = logging.getLogger(__name__)
 
 ProgressCB = Optional[Callable[[int, int], None]]
+# Called before each batch is sent; may block (pause) or raise (cancel).
+ControlCB = Optional[Callable[[], None]]
+
+MODEL = "gpt-4o-mini"
+SYSTEM_PROMPT = """You are a precise conversation categorizer. Output strict JSON only.
+
+Each user message lists ChatGPT conversations, each starting with "[n]". Put every conversation in ONE of these categories and answer with the category's number:
+
+{categories}
+
+If none fits, answer with a short code such as "a" and name the new category once under "new". Never answer "Uncategorized".
+Respond ONLY as JSON of this shape: {{"c": [2, 5, "a", 2], "new": {{"a": "Home & Cooking"}}}}
+"c" MUST hold exactly one answer per conversation, in order."""
+# What a new-category code looks like ("a", "b2"): an answer of this shape that
+# isn't defined under "new" is an invented code, not a category name.
+NEW_CATEGORY_CODE = re.compile(r"[a-z]{1,2}[0-9]{0,2}")
+
+
+@lru_cache(maxsize=32)
+def system_prompt(categories: Tuple[str, ...]) -> str:
+    """
+    The instructions and numbered categories: everything that doesn't change
+    between batches, sent once per request instead of repeated around every
+    summary. (At ~190 tokens with the default categories it is well under the
+    1024-token minimum OpenAI's prompt caching needs, so it isn't cached.)
+    """
+    return SYSTEM_PROMPT.format(categories="\n".join(f"{i}. {c}" for i, c in enumerate(categories, 1)))
+
+
+class _BatchMismatch(ValueError):
+    """The model answered, but not with one category per conversation."""
 
 class ChatGPTCategorizer:
     """
@@ -18,12 +64,30 @@ class ChatGPTCategorizer:
       - Does not store the api_key on self.
       - Sets client timeouts.
       - Avoids logging/printing sensitive content.
+
+    Batches are dispatched on a thread pool of up to ``max_concurrency``
+    workers. Retries are handled here rather than by the SDK so that a 429
+    on one worker pauses every worker (shared cooldown) instead of each
+    thread hammering the API on its own schedule.
     """
-    def __init__(self, api_key: str, timeout_seconds: float = 90.0):
+    max_retries = 5
+    backoff_base_seconds = 0.5
+    backoff_max_seconds = 30.0
+    # Per-request token budgets used to size batches (see process_conversations).
+    default_token_budget = 12000
+    completion_budget = 1500
+
+    def __init__(self, api_key: str, timeout_seconds: float = 90.0, base_url: Optional[str] = None,
+                 client: Optional[OpenAI] = None):
         if not (isinstance(api_key, str) and api_key.startswith("sk-")):
             raise ValueError("Valid OpenAI API key is required.")
         # Do NOT keep api_key on the instance; hand it straight to the client.
-        self._client = OpenAI(api_key=api_key, timeout=timeout_seconds)
+        # base_url lets tests point the client at a local fake endpoint.
+        # ``client`` is a shared, pooled client (see openai_clients.ClientRegistry).
+        self._client = client or OpenAI(api_key=api_key, timeout=timeout_seconds, base_url=base_url,
+                                        max_retries=0)
+        self._cooldown_lock = threading.Lock()
+        self._cooldown_until = 0.0
 
         self.default_categories = [
             'Programming & Development',
@@ -61,25 +125,8 @@ class ChatGPTCategorizer:
             pass
         return out
 
-    def extract_conversation_summary(self, title: str, messages: list, max_chars: int = 2000) -> str:
-        parts = [f"Title: {title}"]
-        for msg in messages[:5]:
-            try:
-                content = msg.get('content')
-                if isinstance(content, dict) and 'parts' in content:
-                    for part in content['parts'][:2]:
-                        if isinstance(part, str):
-                            parts.append(part[:300])
-                elif isinstance(content, str):
-                    parts.append(content[:300])
-                else:
-                    for k in ('text', 'message', 'content'):
-                        if isinstance(msg.get(k), str):
-                            parts.append(msg[k][:300])
-                            break
-            except Exception:
-                continue
-        return '\n'.join(parts)[:max_chars]
+    def extract_conversation_summary(self, title: str, messages: list, max_tokens: int = SUMMARY_MAX_TOKENS) -> str:
+        return summarize(title, messages, max_tokens)
 
     @staticmethod
     def _sanitize_error(message: str) -> str:
@@ -94,121 +141,459 @@ class ChatGPTCategorizer:
             return s[:300] + "..."
         return s
 
-    # ---------- OpenAI call ----------
-    def batch_categorize_with_gpt(
-        self,
-        conversations_batch: List[Tuple[str, list]],
-        custom_categories: Optional[List[str]] = None
-    ) -> List[str]:
-        categories = custom_categories or self.default_categories
+    # ---------- Backoff ----------
+    @staticmethod
+    def _retry_after_seconds(err: Exception) -> Optional[float]:
+        response = getattr(err, "response", None)
+        headers = getattr(response, "headers", None)
+        if not headers:
+            return None
+        for name in ("retry-after-ms", "retry-after"):
+            raw = headers.get(name)
+            if raw is None:
+                continue
+            try:
+                value = float(raw)
+            except (TypeError, ValueError):
+                continue
+            return value / 1000.0 if name == "retry-after-ms" else value
+        return None
+
+    @staticmethod
+    def _is_retryable(err: Exception) -> bool:
+        if isinstance(err, (RateLimitError, APIConnectionError)):
+            return True
+        if isinstance(err, APIStatusError):
+            return err.status_code in (408, 409, 429) or err.status_code >= 500
+        return False
+
+    def _wait_for_cooldown(self) -> None:
+        with self._cooldown_lock:
+            delay = self._cooldown_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _extend_cooldown(self, delay: float) -> None:
+        with self._cooldown_lock:
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
 
-        conv_summaries = []
-        for idx, (title, messages) in enumerate(conversations_batch):
-            summary = self.extract_conversation_summary(title, messages)
-            conv_summaries.append(f"Conversation {idx + 1}:\n{summary}\n")
+    def _create_completion(self, entry: Optional[dict] = None, **kwargs):
+        """
+        Call chat.completions.create, backing off on rate limits and transient
+        errors. The number of retries is recorded in ``entry``.
+        """
+        return self._with_backoff(self._client.chat.completions.create, entry, **kwargs)
 
-        batch_text = "\n---\n".join(conv_summaries)
+    def _with_backoff(self, call: Callable[..., Any], entry: Optional[dict] = None, **kwargs):
+        """Run ``call(**kwargs)`` under the shared retry/cooldown policy."""
+        attempt = 0
+        while True:
+            self._wait_for_cooldown()
+            try:
+                return call(**kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    raise
+                delay = self._retry_after_seconds(e)
+                if delay is None:
+                    delay = self.backoff_base_seconds * (2 ** attempt)
+                    delay += random.uniform(0, delay / 2)
+                delay = min(delay, self.backoff_max_seconds)
+                if isinstance(e, RateLimitError):
+                    # Everyone sharing this key is over the limit, not just us.
+                    self._extend_cooldown(delay)
+                else:
+                    time.sleep(delay)
+                attempt += 1
+                if entry is not None:
+                    entry["retries"] = attempt
 
-        user_prompt = f"""Categorize each ChatGPT conversation into ONE of these categories:
+    # ---------- OpenAI call ----------
+    @staticmethod
+    def _build_user_prompt(summaries: List[str]) -> str:
+        return "\n".join(f"[{idx}] {summary}" for idx, summary in enumerate(summaries, 1))
 
-Categories: {', '.join(categories)}
+    @staticmethod
+    def _decode_answers(content: str, categories: List[str], expected: int) -> List[str]:
+        """Map the model's numbers and new-category codes back to category names."""
+        try:
+            data = codec.loads(content)
+            answers = data.get("c")
+            new = data.get("new") or {}
+        except Exception as e:
+            # Typically a reply truncated at max_tokens.
+            raise _BatchMismatch("Model reply was not valid JSON.") from e
+        if not isinstance(answers, list) or len(answers) != expected:
+            raise _BatchMismatch("Model did not return an answers array with correct length.")
+        if not isinstance(new, dict):
+            new = {}
+        labels = []
+        for answer in answers:
+            if isinstance(answer, str) and answer.strip().isdigit():
+                answer = int(answer)
+            if isinstance(answer, int) and not isinstance(answer, bool):
+                if not 1 <= answer <= len(categories):
+                    raise _BatchMismatch("Model answered with an unknown category number.")
+                labels.append(categories[answer - 1])
+                continue
+            # A code named under "new", or (if the model ignored the codes) a name.
+            if isinstance(answer, str) and answer not in new and answer.strip() not in categories and \
+                    NEW_CATEGORY_CODE.fullmatch(answer.strip()):
+                raise _BatchMismatch("Model answered with a new-category code it did not name.")
+            label = str(new.get(answer, answer)).strip() if isinstance(answer, str) else ""
+            if not label:
+                raise _BatchMismatch("Model answer was not a category number or code.")
+            labels.append(label)
+        return labels
 
-{batch_text}
+    # Answers are category numbers: about a token each plus a separator. New
+    # categories are named once per request, within new_category_tokens.
+    completion_tokens_per_conversation = 3
+    new_category_tokens = 96
 
-Respond ONLY as JSON with this exact shape and never use "Uncategorized" category:
-{{"categories": ["Programming & Development", "Writing & Content Creation", "..."]}}
+    def prompt_overhead_tokens(self, categories: List[str]) -> int:
+        return estimate_tokens(system_prompt(tuple(categories)))
 
-- The array length MUST equal the number of conversations.
-- If none fits, propose a new single category name at that position.
-"""
+    def _request_body(self, summaries: List[str], categories: List[str]) -> dict:
+        """The chat.completions arguments for one batch."""
+        per_conv = self.completion_tokens_per_conversation
+        max_tokens = min(self.completion_budget,
+                         int(per_conv * len(summaries) * 1.25) + 32 + self.new_category_tokens)
+        return {
+            "model": MODEL,
+            "messages": [
+                {"role": "system", "content": system_prompt(tuple(categories))},
+                {"role": "user", "content": self._build_user_prompt(summaries)}
+            ],
+            "temperature": 0.2,
+            "max_tokens": max_tokens,
+            "response_format": {"type": "json_object"}
+        }
 
+    def _request_categories(self, summaries: List[str], categories: List[str],
+                            batch_stats: Optional[list]) -> List[str]:
+        """One model call. Raises _BatchMismatch if the answer doesn't line up with the batch."""
+        body = self._request_body(summaries, categories)
+        entry = {
+            "size": len(summaries),
+            "estimated_prompt_tokens": sum(estimate_tokens(m["content"]) for m in body["messages"]),
+            "max_tokens": body["max_tokens"],
+            "retries": 0,
+        }
+        started = time.perf_counter()
+        opened_before = connections_opened()
         try:
-            resp = self._client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are a precise conversation categorizer. Output strict JSON only."},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.2,
-                max_tokens=500,
-                response_format={"type": "json_object"}
-            )
-            content = resp.choices[0].message.content
-            #print(content)
-            data = json.loads(content)
-            arr = data.get("categories", [])
-            if not isinstance(arr, list) or len(arr) != len(conversations_batch):
-                raise ValueError("Model did not return a categories array with correct length.")
-            return [str(x) for x in arr]
+            resp = self._create_completion(entry, **body)
+        except Exception:
+            entry.update(latency_ms=round((time.perf_counter() - started) * 1000, 1), ok=False,
+                         connections_opened=connections_opened() - opened_before)
+            if batch_stats is not None:
+                batch_stats.append(entry)
+            raise
+        entry["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        # 0 means the request reused a pooled connection (counted only for pooled clients).
+        entry["connections_opened"] = connections_opened() - opened_before
+        usage = getattr(resp, "usage", None)
+        entry["prompt_tokens"] = getattr(usage, "prompt_tokens", None)
+        entry["completion_tokens"] = getattr(usage, "completion_tokens", None)
+        # Prompt tokens served from the provider's prompt cache; only prompts of 1024+ tokens qualify.
+        entry["cached_tokens"] = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+        entry["ok"] = False
+        if batch_stats is not None:
+            batch_stats.append(entry)
+
+        labels = self._decode_answers(resp.choices[0].message.content, categories, len(summaries))
+        entry["ok"] = True
+        return labels
+
+    def _categorize_summaries(self, summaries: List[str], categories: List[str],
+                              batch_stats: Optional[list] = None) -> List[str]:
+        """
+        Categorize ``summaries``; if the reply doesn't line up with the batch,
+        split it in half and retry each half instead of discarding it.
+        """
+        try:
+            return self._request_categories(summaries, categories, batch_stats)
+        except _BatchMismatch as e:
+            if len(summaries) == 1:
+                logger.warning("Categorization error: %s", self._sanitize_error(e),
+                               extra={"throttle": "categorization-error"})
+                return ["Uncategorized"]
+            mid = len(summaries) // 2
+            return (self._categorize_summaries(summaries[:mid], categories, batch_stats) +
+                    self._categorize_summaries(summaries[mid:], categories, batch_stats))
         except Exception as e:
-            # Do not leak prompts, payloads or API keys — print a sanitized error.
-            sanitized = self._sanitize_error(e)
-            print(f"Categorization error: {sanitized}")
-            return ["Uncategorized"] * len(conversations_batch)
+            # Do not leak prompts, payloads or API keys — log a sanitized error.
+            logger.warning("Categorization error: %s", self._sanitize_error(e),
+                           extra={"throttle": "categorization-error"})
+            return ["Uncategorized"] * len(summaries)
+
+    def batch_categorize_with_gpt(
+        self,
+        conversations_batch: List[Tuple[str, list]],
+        custom_categories: Optional[List[str]] = None,
+        batch_stats: Optional[list] = None
+    ) -> List[str]:
+        categories = custom_categories or self.default_categories
+        summaries = [self.extract_conversation_summary(title, messages) for title, messages in conversations_batch]
+        return self._categorize_summaries(summaries, categories, batch_stats)
 
     # ---------- Main ----------
+    def _iter_items(self, conversations: Iterable[dict], cache_categories: Optional[List[str]] = None
+                    ) -> Iterator[Tuple[str, dict, Optional[str]]]:
+        for conv in conversations:
+            record = parse_conversation(conv)
+            info = {
+                "title": record.title,
+                "id": record.id,
+                "create_time": self.format_timestamp(record.create_time),
+                "update_time": self.format_timestamp(record.update_time),
+                "message_count": record.message_count
+            }
+            summary = record.summary
+            key = None
+            if cache_categories is not None:
+                key = LabelCache.make_key(record.id, record.update_time, summary, cache_categories)
+            yield summary, info, key
+
     def process_export(
         self,
         filepath: str,
         custom_categories: Optional[List[str]] = None,
         batch_size: int = 25,
-        max_concurrency: int = 4,  # reserved for future parallelization
-        progress_cb: ProgressCB = None
+        max_concurrency: int = 4,
+        progress_cb: ProgressCB = None,
+        total: Optional[int] = None,
+        cache: Optional[LabelCache] = None,
+        stats: Optional[dict] = None,
+        token_budget: Optional[int] = None,
+        preclassifier: Optional[Preclassifier] = None,
+        control_cb: ControlCB = None,
+        checkpoint: Optional[JobCheckpoint] = None
     ) -> Dict[str, List[dict]]:
         """
         Returns: { category: [conv_info, ...] }
         conv_info = { title, id, create_time, update_time, message_count, category }
+
+        The export is streamed with ``iter_conversations``; pass ``total`` if
+        the caller already counted conversations to avoid a counting pass.
+        """
+        if total is None:
+            total = count_conversations(filepath)
+        return self.process_conversations(
+            iter_conversations(filepath),
+            custom_categories=custom_categories,
+            batch_size=batch_size,
+            max_concurrency=max_concurrency,
+            progress_cb=progress_cb,
+            total=total,
+            cache=cache,
+            stats=stats,
+            token_budget=token_budget,
+            preclassifier=preclassifier,
+            control_cb=control_cb,
+            checkpoint=checkpoint
+        )
+
+    def process_conversations(
+        self,
+        conversations: Iterable[dict],
+        custom_categories: Optional[List[str]] = None,
+        batch_size: int = 25,
+        max_concurrency: int = 4,
+        progress_cb: ProgressCB = None,
+        total: int = 0,
+        cache: Optional[LabelCache] = None,
+        stats: Optional[dict] = None,
+        token_budget: Optional[int] = None,
+        preclassifier: Optional[Preclassifier] = None,
+        control_cb: ControlCB = None,
+        checkpoint: Optional[JobCheckpoint] = None
+    ) -> Dict[str, List[dict]]:
         """
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        Categorize an iterable of raw conversations (see ``process_export``).
 
-        conversations = data if isinstance(data, list) else [data]
-        all_items: List[Tuple[str, list, dict]] = []
+        Up to ``max_concurrency`` batches are in flight at once. Progress is
+        reported as each batch completes; results are assembled in input order.
+        Message lists are reduced to summaries as they are read, so memory is
+        bounded by the pending batches plus the compact conv_info output.
 
-        for conv in conversations:
-            title = conv.get('title', 'Untitled')
-            messages = self.extract_messages_from_mapping(conv.get('mapping', {}) or {})
-            info = {
-                "title": title,
-                "id": conv.get('id', 'unknown'),
-                "create_time": self.format_timestamp(conv.get('create_time')),
-                "update_time": self.format_timestamp(conv.get('update_time')),
-                "message_count": len(messages)
-            }
-            all_items.append((title, messages, info))
+        Batches hold at most ``batch_size`` conversations and are closed early
+        once their estimated prompt would exceed ``token_budget`` tokens or
+        their expected answer would exceed ``completion_budget``.
+
+        With a ``cache``, labels are looked up first and only misses are
+        batched for the model; model labels also train the cache's term
+        counts. With a ``preclassifier``, misses it is confident about are
+        labelled locally and never sent. ``stats`` (if given) receives the
+        hit/miss and local counts, per-request token/latency entries and
+        usage totals.
 
-        total = len(all_items)
+        ``control_cb`` runs before every batch is sent to the model: it can
+        block to pause the job or raise to abandon it (batches already in
+        flight are allowed to finish).
+
+        With a ``checkpoint``, conversations it already has labels for (by
+        input position, from an interrupted earlier run) are not sent again,
+        and every completed batch is recorded in it.
+        """
         if progress_cb:
             progress_cb(0, total)
 
+        categories = custom_categories or self.default_categories
+        token_budget = token_budget or self.default_token_budget
+        overhead = self.prompt_overhead_tokens(categories)
+        per_conv_completion = self.completion_tokens_per_conversation
+        items = self._iter_items(conversations, list(categories) if cache is not None else None)
         categorized = defaultdict(list)
+        # seq -> (info, category); drained in seq order so output keeps input order.
+        ready: Dict[int, Tuple[dict, str]] = {}
+        # (seq, summary, info, key, prompt_tokens)
+        misses: List[Tuple[int, str, dict, Optional[str], int]] = []
+        batch_stats: List[dict] = []
+        counts = {"hits": 0, "misses": 0, "resumed": 0}
+        resumed = checkpoint.labels if checkpoint is not None else {}
+        emitted = 0
         processed = 0
+        seq = 0
+        parse_seconds = 0.0
 
-        for i in range(0, total, batch_size):
-            batch = all_items[i:i + batch_size]
-            batch_data = [(t, m) for (t, m, _) in batch]
-            cats = self.batch_categorize_with_gpt(batch_data, custom_categories=custom_categories)
-
-            for idx, (title, messages, info) in enumerate(batch):
-                category = cats[idx] if idx < len(cats) else "Uncategorized"
+        def drain():
+            nonlocal emitted
+            while emitted in ready:
+                info, category = ready.pop(emitted)
                 info_out = dict(info)
                 info_out["category"] = category
                 categorized[category].append(info_out)
-                processed += 1
-                if progress_cb:
-                    progress_cb(processed, total)
+                emitted += 1
 
-            if i + batch_size < total:
-                time.sleep(0.15)
+        def take_batch(force: bool):
+            """Pop the next batch off ``misses`` once it is full (or ``force``)."""
+            prompt_tokens = overhead
+            n = 0
+            while n < len(misses) and n < batch_size:
+                fits_prompt = prompt_tokens + misses[n][4] <= token_budget
+                fits_completion = per_conv_completion * (n + 1) <= self.completion_budget
+                if n and not (fits_prompt and fits_completion):
+                    break
+                prompt_tokens += misses[n][4]
+                n += 1
+            if not n or (n == len(misses) and n < batch_size and not force):
+                return None
+            batch = misses[:n]
+            del misses[:n]
+            return batch
 
-        def dt_key(ci):
-            s = ci.get('create_time', 'Unknown')
-            try:
-                return datetime.strptime(s, '%Y-%m-%d %H:%M')
-            except Exception:
-                return datetime.min
+        def run(batch):
+            local_stats: List[dict] = []
+            cats = self._categorize_summaries([m[1] for m in batch], categories, local_stats)
+            labelled = [(s, info, cats[i] if i < len(cats) else "Uncategorized", key, summary)
+                        for i, (s, summary, info, key, _) in enumerate(batch)]
+            return labelled, local_stats
+
+        workers = max(1, int(max_concurrency or 1))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            exhausted = False
+            while True:
+                while len(pending) < workers:
+                    batch = take_batch(force=exhausted)
+                    if batch:
+                        if control_cb:
+                            control_cb()
+                        pending.add(pool.submit(run, batch))
+                        continue
+                    if exhausted:
+                        break
+                    read_started = time.perf_counter()
+                    chunk = list(islice(items, batch_size))
+                    parse_seconds += time.perf_counter() - read_started
+                    if not chunk:
+                        exhausted = True
+                        continue
+                    hits = cache.get_many(k for (_, _, k) in chunk) if cache is not None else {}
+                    resolved_before = processed
+                    for summary, info, key in chunk:
+                        if key in hits:
+                            ready[seq] = (info, hits[key])
+                            counts["hits"] += 1
+                            processed += 1
+                        elif seq in resumed:
+                            ready[seq] = (info, resumed[seq])
+                            counts["resumed"] += 1
+                            processed += 1
+                        else:
+                            counts["misses"] += 1
+                            local = preclassifier.classify(summary) if preclassifier is not None else None
+                            if local:
+                                ready[seq] = (info, local)
+                                processed += 1
+                            else:
+                                misses.append((seq, summary, info, key, estimate_tokens(summary) + 8))
+                        seq += 1
+                    if progress_cb and processed != resolved_before:
+                        progress_cb(processed, max(total, processed))
+                    drain()
+                if not pending:
+                    if exhausted and not misses:
+                        break
+                else:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        labelled, local_stats = fut.result()
+                        batch_stats.extend(local_stats)
+                        for s, info, category, _, _ in labelled:
+                            ready[s] = (info, category)
+                        processed += len(labelled)
+                        if checkpoint is not None:
+                            checkpoint.record((s, category) for s, _, category, _, _ in labelled
+                                              if category != "Uncategorized")
+                        if cache is not None:
+                            # Failed batches come back "Uncategorized"; never cache those.
+                            good = [(key, category, summary) for _, _, category, key, summary in labelled
+                                    if category != "Uncategorized"]
+                            cache.put_many((key, category) for key, category, _ in good)
+                            cache.add_term_counts((category, features(summary)) for _, category, summary in good)
+                        if progress_cb:
+                            progress_cb(processed, max(total, processed))
+
+                drain()
+
+        if stats is not None:
+            stats["cache_hits"] = counts["hits"]
+            stats["cache_misses"] = counts["misses"]
+            if checkpoint is not None:
+                stats["resumed"] = counts["resumed"]
+            stats["batches"] = batch_stats
+            stats["parse_seconds"] = round(parse_seconds, 3)
+            stats["usage"] = summarize_batch_stats(batch_stats)
+            if preclassifier is not None:
+                stats["preclassified"] = preclassifier.summary()
+        return sort_categorized(categorized)
+
+
+def summarize_batch_stats(batch_stats: List[dict]) -> dict:
+    latencies = [b["latency_ms"] for b in batch_stats if b.get("latency_ms") is not None]
+    return {
+        "requests": len(batch_stats),
+        "failed_requests": sum(1 for b in batch_stats if not b.get("ok")),
+        "retries": sum(b.get("retries", 0) for b in batch_stats),
+        "connections_opened": sum(b.get("connections_opened", 0) for b in batch_stats),
+        "prompt_tokens": sum(b.get("prompt_tokens") or 0 for b in batch_stats),
+        "completion_tokens": sum(b.get("completion_tokens") or 0 for b in batch_stats),
+        "cached_tokens": sum(b.get("cached_tokens") or 0 for b in batch_stats),
+        "avg_latency_ms": round(sum(latencies) / len(latencies), 1) if latencies else None,
+        "max_latency_ms": max(latencies) if latencies else None,
+    }
+
+def _create_time_key(ci: dict) -> datetime:
+    s = ci.get('create_time', 'Unknown')
+    try:
+        return datetime.strptime(s, '%Y-%m-%d %H:%M')
+    except Exception:
+        return datetime.min
 
-        for k in list(categorized.keys()):
-            categorized[k] = sorted(categorized[k], key=dt_key, reverse=True)
 
-        return dict(categorized)
+def sort_categorized(categorized: Dict[str, List[dict]]) -> Dict[str, List[dict]]:
+    """Sort each category's conversations newest first (stable for equal times)."""
+    return {k: sorted(v, key=_create_time_key, reverse=True) for k, v in categorized.items()}
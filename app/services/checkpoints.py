@@ -0,0 +1,183 @@
+"""
+Per-batch checkpoints for categorization jobs.
+
+Every batch the model answers is appended to a small NDJSON file as soon as
+it completes: the batch index and the category assigned to each
+conversation, by its position in the input. Files are named after a
+content hash of the input (the export's bytes, the category list and, for
+incremental runs, the previous result's conversations) and the job writing
+them, so if the server restarts mid-job, running the same export again
+picks up the labels already paid for (from every file with that hash) and
+only sends the remaining conversations. Two jobs running the same export
+at once each write their own file; each holds a ``flock`` on it while open,
+and a finished job only deletes the files nobody holds.
+
+API keys are never written to disk, so an interrupted job can't restart by
+itself; resuming means submitting the same export again. Checkpoints are
+removed when their job finishes and otherwise expire after
+``CHECKPOINT_TTL_SECONDS``.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import uuid
+from time import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: finished jobs leave other files to the sweep
+    fcntl = None
+
+from ..utils.private_files import open_private, private_dir
+
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", os.path.join(tempfile.gettempdir(), "chatgpt_organizer_checkpoints"))
+# Empty CHECKPOINT_DIR disables checkpointing.
+CHECKPOINTS_ENABLED = bool(CHECKPOINT_DIR)
+CHECKPOINT_TTL_SECONDS = int(os.getenv("CHECKPOINT_TTL_SECONDS", str(7 * 24 * 3600)))
+
+CHECKPOINT_VERSION = 1
+_HASH_BLOCK = 1 << 20
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def checkpoint_key(input_sha256: str, categories: List[str], known: Optional[dict] = None) -> str:
+    """Content hash of everything that decides which conversation gets which position and label set."""
+    digest = hashlib.sha256()
+    digest.update(input_sha256.encode("ascii"))
+    digest.update(json.dumps(list(categories)).encode("utf-8"))
+    if known is not None:
+        digest.update(json.dumps(known, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class JobCheckpoint:
+    """
+    Append-only record of completed batches. ``labels`` holds what earlier
+    runs already finished (input position -> category), read from every
+    checkpoint with this ``key``; ``record`` adds a batch to this job's own
+    file and flushes it to disk before returning. ``job_id`` names that
+    file (a fresh id if not given; pass the same one to continue it).
+    """
+
+    def __init__(self, key: str, directory: str = CHECKPOINT_DIR, job_id: Optional[str] = None):
+        self.key = key
+        self.directory = directory
+        owner = re.sub(r"[^A-Za-z0-9_-]", "", job_id or "") or uuid.uuid4().hex
+        self.path = os.path.join(directory, f"{key}.{owner}.ndjson")
+        self.labels: Dict[int, str] = {}
+        self.batches = 0
+        private_dir(directory)
+        self._sources = self._siblings()
+        for path in self._sources:
+            self._load(path)
+        self.resumed_batches = self.batches
+        self._file = open_private(self.path, "a", encoding="utf-8")
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if self._file.tell() == 0:
+            self._write({"version": CHECKPOINT_VERSION, "key": key, "created_at": time()})
+
+    def _siblings(self) -> List[str]:
+        """Every checkpoint file for this key (``<key>.ndjson`` is the older, job-less name)."""
+        return [os.path.join(self.directory, name) for name in sorted(os.listdir(self.directory))
+                if name.startswith(f"{self.key}.") and name.endswith(".ndjson")]
+
+    def _load(self, path: str) -> None:
+        try:
+            with open(path, encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        if not lines or _parse(lines[0]).get("version") != CHECKPOINT_VERSION:
+            return  # unreadable or from another version: ignored, and swept in time
+        for line in lines[1:]:
+            entry = _parse(line)  # a crash mid-write leaves at most one torn last line
+            if "labels" not in entry:
+                continue
+            self.labels.update((int(seq), category) for seq, category in entry["labels"])
+            self.batches = max(self.batches, entry.get("batch", -1) + 1)
+
+    def _write(self, entry: dict) -> None:
+        self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def record(self, labels: Iterable[Tuple[int, str]]) -> None:
+        labels = [(int(seq), category) for seq, category in labels]
+        if not labels:
+            return
+        self._write({"batch": self.batches, "labels": labels})
+        self.labels.update(labels)
+        self.batches += 1
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+
+    def discard(self) -> None:
+        """
+        Close and delete: the job finished, nothing left to resume. Files of
+        earlier runs it resumed from go too, unless a job still holds them.
+        """
+        self.close()
+        for path in {self.path, *self._sources}:
+            if path != self.path and not _unheld(path):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def summary(self) -> dict:
+        return {"resumed_batches": self.resumed_batches, "batches": self.batches}
+
+
+def _unheld(path: str) -> bool:
+    """True if no open JobCheckpoint holds ``path`` (never, without flock)."""
+    if fcntl is None:
+        return False
+    try:
+        with open(path, "rb") as f:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def _parse(line: str) -> dict:
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return {}
+    return entry if isinstance(entry, dict) else {}
+
+
+def sweep(max_age_seconds: int = CHECKPOINT_TTL_SECONDS, directory: str = CHECKPOINT_DIR) -> int:
+    """Remove checkpoints nobody has appended to for ``max_age_seconds``."""
+    if not directory:
+        return 0
+    cutoff = time() - max_age_seconds
+    removed = 0
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return 0
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            if name.endswith(".ndjson") and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
@@ -0,0 +1,235 @@
+"""
+Offline topic clustering: the "cluster" organize mode.
+
+Conversations are turned into TF-IDF vectors over the same summary text the
+categorizer sends to the model, clustered with spherical mini-batch k-means,
+and each cluster is labelled from its highest-weighted terms. Nothing leaves
+the machine and no API key is needed; the result has the same ``categories``
+shape as ``ChatGPTCategorizer.process_conversations``.
+
+Vectors are kept in CSR form (``indptr``/``indices``/``data`` arrays) and every
+step after tokenizing is vectorized with numpy, so clustering itself takes a
+few seconds for 100k conversations.
+"""
+import math
+import os
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .chatgpt_categorizer import sort_categorized
+from .conversation import STOPWORDS, parse_conversation, tokenize
+from .time_grouping import format_timestamp
+
+CLUSTER_MAX_CLUSTERS = int(os.getenv("CLUSTER_MAX_CLUSTERS", "12"))
+CLUSTER_SEED = int(os.getenv("CLUSTER_SEED", "0"))
+
+UNCLUSTERED = 'Uncategorized'
+
+
+class _Vocabulary(dict):
+    """term -> id, assigning the next id to unseen terms (lookups stay in C)."""
+
+    def __missing__(self, term):
+        self[term] = i = len(self)
+        return i
+
+
+def _default_k(n_docs: int, max_clusters: int) -> int:
+    return max(2, min(max_clusters, int(round(math.sqrt(n_docs / 2)))))
+
+
+class ConversationClusterer:
+    """Cluster conversations by topic without calling any API."""
+
+    batch_size = 2048
+    max_batches = 200
+    min_df = 2
+    max_df_ratio = 0.5
+    min_docs_for_df_limits = 20  # tiny exports keep every term
+    label_terms = 3
+
+    def __init__(self, n_clusters: Optional[int] = None, max_clusters: int = CLUSTER_MAX_CLUSTERS,
+                 seed: int = CLUSTER_SEED):
+        self.n_clusters = n_clusters
+        self.max_clusters = max_clusters
+        self.seed = seed
+
+    # ---------- Features ----------
+    def _tokenize(self, conversations: Iterable[dict], progress_cb: Optional[Callable[[int, int], None]],
+                  total: int):
+        """Collect conv_info dicts and the flat term-id stream of every summary."""
+        infos: List[dict] = []
+        vocab = _Vocabulary()
+        lookup = vocab.__getitem__
+        term_ids = array('i')
+        lengths = array('i')
+        for conv in conversations:
+            record = parse_conversation(conv)
+            infos.append({
+                "title": record.title,
+                "id": record.id,
+                "create_time": format_timestamp(record.create_time),
+                "update_time": format_timestamp(record.update_time),
+                "message_count": record.message_count
+            })
+            before = len(term_ids)
+            term_ids.extend(map(lookup, tokenize(record.summary)))
+            lengths.append(len(term_ids) - before)
+            if progress_cb and len(infos) % 1000 == 0:
+                progress_cb(len(infos), total)
+        terms = [None] * len(vocab)
+        for term, i in vocab.items():
+            terms[i] = term
+        stop_ids = np.array([i for t, i in vocab.items() if t in STOPWORDS or len(t) < 2 or not t[0].isalpha()],
+                            dtype=np.int64)
+        return (infos, terms, np.frombuffer(term_ids, dtype=np.int32), np.frombuffer(lengths, dtype=np.int32),
+                stop_ids)
+
+    def _tfidf(self, term_ids: np.ndarray, lengths: np.ndarray, n_terms: int, stop_ids: np.ndarray):
+        """
+        Build L2-normalized TF-IDF rows. Returns (doc_rows, indptr, indices,
+        data, kept_terms): ``doc_rows`` maps each CSR row back to its
+        conversation; conversations left with no terms have no row.
+        """
+        n_docs = len(lengths)
+        doc_of_token = np.repeat(np.arange(n_docs, dtype=np.int64), lengths)
+        pairs, counts = np.unique(doc_of_token * n_terms + term_ids, return_counts=True)
+        docs, terms = np.divmod(pairs, n_terms)
+
+        df = np.bincount(terms, minlength=n_terms)
+        if n_docs >= self.min_docs_for_df_limits:
+            keep = (df >= self.min_df) & (df <= self.max_df_ratio * n_docs)
+        else:
+            keep = df > 0
+        keep &= ~np.isin(np.arange(n_terms), stop_ids)
+        kept_terms = np.flatnonzero(keep)
+        remap = np.full(n_terms, -1, dtype=np.int64)
+        remap[kept_terms] = np.arange(len(kept_terms))
+
+        mask = keep[terms]
+        docs, terms, counts = docs[mask], remap[terms[mask]], counts[mask]
+        idf = np.log((1 + n_docs) / (1 + df[kept_terms])) + 1.0
+        data = ((1.0 + np.log(counts)) * idf[terms]).astype(np.float32)
+
+        doc_rows, nnz = np.unique(docs, return_counts=True)
+        indptr = np.zeros(len(doc_rows) + 1, dtype=np.int64)
+        np.cumsum(nnz, out=indptr[1:])
+        norms = np.sqrt(np.add.reduceat(data * data, indptr[:-1])) if len(data) else np.zeros(0, np.float32)
+        data /= np.repeat(norms, nnz)
+        return doc_rows, indptr, terms.astype(np.int32), data, kept_terms
+
+    # ---------- k-means ----------
+    @staticmethod
+    def _similarities(centers, indptr, indices, data, start, stop):
+        """Cosine similarity of rows [start, stop) to every center: (rows, k)."""
+        lo, hi = indptr[start], indptr[stop]
+        contrib = centers[:, indices[lo:hi]] * data[lo:hi]
+        return np.add.reduceat(contrib, indptr[start:stop] - lo, axis=1).T
+
+    def _init_centers(self, rng, k, indptr, indices, data, n_features):
+        """k-means++ seeding on a sample of rows."""
+        n_rows = len(indptr) - 1
+        sample = np.sort(rng.choice(n_rows, size=min(n_rows, 20 * k), replace=False))
+
+        def dense(row):
+            vec = np.zeros(n_features, dtype=np.float32)
+            vec[indices[indptr[row]:indptr[row + 1]]] = data[indptr[row]:indptr[row + 1]]
+            return vec
+
+        centers = np.zeros((k, n_features), dtype=np.float32)
+        centers[0] = dense(sample[rng.integers(len(sample))])
+        best = np.full(len(sample), -np.inf, dtype=np.float32)
+        for c in range(1, k):
+            sims = np.array([self._similarities(centers[c - 1:c], indptr, indices, data, r, r + 1)[0, 0]
+                             for r in sample], dtype=np.float32)
+            best = np.maximum(best, sims)
+            weights = np.clip(1.0 - best, 0.0, None) ** 2
+            total = weights.sum()
+            pick = rng.choice(len(sample), p=weights / total) if total > 0 else rng.integers(len(sample))
+            centers[c] = dense(sample[pick])
+        return centers
+
+    def _fit(self, k, indptr, indices, data, n_features):
+        rng = np.random.default_rng(self.seed)
+        n_rows = len(indptr) - 1
+        centers = self._init_centers(rng, k, indptr, indices, data, n_features)
+        seen = np.zeros(k, dtype=np.float64)
+        n_batches = min(self.max_batches, max(10, 3 * n_rows // self.batch_size))
+        for _ in range(n_batches):
+            # Contiguous random windows keep each batch a cheap CSR slice.
+            start = int(rng.integers(0, max(1, n_rows - self.batch_size + 1)))
+            stop = min(n_rows, start + self.batch_size)
+            labels = self._similarities(centers, indptr, indices, data, start, stop).argmax(axis=1)
+            counts = np.bincount(labels, minlength=k).astype(np.float64)
+            lo, hi = indptr[start], indptr[stop]
+            row_label = np.repeat(labels, np.diff(indptr[start:stop + 1]))
+            sums = np.bincount(row_label * n_features + indices[lo:hi], weights=data[lo:hi],
+                               minlength=k * n_features).reshape(k, n_features)
+            # Per-center learning rate 1/seen (Sculley 2010), applied to the whole batch at once.
+            moved = counts > 0
+            seen[moved] += counts[moved]
+            centers[moved] += ((sums[moved] - counts[moved, None] * centers[moved]) / seen[moved, None]
+                               ).astype(np.float32)
+            norms = np.linalg.norm(centers, axis=1, keepdims=True)
+            np.divide(centers, norms, out=centers, where=norms > 0)
+        return centers, n_batches
+
+    def _assign(self, centers, indptr, indices, data):
+        n_rows = len(indptr) - 1
+        labels = np.empty(n_rows, dtype=np.int64)
+        for start in range(0, n_rows, self.batch_size):
+            stop = min(n_rows, start + self.batch_size)
+            labels[start:stop] = self._similarities(centers, indptr, indices, data, start, stop).argmax(axis=1)
+        return labels
+
+    def _label(self, center, terms, kept_terms, used):
+        top = np.argsort(center)[::-1][:self.label_terms]
+        label = ' / '.join(terms[kept_terms[i]].title() for i in top if center[i] > 0) or UNCLUSTERED
+        name, n = label, 2
+        while name in used:
+            name = f"{label} ({n})"
+            n += 1
+        used.add(name)
+        return name
+
+    # ---------- Main ----------
+    def cluster(self, conversations: Iterable[dict], progress_cb: Optional[Callable[[int, int], None]] = None,
+                total: int = 0, stats: Optional[dict] = None) -> Dict[str, List[dict]]:
+        infos, terms, term_ids, lengths, stop_ids = self._tokenize(conversations, progress_cb, total)
+        if progress_cb:
+            progress_cb(len(infos), total or len(infos))
+        if not infos:
+            return {}
+        doc_rows, indptr, indices, data, kept_terms = self._tfidf(term_ids, lengths, len(terms), stop_ids)
+
+        categorized: Dict[str, List[dict]] = {}
+        n_rows = len(doc_rows)
+        k = min(self.n_clusters or _default_k(n_rows, self.max_clusters), n_rows)
+        labels = np.zeros(n_rows, dtype=np.int64)
+        n_batches = 0
+        if k >= 2 and len(kept_terms):
+            centers, n_batches = self._fit(k, indptr, indices, data, len(kept_terms))
+            labels = self._assign(centers, indptr, indices, data)
+        else:
+            k = 1 if n_rows else 0
+            centers = np.zeros((k, len(kept_terms)), dtype=np.float32)
+            if k:
+                np.add.at(centers[0], indices, data)
+
+        used = set()
+        names = [self._label(centers[c], terms, kept_terms, used) for c in range(k)]
+        doc_label = np.full(len(infos), -1, dtype=np.int64)
+        doc_label[doc_rows] = labels
+        for info, c in zip(infos, doc_label.tolist()):
+            categorized.setdefault(names[c] if c >= 0 else UNCLUSTERED, []).append(info)
+
+        if stats is not None:
+            stats.update({
+                "clusters": k,
+                "vocabulary": int(len(kept_terms)),
+                "batches": n_batches,
+                "unclustered": int(len(infos) - n_rows),
+            })
+        return sort_categorized(categorized)
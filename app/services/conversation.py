@@ -0,0 +1,147 @@
+"""
+Single-pass parsing of one export conversation into a compact record.
+
+Both the categorizer and the time grouper need the message count, and the
+categorizer needs the first few messages (by ``create_time``) for its
+summary. Parsing each conversation once into a small record gives all of
+that from one walk of the ``mapping``, picks the first messages with a
+bounded heap instead of sorting every message, and keeps only those few
+messages (then just the summary) rather than the whole list.
+"""
+import heapq
+import string
+from typing import List
+
+SUMMARY_HEAD_MESSAGES = 5
+SUMMARY_PARTS_PER_MESSAGE = 2
+SUMMARY_MAX_TOKENS = 200
+CHARS_PER_TOKEN = 4
+
+# Punctuation becomes whitespace so str.split() tokenizes (much faster than a
+# regex); "+" and "#" survive for c++ / c#.
+_PUNCTUATION = str.maketrans({c: ' ' for c in string.punctuation if c not in '+#'})
+STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being below between both
+but by can could did do does doing don done down during each else even ever every few for from further get
+got had has have having he her here hers him his how however i if in into is it its itself just know let
+like make many may me might more most much must my need no nor not now of off on once one only or other our
+ours out over own please really right same see she should so some such sure than thank thanks that the
+their theirs them then there these they thing things think this those through title to too under until up
+us use used using very want was way we well were what when where which while who whom why will with would
+yes yet you your yours
+""".split())
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English text)."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased word tokens; stopwords are left in (callers filter them)."""
+    return text.lower().translate(_PUNCTUATION).split()
+
+
+def _message_texts(msg: dict) -> List[str]:
+    content = msg.get('content')
+    if isinstance(content, dict) and 'parts' in content:
+        return [p for p in content['parts'][:SUMMARY_PARTS_PER_MESSAGE] if isinstance(p, str)]
+    if isinstance(content, str):
+        return [content]
+    for k in ('text', 'message', 'content'):
+        if isinstance(msg.get(k), str):
+            return [msg[k]]
+    return []
+
+
+def _squash(text: str, limit: int) -> str:
+    """Collapse whitespace runs (newlines, indentation) that cost tokens but say nothing."""
+    return ' '.join(text[:limit].split())
+
+
+def summarize(title: str, messages: list, max_tokens: int = SUMMARY_MAX_TOKENS) -> str:
+    """
+    Title plus the opening of the first few messages, as sent to the model,
+    trimmed to about ``max_tokens`` tokens.
+
+    The budget left after the title is shared between the message parts:
+    parts shorter than their share are kept whole and what they leave goes
+    to the longer ones, rather than cutting every part at a fixed length.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    head = f"Title: {_squash(str(title), max_chars)}"[:max_chars]
+    texts = []
+    for msg in messages[:SUMMARY_HEAD_MESSAGES]:
+        try:
+            texts.extend(t for t in (_squash(text, max_chars) for text in _message_texts(msg)) if t)
+        except Exception:
+            continue
+    # One newline per part comes out of the budget too.
+    budget = max_chars - len(head) - len(texts)
+    limits = [0] * len(texts)
+    left = len(texts)
+    for i in sorted(range(len(texts)), key=lambda i: len(texts[i])):
+        limits[i] = max(0, min(len(texts[i]), budget // left))
+        budget -= limits[i]
+        left -= 1
+    return '\n'.join([head] + [text[:n].rstrip() for text, n in zip(texts, limits) if n])
+
+
+def first_messages(mapping: dict, n: int):
+    """
+    Return (message_count, first ``n`` messages ordered by create_time).
+
+    Equivalent to stable-sorting every message by ``create_time or 0`` and
+    slicing, but selects through an ``n``-sized heap over the timestamps
+    instead of sorting the message dicts.
+    If create_times can't be compared the messages stay in mapping order,
+    as the old sort-in-a-try did.
+    """
+    messages = [node['message'] for node in mapping.values() if node.get('message')]
+    if len(messages) <= 1 or n <= 0:
+        return len(messages), messages[:n]
+    times = [m.get('create_time') or 0 for m in messages]
+    try:
+        # nsmallest keeps an n-sized heap and is stable, like sorted(...)[:n].
+        first = heapq.nsmallest(n, range(len(times)), key=times.__getitem__)
+    except TypeError:
+        return len(messages), messages[:n]
+    return len(messages), [messages[i] for i in first]
+
+
+class ConversationRecord:
+    """What the organizers need from one conversation; the raw mapping is not kept."""
+
+    __slots__ = ('id', 'title', 'create_time', 'update_time', 'message_count', 'head', '_summary')
+
+    def __init__(self, id, title, create_time, update_time, message_count, head):
+        self.id = id
+        self.title = title
+        self.create_time = create_time
+        self.update_time = update_time
+        self.message_count = message_count
+        self.head = head
+        self._summary = None
+
+    @property
+    def summary(self) -> str:
+        if self._summary is None:
+            self._summary = summarize(self.title, self.head)
+            self.head = None  # no longer needed once summarized
+        return self._summary
+
+
+def parse_conversation(conv: dict, head_size: int = SUMMARY_HEAD_MESSAGES) -> ConversationRecord:
+    """Parse one export conversation in a single pass over its mapping.
+
+    ``head_size=0`` skips message selection when only the count is needed.
+    """
+    count, head = first_messages(conv.get('mapping', {}) or {}, head_size)
+    return ConversationRecord(
+        id=conv.get('id', 'unknown'),
+        title=conv.get('title', 'Untitled'),
+        create_time=conv.get('create_time'),
+        update_time=conv.get('update_time'),
+        message_count=count,
+        head=head,
+    )
@@ -0,0 +1,255 @@
+"""
+Incremental reader for ChatGPT ``conversations.json`` exports.
+
+The export is a single top-level JSON array that can run to hundreds of MB.
+Instead of ``json.load``-ing it, we decode one array element at a time from a
+sliding text buffer, so peak memory is roughly one conversation plus one read
+chunk regardless of the export size.
+
+Exports may also be gzip-compressed, or the ``.zip`` ChatGPT produces, in
+which case ``conversations.json`` is read (and decompressed) straight out of
+the archive.
+
+When msgspec is installed, exports up to ``TYPED_DECODE_MAX_BYTES`` can
+instead be read whole and decoded into just the fields the organizer uses
+(see ``codec.decode_export``). That is several times faster, but holds the
+export's bytes and its decoded structs at once, so it is off by default
+(0): memory then stays at one conversation plus one chunk. Set the limit
+to what a worker may spend per export to opt in.
+"""
+import gzip
+import io
+import json
+import os
+import posixpath
+import zipfile
+from typing import IO, Iterator, Optional
+
+from ..utils import codec
+
+READ_CHUNK_CHARS = 1 << 16
+UPLOAD_CHUNK_BYTES = 1 << 20
+TYPED_DECODE_MAX_BYTES = int(os.getenv("TYPED_DECODE_MAX_BYTES", "0"))
+
+_WHITESPACE = " \t\r\n"
+_decoder = json.JSONDecoder()
+
+
+class _Buffer:
+    def __init__(self, f, chunk_chars: int):
+        self._f = f
+        self._chunk = chunk_chars
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, min_chars: int = 0) -> bool:
+        """Drop consumed text and read at least one more chunk. Returns False at EOF."""
+        if self.eof:
+            return False
+        if self.pos:
+            self.text = self.text[self.pos:]
+            self.pos = 0
+        data = self._f.read(max(self._chunk, min_chars))
+        if not data:
+            self.eof = True
+            return False
+        self.text += data
+        return True
+
+    def skip(self, chars: str) -> str:
+        """Skip over ``chars`` and return the next significant char ('' at EOF)."""
+        while True:
+            n = len(self.text)
+            while self.pos < n and self.text[self.pos] in chars:
+                self.pos += 1
+            if self.pos < n:
+                return self.text[self.pos]
+            if not self.fill():
+                return ""
+
+    def decode_value(self):
+        """Decode one JSON value at the cursor, reading more input as needed."""
+        want = self._chunk
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                # Either malformed or simply not fully read yet. Grow the
+                # read size geometrically so one huge conversation is not
+                # re-scanned a quadratic number of times.
+                if not self.fill(want):
+                    raise
+                want *= 2
+                continue
+            self.pos = end
+            return value
+
+
+EXPORT_MEMBER = "conversations.json"
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZIP_MAGIC = b"PK\x03\x04"
+
+
+def detect_format(path: str) -> str:
+    """"gzip", "zip" or "json", from the file's leading bytes."""
+    with open(path, "rb") as f:
+        head = f.read(4)
+    if head.startswith(_GZIP_MAGIC):
+        return "gzip"
+    if head == _ZIP_MAGIC:
+        return "zip"
+    return "json"
+
+
+def _zip_member(zf: zipfile.ZipFile) -> str:
+    """The archive's conversations.json (the shallowest one, if nested)."""
+    names = [n for n in zf.namelist() if posixpath.basename(n) == EXPORT_MEMBER and not n.startswith("__MACOSX/")]
+    if not names:
+        raise ValueError(f"No {EXPORT_MEMBER} found in the zip archive.")
+    return min(names, key=lambda n: (n.count("/"), n))
+
+
+class _ZipText(io.TextIOWrapper):
+    """Text stream over a zip member that also closes the archive."""
+
+    def __init__(self, member, archive: zipfile.ZipFile):
+        super().__init__(member, encoding="utf-8")
+        self._archive = archive
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._archive.close()
+
+
+def open_export(path: str) -> IO[str]:
+    """Open an export (plain, gzip or zip) as a UTF-8 text stream."""
+    fmt = detect_format(path)
+    if fmt == "gzip":
+        return gzip.open(path, "rt", encoding="utf-8")
+    if fmt == "zip":
+        zf = zipfile.ZipFile(path)
+        try:
+            member = zf.open(_zip_member(zf))
+        except Exception:
+            zf.close()
+            raise
+        return _ZipText(member, zf)
+    return open(path, "r", encoding="utf-8")
+
+
+def _read_small_export(path: str, limit: int) -> Optional[bytes]:
+    """The export's (decompressed) bytes, or None if it is larger than ``limit``."""
+    fmt = detect_format(path)
+    if fmt == "zip":
+        with zipfile.ZipFile(path) as zf:
+            info = zf.getinfo(_zip_member(zf))
+            if info.file_size > limit:
+                return None
+            with zf.open(info) as f:
+                return f.read()
+    if fmt == "json":
+        if os.path.getsize(path) > limit:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+    with open(path, "rb") as f:
+        f.seek(-4, os.SEEK_END)
+        # ISIZE: uncompressed size mod 2**32. Read exactly that much (a larger
+        # read() allocates its whole size up front); more data means it wrapped.
+        size = int.from_bytes(f.read(4), "little")
+    if size > limit:
+        return None
+    with gzip.open(path, "rb") as f:
+        data = f.read(size)
+        if f.read(1):
+            return None
+    return data
+
+
+def _typed_export_bytes(path: str) -> Optional[bytes]:
+    """The export's bytes when typed decoding is enabled and the export is within the limit."""
+    if not codec.TYPED_DECODING or TYPED_DECODE_MAX_BYTES <= 0:
+        return None
+    data = _read_small_export(path, TYPED_DECODE_MAX_BYTES)
+    return data.removeprefix(b"\xef\xbb\xbf") if data else None
+
+
+def _typed_conversations(path: str) -> Optional[Iterator[dict]]:
+    data = _typed_export_bytes(path)
+    if data is None:
+        return None
+    try:
+        return codec.decode_export(data)
+    except ValueError:
+        # Unexpected field types (or malformed JSON): the streaming decoder copes or reports it.
+        return None
+
+
+def iter_conversations(path: str, chunk_chars: int = READ_CHUNK_CHARS) -> Iterator[dict]:
+    """
+    Yield conversations from an export one at a time.
+
+    Accepts the usual top-level array, or a single conversation object
+    (treated as a one-element export, matching the old ``json.load`` path).
+    The file may be plain JSON, gzip-compressed, or a ChatGPT export zip.
+    """
+    typed = _typed_conversations(path)
+    if typed is not None:
+        yield from typed
+        return
+    with open_export(path) as f:
+        buf = _Buffer(f, chunk_chars)
+        first = buf.skip(_WHITESPACE + "\ufeff")
+        if first == "":
+            raise ValueError("Export file is empty.")
+        if first != "[":
+            yield buf.decode_value()
+            return
+        buf.pos += 1
+        while True:
+            ch = buf.skip(_WHITESPACE)
+            if ch == "]":
+                return
+            if ch == "":
+                raise ValueError("Unexpected end of export: unterminated array.")
+            item = buf.decode_value()
+            if isinstance(item, dict):
+                yield item
+            ch = buf.skip(_WHITESPACE)
+            if ch == ",":
+                buf.pos += 1
+            elif ch != "]":
+                raise ValueError("Malformed export: expected ',' or ']' between conversations.")
+
+
+def count_conversations(path: str) -> int:
+    """
+    Count conversations without holding more than one in memory. With
+    typed decoding on, the elements are only skipped over, not decoded.
+    """
+    data = _typed_export_bytes(path)
+    if data is not None:
+        try:
+            return codec.count_export(data)
+        except ValueError:
+            pass
+    return sum(1 for _ in iter_conversations(path))
+
+
+def save_upload(stream, dest, chunk_bytes: int = UPLOAD_CHUNK_BYTES, digest=None) -> int:
+    """
+    Copy an uploaded file stream to ``dest`` (a binary file object) in
+    chunks, feeding each chunk to ``digest`` (a hashlib object) if given.
+    """
+    written = 0
+    while True:
+        chunk = stream.read(chunk_bytes)
+        if not chunk:
+            return written
+        dest.write(chunk)
+        if digest is not None:
+            digest.update(chunk)
+        written += len(chunk)
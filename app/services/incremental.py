@@ -0,0 +1,119 @@
+"""
+Incremental re-organization against a previous job result.
+
+A previous result (a finished job, or the JSON downloaded from the UI) tells
+us every conversation we have already organized and its ``update_time``.
+Only conversations that are new or whose ``update_time`` changed are run
+through the organizer; they are then merged into the previous ``categories``
+or ``time_periods`` structure with the usual newest-first bucket ordering.
+
+Results only store ``update_time`` at minute resolution ("%Y-%m-%d %H:%M"),
+so that is the resolution changes are detected at.
+"""
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from .chatgpt_categorizer import sort_categorized
+from .time_grouping import format_timestamp, sort_time_periods
+
+
+def validate_previous_result(result, organize_mode: str) -> Optional[str]:
+    """Return an error message if ``result`` can't seed a job in ``organize_mode``."""
+    if organize_mode == 'cluster':
+        return 'Cluster mode always re-clusters the whole export; previous results are not supported.'
+    if not isinstance(result, dict):
+        return 'Previous result must be a JSON object.'
+    prev_mode = (result.get('summary') or {}).get('organize_mode')
+    key = 'categories' if organize_mode == 'category' else 'time_periods'
+    if not isinstance(result.get(key), dict):
+        return f'Previous result has no "{key}" to merge into.'
+    if prev_mode and prev_mode != organize_mode:
+        return f'Previous result was organized by "{prev_mode}", not "{organize_mode}".'
+    return None
+
+
+def _iter_infos(result: dict) -> Iterator[dict]:
+    if isinstance(result.get('categories'), dict):
+        for convs in result['categories'].values():
+            yield from convs
+    if isinstance(result.get('time_periods'), dict):
+        for buckets in result['time_periods'].values():
+            for convs in buckets.values():
+                yield from convs
+
+
+def known_update_times(result: dict) -> Dict[str, str]:
+    """id -> formatted update_time for every conversation in a previous result."""
+    return {str(c.get('id')): c.get('update_time', 'Unknown') for c in _iter_infos(result)}
+
+
+class ChangeFilter:
+    """Pass through only new or updated conversations, counting as it goes."""
+
+    def __init__(self, known: Dict[str, str], format_ts: Callable = format_timestamp):
+        self.known = known
+        self.format_ts = format_ts
+        self.new = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.changed_ids = set()
+
+    def __call__(self, conversations: Iterable[dict]) -> Iterator[dict]:
+        for conv in conversations:
+            conv_id = str(conv.get('id', 'unknown'))
+            previous = self.known.get(conv_id)
+            if previous is None:
+                self.new += 1
+            elif previous != self.format_ts(conv.get('update_time')):
+                self.updated += 1
+            else:
+                self.unchanged += 1
+                continue
+            self.changed_ids.add(conv_id)
+            yield conv
+
+    def state(self) -> dict:
+        """What ``restore`` needs to pick up the counts later, e.g. after a bulk job waited (JSON-safe)."""
+        return {"new": self.new, "updated": self.updated, "unchanged": self.unchanged,
+                "changed_ids": sorted(self.changed_ids)}
+
+    def restore(self, state: dict) -> None:
+        self.new, self.updated, self.unchanged = state["new"], state["updated"], state["unchanged"]
+        self.changed_ids = set(state["changed_ids"])
+
+    def summary(self) -> dict:
+        return {
+            "previous_conversations": len(self.known),
+            "new": self.new,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+        }
+
+
+def _without(convs: List[dict], drop_ids: set) -> List[dict]:
+    return [c for c in convs if str(c.get('id')) not in drop_ids]
+
+
+def merge_categories(previous: Dict[str, List[dict]], delta: Dict[str, List[dict]], changed_ids: set
+                     ) -> Dict[str, List[dict]]:
+    merged = {}
+    for cat, convs in previous.items():
+        kept = _without(convs, changed_ids)
+        if kept:
+            merged[cat] = kept
+    for cat, convs in delta.items():
+        merged.setdefault(cat, []).extend(convs)
+    return sort_categorized(merged)
+
+
+def merge_time_periods(previous: Dict[str, Dict[str, List[dict]]], delta: Dict[str, Dict[str, List[dict]]],
+                       changed_ids: set, mode: str) -> Dict[str, Dict[str, List[dict]]]:
+    merged = {}
+    for period, buckets in previous.items():
+        for bucket, convs in buckets.items():
+            kept = _without(convs, changed_ids)
+            if kept:
+                merged.setdefault(period, {})[bucket] = kept
+    for period, buckets in delta.items():
+        for bucket, convs in buckets.items():
+            merged.setdefault(period, {}).setdefault(bucket, []).extend(convs)
+    return sort_time_periods(merged, mode)
@@ -1,98 +1,673 @@
+import hashlib
+import heapq
+import itertools
 import json
+import logging
+import multiprocessing
 import os
+import shutil
+import threading
 import traceback
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from time import perf_counter, time
 
+from cryptography.fernet import InvalidToken
+
+from .bulk_categorizer import (BULK_COMPLETION_WINDOW_SECONDS, FINAL_STATUSES as BATCH_FINAL_STATUSES, BatchPending,
+                               BulkCategorizer, remote_info)
 from .chatgpt_categorizer import ChatGPTCategorizer
-from .time_grouping import group_conversations_by_date
-from .store import JOBS
+from .checkpoints import CHECKPOINTS_ENABLED, JobCheckpoint, checkpoint_key, file_sha256
+from .clustering import ConversationClusterer
+from .time_grouping import GRANULARITIES, group_conversations_by_date
+from .export_reader import count_conversations, iter_conversations
+from .label_cache import get_label_cache
+from .openai_clients import CLIENTS
+from .preclassifier import PRECLASSIFIER_ENABLED, NaiveBayesModel, Preclassifier
+from .incremental import (
+    ChangeFilter, known_update_times, merge_categories, merge_time_periods
+)
+from .result_index import build_index
+from .results import category_result, cluster_result, time_result
+from .store import JOB_TTL_SECONDS, JOBS, KEY_STORE, is_token_expired
 from ..utils.keys import FERNET
+from ..utils.logs import configure_logging
+from ..utils.metrics import REGISTRY
+from ..utils.profiler import RssSampler, StackSampler, save_profile
+
+logger = logging.getLogger(__name__)
+
+# Number of jobs run at once. Jobs go to a process pool when the job store is
+# shared across processes (JOB_BACKEND=sqlite), otherwise to a thread pool.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+
+# Queue order (lower runs first, then first come first served). Time grouping
+# and clustering finish quickly without the API, so by default they don't
+# wait behind long categorization jobs.
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+# How often a paused job re-reads its record (changes in this process wake it at once).
+PAUSE_POLL_SECONDS = 5.0
+# Conversations read between control checks outside the categorizer's batch loop.
+CONTROL_CHECK_EVERY = 1000
+# An identical request (same export bytes, mode, categories and previous
+# result) attaches to the job already running it, or to one that finished
+# within this many seconds, instead of starting another. 0 disables.
+JOB_DEDUPE_SECONDS = int(os.getenv("JOB_DEDUPE_SECONDS", "3600"))
+
+
+def default_priority(organize_mode):
+    return 'normal' if organize_mode == 'category' else 'high'
+
+
+def job_fingerprint(content_sha256, organize_mode, categories=None, previous=None, bulk=False):
+    """
+    Dedupe key for a request: everything that decides its result. Batch
+    sizes, concurrency and priority only change how it is computed.
+    ``previous`` identifies the previous result (a job id or the result).
+    Bulk jobs get keys of their own: a synchronous request shouldn't end up
+    waiting out a Batch job's completion window.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{content_sha256}\0{organize_mode}\0".encode("utf-8"))
+    if bulk:
+        digest.update(b"bulk\0")
+    if organize_mode == 'category':
+        digest.update(json.dumps(categories or None).encode("utf-8"))  # None: the default list
+    if previous is not None:
+        digest.update(b"\0")
+        digest.update(json.dumps(previous, sort_keys=True, separators=(',', ':')).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once it has been asked to cancel."""
+
+
+JOB_DURATION = REGISTRY.histogram(
+    "job_duration_seconds", "Wall time of finished jobs.", ("organize_mode", "status"),
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200))
+JOB_PARSE = REGISTRY.histogram(
+    "job_parse_seconds", "Time categorization jobs spent reading and parsing the export.", ("organize_mode",),
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+JOB_PEAK_RSS = REGISTRY.gauge(
+    "job_peak_rss_bytes",
+    "Peak resident memory of the process while the latest job ran (sampled; includes jobs running beside it).",
+    ("organize_mode",))
+JOB_RSS_GROWTH = REGISTRY.gauge(
+    "job_rss_growth_bytes", "How far the latest job's process grew above its resident memory at job start.",
+    ("organize_mode",))
+OPENAI_LATENCY = REGISTRY.histogram(
+    "openai_request_duration_seconds",
+    "Latency of chat completion requests (including retries), by whether they opened a new connection.",
+    ("connection",), buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120))
+OPENAI_CONNECTIONS = REGISTRY.counter("openai_connections_opened_total", "Connections opened to the API.")
+OPENAI_REQUESTS = REGISTRY.counter("openai_requests_total", "Chat completion requests by outcome.", ("outcome",))
+OPENAI_RETRIES = REGISTRY.counter("openai_retries_total", "Retried chat completion attempts.")
+OPENAI_TOKENS = REGISTRY.counter("openai_tokens_total", "Tokens reported by the API.", ("kind",))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if JOBS.shared:
+                # spawn: never fork a process that is running Flask's threads.
+                _executor = ProcessPoolExecutor(max_workers=JOB_WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+            else:
+                _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+        return _executor
+
+class JobScheduler:
+    """
+    Runs at most ``max_running`` jobs at once and queues the rest by
+    priority, then arrival. Each queued job's record carries its
+    ``queue_position`` (1 = next to start) for /api/progress.
+
+    The queue belongs to the process that accepted the jobs; the jobs
+    themselves may run in worker processes. A bulk job that returns while
+    its batch runs remotely (status 'waiting') frees its slot and is
+    handed to ``batches``, which queues it again once the batch is done.
+    """
+
+    def __init__(self, max_running=JOB_WORKERS):
+        self.max_running = max_running
+        self._lock = threading.Lock()
+        self._queue = []  # heap of (priority, seq, job_id, args, kwargs)
+        self._seq = itertools.count()
+        self._running = 0
+        self._positions = {}  # job_id -> last published position
+        self.batches = BatchPoller(self)
+
+    def submit(self, job_id, *args, priority='normal', **kwargs):
+        self._push(PRIORITIES[priority], job_id, args, kwargs)
+
+    def _push(self, rank, job_id, args, kwargs):
+        with self._lock:
+            heapq.heappush(self._queue, (rank, next(self._seq), job_id, args, kwargs))
+        self._dispatch()
+
+    def remove(self, job_id):
+        """Take a job off the queue. Returns its process_job args, or None if it isn't queued here."""
+        with self._lock:
+            for i, entry in enumerate(self._queue):
+                if entry[2] == job_id:
+                    self._queue.pop(i)
+                    heapq.heapify(self._queue)
+                    break
+            else:
+                return None
+        self._publish_positions()
+        return entry[3]
+
+    def queued(self):
+        with self._lock:
+            return [entry[2] for entry in sorted(self._queue)]
+
+    def queued_count(self) -> int:
+        with self._lock:
+            return len(self._queue)
+
+    def _dispatch(self):
+        started = []
+        with self._lock:
+            while self._queue and self._running < self.max_running:
+                started.append(heapq.heappop(self._queue))
+                self._running += 1
+        for rank, _, job_id, args, kwargs in started:
+            self._start(rank, job_id, args, kwargs)
+        self._publish_positions()
+
+    def _start(self, rank, job_id, args, kwargs):
+        try:
+            future = get_executor().submit(process_job, job_id, *args, **kwargs)
+        except Exception as e:
+            finish_job(job_id, error=e)
+            self._finished()
+            return
+
+        def _done(fut):
+            # Failures to even start are recorded on the job.
+            exc = fut.exception()
+            if exc is not None:
+                finish_job(job_id, error=exc)
+            elif (fut.result() or {}).get('status') == 'waiting':
+                self.batches.watch(job_id, rank, args, kwargs)
+            else:
+                try:
+                    observe_job(fut.result())
+                except Exception:
+                    logger.exception("[JOB %s] Could not record metrics", job_id)
+            self._finished()
+
+        future.add_done_callback(_done)
+
+    def _finished(self):
+        with self._lock:
+            self._running -= 1
+        self._dispatch()
+
+    def _publish_positions(self):
+        with self._lock:
+            order = [entry[2] for entry in sorted(self._queue)]
+            changed = {job_id: n for n, job_id in enumerate(order, 1) if self._positions.get(job_id) != n}
+            self._positions = {job_id: n for n, job_id in enumerate(order, 1)}
+        for job_id, n in changed.items():
+            JOBS.update(job_id, queue_position=n, message=f"Queued (position {n})")
+
+
+class BatchPoller:
+    """
+    Polls the remote batches of bulk jobs waiting in status 'waiting', one
+    thread for all of them, every ``BulkCategorizer.poll_seconds``. A job
+    goes back on its scheduler's queue (same priority) once its batch is
+    final; until then it holds no slot, so a batch that takes its whole
+    completion window doesn't hold up other jobs. Paused jobs stay here;
+    cancelled ones are cancelled remotely and cleaned up.
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self._lock = threading.Lock()
+        self._waiting = {}  # job_id -> (priority, args, kwargs)
+        self._wake = threading.Event()
+        self._thread = None
+
+    def watch(self, job_id, rank, args, kwargs):
+        with self._lock:
+            self._waiting[job_id] = (rank, args, kwargs)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="batch-poller", daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        """Poll now rather than at the next interval (e.g. after a cancel)."""
+        self._wake.set()
+
+    def waiting(self):
+        with self._lock:
+            return list(self._waiting)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._waiting:
+                    self._thread = None
+                    return
+            self._wake.wait(BulkCategorizer.poll_seconds)
+            self._wake.clear()
+            self.poll()
+
+    def poll(self):
+        """Check every waiting job once; requeue those whose batch is final."""
+        for job_id in self.waiting():
+            with self._lock:
+                rank, args, kwargs = self._waiting[job_id]
+            try:
+                parked = _poll_parked_job(job_id, kwargs.get('key_token'))
+            except Exception as e:
+                # Transient (network, rate limits): the batch keeps running, try again next round.
+                logger.warning("[JOB %s] Could not poll its batch: %s", job_id, e)
+                continue
+            if parked is None:
+                continue
+            with self._lock:
+                self._waiting.pop(job_id, None)
+            if parked:
+                JOBS.update(job_id, status='queued', message='Queued')
+                self.scheduler._push(rank, job_id, args, dict(kwargs, parked=parked))
+
+
+def _poll_parked_job(job_id, key_token=None):
+    """
+    One look at a waiting bulk job. Returns its parked state once it should
+    run again, False once it no longer waits (cancelled, key gone), and
+    None while its batch is still running or the job is paused.
+    """
+    job = JOBS.get(job_id, include_result=False)
+    parked = (job or {}).get('parked')
+    if job is None or job.get('status') != 'waiting' or not parked:
+        return False
+    api_key = take_job_key(job_id, keep=True)
+    if api_key is None:
+        shutil.rmtree(parked['workdir'], ignore_errors=True)
+        finish_job(job_id, error="The API key for this job expired while its batch was running.")
+        return False
+    with ExitStack() as resources:
+        client = resources.enter_context(CLIENTS.lease(key_token, api_key)) if key_token else None
+        categorizer = BulkCategorizer(api_key=api_key, client=client)
+        if job.get('control') == 'cancel':
+            categorizer.discard_pending(parked)
+            KEY_STORE.pop(_job_key_token(job_id), None)
+            if JOBS.update(job_id, status='cancelled', control=None, parked=None, message='Cancelled'):
+                logger.info("[JOB %s] CANCELLED while its batch was running", job_id)
+            return False
+        if job.get('control') == 'pause':
+            return None
+        batch = categorizer.batch_status(parked)
+    if batch.status in BATCH_FINAL_STATUSES:
+        return parked
+    set_job_phase(job_id, 'remote', remote_info(batch, parked['requests']))
+    return None
+
+
+SCHEDULER = JobScheduler()
+
+REGISTRY.gauge("jobs_queued", "Jobs waiting for a worker in this process.", function=SCHEDULER.queued_count)
+REGISTRY.gauge("jobs_running", "Jobs running for this process.", function=lambda: SCHEDULER._running)
+REGISTRY.gauge("jobs_waiting", "Bulk jobs waiting for their remote batch, without a slot.",
+               function=lambda: len(SCHEDULER.batches.waiting()))
+REGISTRY.gauge("openai_pooled_clients", "Pooled API clients held by this process.",
+               function=lambda: CLIENTS.stats()["clients"])
+
+
+def observe_job(report):
+    """Record the report returned by process_job (in the process that queued the job)."""
+    if not report:
+        return
+    mode = report["organize_mode"]
+    JOB_DURATION.observe(report["duration"], organize_mode=mode, status=report.get("status") or "unknown")
+    if report.get("parse_seconds") is not None:
+        JOB_PARSE.observe(report["parse_seconds"], organize_mode=mode)
+    if report.get("peak_rss_bytes"):
+        JOB_PEAK_RSS.set(report["peak_rss_bytes"], organize_mode=mode)
+    if report.get("rss_growth_bytes") is not None:
+        JOB_RSS_GROWTH.set(report["rss_growth_bytes"], organize_mode=mode)
+    for batch in report.get("batches") or ():
+        OPENAI_REQUESTS.inc(outcome="ok" if batch.get("ok") else "failed")
+        opened = batch.get("connections_opened", 0)
+        if opened:
+            OPENAI_CONNECTIONS.inc(opened)
+        if batch.get("latency_ms") is not None:
+            OPENAI_LATENCY.observe(batch["latency_ms"] / 1000.0, connection="new" if opened else "reused")
+        if batch.get("retries"):
+            OPENAI_RETRIES.inc(batch["retries"])
+        for kind in ("prompt", "completion"):
+            if batch.get(f"{kind}_tokens"):
+                OPENAI_TOKENS.inc(batch[f"{kind}_tokens"], kind=kind)
+
+
+def submit_job(job_id, *args, priority='normal', **kwargs):
+    """Queue process_job; it starts once a slot is free and nothing of higher priority is waiting."""
+    SCHEDULER.submit(job_id, *args, priority=priority, **kwargs)
+
+
+def _job_key_token(job_id):
+    return f"job:{job_id}"
+
+
+def hold_job_key(job_id, key_token):
+    """
+    Keep the encrypted key behind ``key_token`` for ``job_id`` until the job
+    starts, however long it queues. Workers get only the job id and decrypt
+    the key themselves, so the plaintext key is never pickled into a worker
+    process. Returns False if the token has expired.
+    """
+    rec = KEY_STORE.get(key_token)
+    if rec is None:
+        return False
+    KEY_STORE[_job_key_token(job_id)] = {'enc_key': rec['enc_key'], 'exp': int(time()) + JOB_TTL_SECONDS}
+    return True
+
+
+def take_job_key(job_id, keep=False):
+    """The key held for ``job_id`` (removed from the store unless ``keep``), or None."""
+    token = _job_key_token(job_id)
+    rec = KEY_STORE.get(token) if keep else KEY_STORE.pop(token, None)
+    if rec is None or is_token_expired(rec):
+        return None
+    try:
+        return FERNET.decrypt(rec['enc_key']).decode()
+    except InvalidToken:
+        return None
+
+
+def check_job_control(job_id):
+    """
+    Called by a running job between units of work: returns at once normally,
+    blocks while the job is paused and raises JobCancelled once it has been
+    cancelled. Works across processes, since it only reads the job record.
+    """
+    paused = False
+    while True:
+        job = JOBS.get(job_id, include_result=False)
+        if job is None:
+            raise JobCancelled()
+        control = job.get('control')
+        if control == 'cancel':
+            raise JobCancelled()
+        if control != 'pause':
+            if paused:
+                JOBS.update(job_id, status='processing', message='Resuming…')
+                logger.info("[JOB %s] Resumed", job_id)
+            return
+        if not paused:
+            paused = True
+            JOBS.update(job_id, status='paused', message='Paused')
+            logger.info("[JOB %s] Paused", job_id)
+            continue
+        JOBS.wait_for_update(job_id, job.get('version'), timeout=PAUSE_POLL_SECONDS)
+
+
+def cancel_job(job_id):
+    """Cancel a queued job right away, or ask a running (or paused) one to stop at its next check."""
+    args = SCHEDULER.remove(job_id)
+    if args is None:
+        JOBS.update(job_id, control='cancel')
+        SCHEDULER.batches.wake()  # a bulk job waiting on its batch is cancelled by the poller
+        return
+    JOBS.update(job_id, status='cancelled', control=None, queue_position=None, message='Cancelled')
+    logger.info("[JOB %s] Cancelled while queued", job_id)
+    KEY_STORE.pop(_job_key_token(job_id), None)
+    _remove_temp(job_id, args[1])
+
+
+def pause_job(job_id):
+    JOBS.update(job_id, control='pause')
+
+
+def resume_job(job_id):
+    JOBS.update(job_id, control=None)
+
+
+def _checked(stream, job_id):
+    for i, conv in enumerate(stream):
+        if i % CONTROL_CHECK_EVERY == 0:
+            check_job_control(job_id)
+        yield conv
+
+
+def _remove_temp(job_id, temp_path):
+    try:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+            logger.debug("[JOB %s] Cleaned up temp file", job_id)
+    except Exception as e:
+        logger.warning("[JOB %s] Failed to clean temp file: %s", job_id, e)
 
 def set_job_progress(job_id, processed, total, message="Processing..."):
-    job = JOBS.get(job_id)
-    if not job:
+    total = max(int(total), 1)
+    pct = int(round((processed / total) * 100))
+    if not JOBS.update(job_id, processed=int(processed), total=total,
+                       progress=max(0, min(100, pct)), message=message):
         return
-    job['processed'] = int(processed)
-    job['total'] = max(int(total), 1)
-    pct = int(round((processed / job['total']) * 100))
-    job['progress'] = max(0, min(100, pct))
-    job['message'] = message
-    print(f"[JOB {job_id}] Progress: {processed}/{total} ({pct}%) - {message}")
+    logger.info("[JOB %s] Progress: %s/%s (%s%%) - %s", job_id, processed, total, pct, message,
+                extra={"throttle": f"progress:{job_id}"})
+
+BULK_PHASE_MESSAGES = {
+    'preparing': "Preparing batch file…",
+    'submitting': "Submitting batch…",
+    'remote': "Waiting for OpenAI batch…",
+    'ingesting': "Reading batch results…",
+}
+
+def set_job_phase(job_id, phase, info=None):
+    """Record a bulk job's phase, and the remote batch's status and request counts, for /api/progress."""
+    message = BULK_PHASE_MESSAGES.get(phase, "Categorizing…")
+    if phase == 'remote' and info:
+        message = f"OpenAI batch {info.get('status')}: {info.get('completed', 0)}/{info.get('requests', 0)} requests"
+    JOBS.update(job_id, phase=phase, remote=info or None, message=message)
+    logger.info("[JOB %s] %s", job_id, message, extra={"throttle": f"phase:{job_id}:{phase}"})
+    return message
 
 def finish_job(job_id, result=None, error=None):
-    job = JOBS.get(job_id)
-    if not job:
-        return
     if error:
-        job['status'] = 'error'
-        job['error'] = str(error)
-        job['message'] = 'Failed'
-        print(f"[JOB {job_id}] FAILED: {error}")
+        if JOBS.update(job_id, status='error', error=str(error), message='Failed'):
+            logger.error("[JOB %s] FAILED: %s", job_id, error)
     else:
-        job['status'] = 'done'
-        job['result'] = result
-        job['progress'] = 100
-        job['message'] = 'Completed'
-        print(f"[JOB {job_id}] COMPLETED")
+        try:
+            # Index before flipping to 'done' so the query API never sees a finished job without one.
+            build_index(job_id, result)
+        except Exception as e:
+            logger.warning("[JOB %s] Indexing failed (will rebuild on demand): %s", job_id, e)
+        if JOBS.update(job_id, status='done', result=result, progress=100, message='Completed'):
+            logger.info("[JOB %s] COMPLETED", job_id)
+
+def process_job(job_id, api_key, temp_path, organize_mode, *args, profile=False, **kwargs):
+    """
+    Run a job. Returns a small report (duration, peak memory, per-request
+    API stats) for observe_job, which runs in the process that queued it.
+    With ``profile`` the job's thread is sampled and the profile saved
+    under the job id.
+    """
+    configure_logging()
+    started = perf_counter()
+    report = {"organize_mode": organize_mode}
+    sampler = StackSampler().start() if profile else None
+    rss = RssSampler().start()
+    try:
+        _run_job(job_id, api_key, temp_path, organize_mode, *args, report=report, **kwargs)
+    finally:
+        rss.stop()
+        if sampler is not None:
+            sampler.stop()
+            try:
+                save_profile(job_id, sampler)
+                JOBS.update(job_id, profile=True)
+            except OSError as e:
+                logger.warning("[JOB %s] Could not save profile: %s", job_id, e)
+    job = JOBS.get(job_id, include_result=False) or {}
+    report.update(duration=perf_counter() - started, status=job.get('status'), peak_rss_bytes=rss.peak_bytes,
+                  rss_growth_bytes=rss.growth_bytes)
+    return report
 
-def process_job(job_id, api_key, temp_path, organize_mode, custom_categories, batch_size, max_concurrency):
+def _run_job(job_id, api_key, temp_path, organize_mode, custom_categories, batch_size, max_concurrency,
+             previous_result=None, token_budget=None, key_token=None, report=None, bulk=False, parked=None):
+    report = {} if report is None else report
+    resources = ExitStack()
+    checkpoint = None
+    waiting = False
     try:
-        print(f"[JOB {job_id}] Starting job - Mode: {organize_mode}")
-        with open(temp_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        conversations = data if isinstance(data, list) else [data]
-        total = len(conversations)
-        set_job_progress(job_id, 0, total, "Preparing…")
-
-        if organize_mode in ("month", "year"):
-            time_periods = group_conversations_by_date(conversations, mode=organize_mode)
-            result = {
-                "summary": {
-                    "total_conversations": total,
-                    "total_groups": len(time_periods),
-                    "generated_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    "organize_mode": organize_mode
-                },
-                "time_periods": time_periods
-            }
+        JOBS.update(job_id, status='processing', queue_position=None, message='Starting…')
+        check_job_control(job_id)
+        logger.info("[JOB %s] Starting job - Mode: %s", job_id, organize_mode)
+        known = known_update_times(previous_result) if previous_result is not None else None
+        changes = None
+
+        def conversations():
+            stream = _checked(iter_conversations(temp_path), job_id)
+            return changes(stream) if changes else stream
+
+        if organize_mode in GRANULARITIES:
+            # Single streaming pass: the grouper only keeps compact conv_info.
+            set_job_progress(job_id, 0, 1, "Preparing…")
+            if known is not None:
+                changes = ChangeFilter(known)
+            time_periods = group_conversations_by_date(conversations(), mode=organize_mode)
+            if changes:
+                time_periods = merge_time_periods(previous_result['time_periods'], time_periods,
+                                                  changes.changed_ids, organize_mode)
+            result = time_result(time_periods, organize_mode)
+            total = result["summary"]["total_conversations"]
+            if changes:
+                result["summary"]["incremental"] = changes.summary()
             set_job_progress(job_id, total, total, "Finalizing…")
             finish_job(job_id, result=result)
             return
 
-        categorizer = ChatGPTCategorizer(api_key=api_key)
+        if organize_mode == 'cluster':
+            # Offline: no API key, no cache, no incremental merge (cluster labels aren't stable).
+            total = count_conversations(temp_path)
+            set_job_progress(job_id, 0, total, "Preparing…")
+            stats = {}
+            categorized = ConversationClusterer().cluster(
+                conversations(),
+                progress_cb=lambda processed, _: set_job_progress(job_id, processed, total, "Clustering…"),
+                total=total, stats=stats)
+            result = cluster_result(categorized, stats)
+            set_job_progress(job_id, total, total, "Finalizing…")
+            finish_job(job_id, result=result)
+            return
+
+        if api_key is None:
+            api_key = take_job_key(job_id)
+            if api_key is None:
+                raise ValueError("The API key for this job is no longer available. Please re-enter your key.")
+        # Jobs under the same key token share one pooled, keep-alive client.
+        client = resources.enter_context(CLIENTS.lease(key_token, api_key)) if key_token else None
+        # Bulk jobs send every model batch as one Batch API job instead of one request each.
+        categorizer_cls = BulkCategorizer if bulk else ChatGPTCategorizer
+        categorizer = categorizer_cls(api_key=api_key, client=client)
+        if parked is not None:
+            # Back from waiting on its batch: the export was read (and removed) before.
+            total = parked['total']
+            if known is not None:
+                changes = ChangeFilter(known, categorizer.format_timestamp)
+                changes.restore(parked['changes'])
+        elif known is not None:
+            # Count only the delta so progress (and spend) track what is re-run.
+            counter = ChangeFilter(known, categorizer.format_timestamp)
+            total = sum(1 for _ in counter(iter_conversations(temp_path)))
+            changes = ChangeFilter(known, categorizer.format_timestamp)
+        else:
+            total = count_conversations(temp_path)
+        if parked is None:
+            set_job_progress(job_id, 0, total, "Preparing…")
+
+        phase = {'message': "Categorizing…"}
 
         def progress_cb(processed, total_hint):
-            set_job_progress(job_id, processed, total or total_hint or 1, "Categorizing…")
+            set_job_progress(job_id, processed, total or total_hint or 1, phase['message'])
 
         import inspect
-        sig = inspect.signature(categorizer.process_export)
+        sig = inspect.signature(categorizer.process_conversations)
         params = sig.parameters
         kwargs = {'custom_categories': custom_categories, 'batch_size': batch_size}
         if 'max_concurrency' in params:
             kwargs['max_concurrency'] = max_concurrency
         if 'progress_cb' in params:
             kwargs['progress_cb'] = progress_cb
+        if 'total' in params:
+            kwargs['total'] = total
+        stats = {}
+        if 'cache' in params:
+            kwargs['cache'] = get_label_cache()
+            kwargs['stats'] = stats
+        if 'token_budget' in params:
+            kwargs['token_budget'] = token_budget
+        if 'control_cb' in params:
+            kwargs['control_cb'] = lambda: check_job_control(job_id)
+        if 'phase_cb' in params:
+            def phase_cb(name, info):
+                phase['message'] = set_job_phase(job_id, name, info)
+            kwargs['phase_cb'] = phase_cb
+        categories = custom_categories or categorizer.default_categories
+        if 'detach' in params:
+            # Give the slot back while the batch runs remotely (see BatchPoller).
+            kwargs['detach'] = True
+            kwargs['parked'] = parked
+        if 'checkpoint' in params and CHECKPOINTS_ENABLED:
+            key = parked['checkpoint_key'] if parked is not None else None
+            checkpoint = JobCheckpoint(key or checkpoint_key(file_sha256(temp_path), categories, known),
+                                       job_id=job_id)
+            kwargs['checkpoint'] = checkpoint
+            if checkpoint.labels:
+                logger.info("[JOB %s] Resuming from checkpoint: %s conversations in %s batches",
+                            job_id, len(checkpoint.labels), checkpoint.batches)
+        if 'preclassifier' in params and PRECLASSIFIER_ENABLED and parked is None:
+            cache = kwargs.get('cache')
+            model = NaiveBayesModel.from_cache(cache, categories) if cache is not None else None
+            kwargs['preclassifier'] = Preclassifier(categories, model=model)
 
-        categorized = categorizer.process_export(temp_path, **kwargs)
-        result = {
-            "summary": {
-                "total_conversations": total,
-                "total_categories": len(categorized),
-                "generated_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "organize_mode": organize_mode
-            },
-            "categories": categorized
-        }
+        categorized = categorizer.process_conversations(conversations() if parked is None else (), **kwargs)
+        report.update(batches=stats.get("batches", []), parse_seconds=stats.get("parse_seconds"))
+        if changes:
+            categorized = merge_categories(previous_result['categories'], categorized, changes.changed_ids)
+        result = category_result(categorized, stats, total)
+        if checkpoint is not None:
+            result["summary"]["checkpoint"] = dict(checkpoint.summary(), resumed=stats.get("resumed", 0))
+        if changes:
+            result["summary"]["incremental"] = changes.summary()
         set_job_progress(job_id, total, total, "Finalizing…")
         finish_job(job_id, result=result)
+        if checkpoint is not None:
+            checkpoint.discard()
+            checkpoint = None
+    except BatchPending as e:
+        # Hold the key for the poller and the second run, for as long as the batch may take.
+        KEY_STORE[_job_key_token(job_id)] = {'enc_key': FERNET.encrypt(api_key.encode()),
+                                             'exp': int(time()) + BULK_COMPLETION_WINDOW_SECONDS + JOB_TTL_SECONDS}
+        parked = dict(e.state, total=total, changes=changes.state() if changes else None,
+                      checkpoint_key=checkpoint.key if checkpoint is not None else None)
+        waiting = JOBS.update(job_id, status='waiting', parked=parked)
+        logger.info("[JOB %s] Waiting for batch %s without a worker", job_id, parked['batch_id'])
+    except JobCancelled:
+        if JOBS.update(job_id, status='cancelled', control=None, message='Cancelled'):
+            logger.info("[JOB %s] CANCELLED", job_id)
     except Exception as e:
         error_msg = f"{str(e)}\n{traceback.format_exc()}"
-        print(f"[JOB {job_id}] ERROR: {error_msg}")
+        logger.error("[JOB %s] ERROR: %s", job_id, error_msg)
         finish_job(job_id, error=error_msg)
     finally:
-        try:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-                print(f"[JOB {job_id}] Cleaned up temp file")
-        except Exception as e:
-            print(f"[JOB {job_id}] Failed to clean temp file: {e}")
+        resources.close()
+        if not waiting:
+            KEY_STORE.pop(_job_key_token(job_id), None)
+            if parked is not None:
+                # Normally gone already; not if the job failed before reading the batch.
+                shutil.rmtree(parked['workdir'], ignore_errors=True)
+        if checkpoint is not None:
+            # Kept on disk: running the same export again resumes from it.
+            checkpoint.close()
+        _remove_temp(job_id, temp_path)
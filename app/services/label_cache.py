@@ -0,0 +1,205 @@
+"""
+Persistent, content-addressed cache of category labels.
+
+A label is keyed by (conversation id, update_time, hash of the summary sent to
+the model, category list), so an unchanged conversation in a fresh export maps
+to the same key and never needs another model call. Entries are evicted by age
+and, beyond ``max_entries``, least-recently-used first.
+
+The same database keeps aggregated (label, hashed term) counts from every
+model-labelled summary, which the pre-classifier's naive Bayes model is
+trained on (see preclassifier.py). Only counts are stored, never the text.
+Counts for a label are dropped once no cached entry carries that label, and
+every change to the counts bumps ``generation`` so trained models can be
+reused until then.
+
+The labels are still users' data: the database (and its -wal/-shm files)
+is created 0600, by default in the private ``instance/`` directory.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from time import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ..utils.private_files import INSTANCE_DIR, private_file, private_parent
+
+DEFAULT_CACHE_PATH = os.getenv("LABEL_CACHE_PATH", os.path.join(INSTANCE_DIR, "label_cache.sqlite3"))
+DEFAULT_MAX_ENTRIES = int(os.getenv("LABEL_CACHE_MAX_ENTRIES", "500000"))
+DEFAULT_MAX_AGE_SECONDS = int(os.getenv("LABEL_CACHE_MAX_AGE_SECONDS", str(90 * 24 * 3600)))
+
+# SQLite caps bound parameters per statement; stay well under it.
+_LOOKUP_CHUNK = 500
+
+
+class LabelCache:
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_age_seconds: int = DEFAULT_MAX_AGE_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            # SQLite gives the -wal and -shm files the database file's permissions.
+            private_file(private_parent(path, INSTANCE_DIR))
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS labels ("
+            " key TEXT PRIMARY KEY,"
+            " label TEXT NOT NULL,"
+            " created_at INTEGER NOT NULL,"
+            " accessed_at INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS labels_accessed ON labels(accessed_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS labels_label ON labels(label)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS term_counts ("
+            " label TEXT NOT NULL,"
+            " feature INTEGER NOT NULL,"
+            " count INTEGER NOT NULL,"
+            " PRIMARY KEY (label, feature))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS label_docs ("
+            " label TEXT PRIMARY KEY,"
+            " docs INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    @staticmethod
+    def make_key(conv_id, update_time, summary: str, categories: List[str]) -> str:
+        summary_hash = hashlib.sha256(summary.encode("utf-8")).hexdigest()
+        raw = json.dumps([str(conv_id), update_time, summary_hash, list(categories)], separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        keys = list(keys)
+        now = int(time())
+        min_created = now - self.max_age_seconds
+        found: Dict[str, str] = {}
+        with self._lock:
+            for i in range(0, len(keys), _LOOKUP_CHUNK):
+                chunk = keys[i:i + _LOOKUP_CHUNK]
+                marks = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, label FROM labels WHERE key IN ({marks}) AND created_at >= ?",
+                    (*chunk, min_created),
+                ).fetchall()
+                found.update(rows)
+            if found:
+                hit = list(found)
+                for i in range(0, len(hit), _LOOKUP_CHUNK):
+                    chunk = hit[i:i + _LOOKUP_CHUNK]
+                    marks = ",".join("?" * len(chunk))
+                    self._conn.execute(f"UPDATE labels SET accessed_at = ? WHERE key IN ({marks})", (now, *chunk))
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, str]]) -> None:
+        now = int(time())
+        rows = [(k, label, now, now) for k, label in items]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT OR REPLACE INTO labels VALUES (?, ?, ?, ?)", rows)
+            self._conn.execute("COMMIT")
+            self._evict_locked(now)
+
+    def add_term_counts(self, samples: Iterable[Tuple[str, Dict[int, int]]]) -> None:
+        """Accumulate (label, {feature: count}) training samples."""
+        docs: Dict[str, int] = {}
+        counts: Dict[Tuple[str, int], int] = {}
+        for label, features in samples:
+            docs[label] = docs.get(label, 0) + 1
+            for feature, n in features.items():
+                counts[(label, feature)] = counts.get((label, feature), 0) + n
+        if not docs:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT INTO label_docs VALUES (?, ?)"
+                " ON CONFLICT(label) DO UPDATE SET docs = docs + excluded.docs",
+                docs.items(),
+            )
+            self._conn.executemany(
+                "INSERT INTO term_counts VALUES (?, ?, ?)"
+                " ON CONFLICT(label, feature) DO UPDATE SET count = count + excluded.count",
+                ((label, feature, n) for (label, feature), n in counts.items()),
+            )
+            self._bump_generation_locked()
+            self._conn.execute("COMMIT")
+
+    def term_counts(self, labels: Optional[Iterable[str]] = None
+                    ) -> Tuple[Dict[str, int], Dict[str, Dict[int, int]]]:
+        """({label: training docs}, {label: {feature: count}}), for ``labels`` only if given."""
+        with self._lock:
+            docs = dict(self._conn.execute("SELECT label, docs FROM label_docs").fetchall())
+            if labels is not None:
+                docs = {label: docs[label] for label in labels if label in docs}
+            counts: Dict[str, Dict[int, int]] = {}
+            for label in docs:
+                counts[label] = dict(self._conn.execute(
+                    "SELECT feature, count FROM term_counts WHERE label = ?", (label,)).fetchall())
+        return docs, counts
+
+    def generation(self) -> int:
+        """Changes whenever the term counts do (in any process sharing the file)."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return row[0] if row else 0
+
+    def _bump_generation_locked(self) -> None:
+        self._conn.execute("INSERT INTO meta VALUES ('generation', 1)"
+                           " ON CONFLICT(key) DO UPDATE SET value = value + 1")
+
+    def evict(self) -> None:
+        with self._lock:
+            self._evict_locked(int(time()))
+
+    def _evict_locked(self, now: int) -> None:
+        self._conn.execute("DELETE FROM labels WHERE created_at < ?", (now - self.max_age_seconds,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM labels").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM labels WHERE key IN (SELECT key FROM labels ORDER BY accessed_at LIMIT ?)",
+                (overflow,),
+            )
+        # Training counts only live as long as some cached entry still has their label.
+        orphans = [row[0] for row in self._conn.execute(
+            "SELECT label FROM label_docs WHERE NOT EXISTS"
+            " (SELECT 1 FROM labels WHERE labels.label = label_docs.label)")]
+        if orphans:
+            self._conn.execute("BEGIN")
+            for label in orphans:
+                self._conn.execute("DELETE FROM term_counts WHERE label = ?", (label,))
+                self._conn.execute("DELETE FROM label_docs WHERE label = ?", (label,))
+            self._bump_generation_locked()
+            self._conn.execute("COMMIT")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM labels").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_shared: Optional[LabelCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_label_cache() -> Optional[LabelCache]:
+    """Process-wide cache, or None when disabled with LABEL_CACHE_PATH=''."""
+    global _shared
+    if not DEFAULT_CACHE_PATH:
+        return None
+    with _shared_lock:
+        if _shared is None:
+            _shared = LabelCache(DEFAULT_CACHE_PATH)
+        return _shared
@@ -0,0 +1,150 @@
+"""
+Pooled OpenAI clients shared across batches and jobs.
+
+Every job used to build its own ``OpenAI`` client, so every job paid for
+fresh TCP and TLS handshakes. ``ClientRegistry`` keeps one client per
+registered key token, backed by a keep-alive httpx pool (HTTP/2 when the
+``h2`` package is installed), and hands it out through ``lease``. A
+client nobody has leased for ``KEY_TTL_SECONDS`` (the key token's own
+lifetime) is closed on the next lease or sweep.
+
+Connection reuse is counted with httpcore's ``trace`` extension. Each
+request also records how many connections the calling thread opened,
+so the categorizer can note new vs reused connections per batch.
+"""
+import hashlib
+import importlib.util
+import os
+import threading
+from contextlib import contextmanager
+from time import monotonic
+from typing import Dict, Iterator, Optional, Tuple
+
+import httpx
+from openai import OpenAI
+
+from .store import KEY_TTL_SECONDS
+
+OPENAI_POOL_MAX_CONNECTIONS = int(os.getenv("OPENAI_POOL_MAX_CONNECTIONS", "20"))
+OPENAI_POOL_MAX_KEEPALIVE = int(os.getenv("OPENAI_POOL_MAX_KEEPALIVE", "10"))
+OPENAI_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY_SECONDS", "60"))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "90"))
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+_local = threading.local()
+
+
+def connections_opened() -> int:
+    """Connections opened so far by the calling thread (take a difference around a request)."""
+    return getattr(_local, "opened", 0)
+
+
+class _Entry:
+    __slots__ = ("client", "http", "leases", "last_used", "stats")
+
+    def __init__(self, client, http):
+        self.client = client
+        self.http = http
+        self.leases = 0
+        self.last_used = monotonic()
+        self.stats = {"requests": 0, "connections_opened": 0, "tls_handshakes": 0}
+
+
+class ClientRegistry:
+    def __init__(self, ttl_seconds: float = KEY_TTL_SECONDS, base_url: Optional[str] = None,
+                 max_connections: int = OPENAI_POOL_MAX_CONNECTIONS,
+                 max_keepalive: int = OPENAI_POOL_MAX_KEEPALIVE,
+                 keepalive_expiry: float = OPENAI_KEEPALIVE_EXPIRY_SECONDS,
+                 http2: bool = HTTP2_AVAILABLE):
+        self.ttl_seconds = ttl_seconds
+        self.base_url = base_url
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                                   keepalive_expiry=keepalive_expiry)
+        self.http2 = http2
+        self._entries: Dict[Tuple[str, str], _Entry] = {}
+        self._lock = threading.Lock()
+        self._totals = {"requests": 0, "connections_opened": 0, "tls_handshakes": 0, "clients_closed": 0}
+
+    def _build(self, api_key: str) -> _Entry:
+        holder = {}
+
+        def trace(event, info):
+            entry = holder["entry"]
+            if event in ("http11.send_request_headers.started", "http2.send_request_headers.started"):
+                field = "requests"
+            elif event == "connection.connect_tcp.complete":
+                field = "connections_opened"
+                _local.opened = connections_opened() + 1
+            elif event == "connection.start_tls.complete":
+                field = "tls_handshakes"
+            else:
+                return
+            with self._lock:
+                entry.stats[field] += 1
+                self._totals[field] += 1
+
+        def add_trace(request):
+            request.extensions["trace"] = trace
+
+        http = httpx.Client(limits=self.limits, http2=self.http2, timeout=OPENAI_TIMEOUT_SECONDS,
+                            event_hooks={"request": [add_trace]})
+        client = OpenAI(api_key=api_key, base_url=self.base_url, http_client=http, max_retries=0,
+                        timeout=OPENAI_TIMEOUT_SECONDS)
+        holder["entry"] = entry = _Entry(client, http)
+        return entry
+
+    @contextmanager
+    def lease(self, key_token: str, api_key: str) -> Iterator[OpenAI]:
+        """The pooled client for ``key_token``; it won't be closed while leased."""
+        # Keyed by the key too, so a client is never handed to a different key.
+        slot = (key_token, hashlib.sha256(api_key.encode()).hexdigest())
+        stale = self._expired()
+        with self._lock:
+            entry = self._entries.get(slot)
+            if entry is None:
+                entry = self._entries[slot] = self._build(api_key)
+            entry.leases += 1
+            entry.last_used = monotonic()
+        self._close(stale)
+        try:
+            yield entry.client
+        finally:
+            with self._lock:
+                entry.leases -= 1
+                entry.last_used = monotonic()
+
+    def _expired(self):
+        """Pop entries idle past the TTL (under the lock); the caller closes them."""
+        cutoff = monotonic() - self.ttl_seconds
+        with self._lock:
+            tokens = [t for t, e in self._entries.items() if e.leases == 0 and e.last_used < cutoff]
+            return [self._entries.pop(t) for t in tokens]
+
+    def _close(self, entries) -> None:
+        for entry in entries:
+            entry.http.close()
+        if entries:
+            with self._lock:
+                self._totals["clients_closed"] += len(entries)
+
+    def sweep(self) -> int:
+        """Close the pools of tokens nobody has used for ``ttl_seconds``."""
+        stale = self._expired()
+        self._close(stale)
+        return len(stale)
+
+    def close_all(self) -> None:
+        with self._lock:
+            entries = [e for e in self._entries.values() if e.leases == 0]
+            self._entries = {t: e for t, e in self._entries.items() if e.leases}
+        self._close(entries)
+
+    def stats(self) -> dict:
+        """Totals since start plus live clients; ``reused_requests`` ran on an existing connection."""
+        with self._lock:
+            totals = dict(self._totals, clients=len(self._entries))
+        totals["reused_requests"] = max(0, totals["requests"] - totals["connections_opened"])
+        return totals
+
+
+CLIENTS = ClientRegistry()
@@ -0,0 +1,193 @@
+"""
+Local pre-classification in front of the model.
+
+Many conversations are obvious from their wording ("Python traceback in my
+Flask app" is Programming & Development). ``Preclassifier`` labels those
+locally and only the rest are batched for the model:
+
+  1. keyword/regex rules per category, scored on the summary with title
+     hits counting double; a category wins only with enough hits and a clear
+     margin over the runner-up;
+  2. optionally, a multinomial naive Bayes model over hashed terms, trained
+     on labels the model assigned in earlier jobs (counts kept in the label
+     cache); its answer is used only above ``min_confidence``.
+
+Anything still ambiguous returns None and goes to the model as before.
+"""
+import math
+import os
+import re
+import threading
+import weakref
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from .conversation import STOPWORDS, tokenize
+
+PRECLASSIFIER_ENABLED = os.getenv("PRECLASSIFIER_ENABLED", "1").lower() not in ("0", "false", "no", "")
+PRECLASSIFIER_MIN_CONFIDENCE = float(os.getenv("PRECLASSIFIER_MIN_CONFIDENCE", "0.97"))
+
+# Rules for the categorizer's default categories. Custom category lists only
+# get rules for names that match exactly.
+DEFAULT_RULES: Dict[str, List[str]] = {
+    'Programming & Development': [
+        r"\bpython\b", r"\b(?:java|type)script\b", r"\bsql\b", r"traceback|stack ?trace|segfault",
+        r"\b(?:def|class|import|function)\s+\w+\s*[(:]", r"\b(?:react|flask|django|node\.?js|docker|kubernetes)\b",
+        r"\bgit (?:merge|rebase|branch|commit|push)\b", r"\bcompil(?:e|er|ing)\b", r"\brefactor", r"```",
+    ],
+    'Data Science & ML': [
+        r"\b(?:pandas|numpy|scikit-learn|sklearn|tensorflow|pytorch|keras)\b", r"\bneural net(?:work)?s?\b",
+        r"\b(?:regression|classifier|clustering|embeddings?|gradient descent)\b",
+        r"\b(?:machine|deep) learning\b", r"\bdataset\b", r"\b(?:training|test) (?:set|data)\b",
+    ],
+    'Writing & Content Creation': [
+        r"\b(?:essay|blog post|article|newsletter|headline|copywriting|proofread)\b",
+        r"\b(?:rewrite|paraphrase)\b", r"\b(?:first|rough) draft\b", r"\bcover copy\b",
+    ],
+    'Learning & Education': [
+        r"\b(?:homework|exam|quiz|lecture|syllabus|theorem)\b", r"\bexplain (?:like|to me|the concept)\b",
+        r"\bstudy (?:guide|plan)\b",
+    ],
+    'Business & Strategy': [
+        r"\b(?:revenue|pricing|startup|investors?|go-to-market|business plan|churn|okrs?)\b",
+        r"\b(?:market|marketing|growth) strategy\b", r"\bcompetitors?\b",
+    ],
+    'Career & Professional': [
+        r"\b(?:resume|cv|cover letter|salary|linkedin)\b", r"\bjob (?:interview|offer|search|application)\b",
+        r"\bpromotion\b",
+    ],
+    'Technical Support': [
+        r"\b(?:printer|wi-?fi|router|bluetooth|driver)\b", r"\bwon'?t (?:start|boot|turn on|connect)\b",
+        r"\breset (?:my )?password\b", r"\btroubleshoot",
+    ],
+    'Personal Advice': [
+        r"\b(?:relationship|girlfriend|boyfriend|breakup|anxious|anxiety|lonely)\b",
+        r"\b(?:stress|motivation|self-esteem)\b",
+    ],
+    'Creative & Design': [
+        r"\b(?:logo|poem|lyrics|illustration|colou?r palette|midjourney|figma)\b", r"\bshort story\b",
+    ],
+    'Research & Analysis': [
+        r"\bliterature review\b", r"\bcitations?\b", r"\b(?:pros and cons|comparative analysis)\b",
+        r"\bresearch (?:paper|question)\b",
+    ],
+}
+
+FEATURE_BUCKETS = 1 << 20
+# Trained models kept per label cache (one per category list).
+MODEL_CACHE_SIZE = 8
+
+_models: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_models_lock = threading.Lock()
+
+
+def features(summary: str) -> Dict[int, int]:
+    """Hashed term counts of a summary (the naive Bayes input)."""
+    counts: Dict[int, int] = {}
+    for term in tokenize(summary):
+        if len(term) < 2 or term in STOPWORDS:
+            continue
+        f = zlib.crc32(term.encode("utf-8")) & (FEATURE_BUCKETS - 1)
+        counts[f] = counts.get(f, 0) + 1
+    return counts
+
+
+class NaiveBayesModel:
+    """Multinomial naive Bayes with add-one smoothing over hashed terms."""
+
+    min_docs_per_label = 20
+
+    def __init__(self, docs: Dict[str, int], counts: Dict[str, Dict[int, int]], categories: List[str]):
+        self.labels = [c for c in categories if docs.get(c, 0) >= self.min_docs_per_label]
+        total_docs = sum(docs[c] for c in self.labels) or 1
+        vocab = set()
+        for c in self.labels:
+            vocab.update(counts.get(c, {}))
+        self.log_prior: Dict[str, float] = {}
+        self.log_prob: Dict[str, Dict[int, float]] = {}
+        self.log_unseen: Dict[str, float] = {}
+        for c in self.labels:
+            terms = counts.get(c, {})
+            denom = sum(terms.values()) + len(vocab) + 1
+            self.log_prior[c] = math.log(docs[c] / total_docs)
+            self.log_prob[c] = {f: math.log((n + 1) / denom) for f, n in terms.items()}
+            self.log_unseen[c] = math.log(1 / denom)
+
+    @classmethod
+    def from_cache(cls, cache, categories: List[str]) -> Optional["NaiveBayesModel"]:
+        """
+        Model over ``categories`` from the cache's counts, or None if too few
+        are trained. Trained models are kept per cache and category list until
+        the cache's counts change, so jobs don't reload every count.
+        """
+        key = tuple(categories)
+        generation = cache.generation()
+        with _models_lock:
+            models = _models.setdefault(cache, OrderedDict())
+            hit = models.get(key)
+            if hit is not None and hit[0] == generation:
+                models.move_to_end(key)
+                return hit[1]
+        docs, counts = cache.term_counts(categories)
+        model = cls(docs, counts, categories)
+        model = model if len(model.labels) >= 2 else None
+        with _models_lock:
+            models[key] = (generation, model)
+            models.move_to_end(key)
+            while len(models) > MODEL_CACHE_SIZE:
+                models.popitem(last=False)
+        return model
+
+    def predict(self, feats: Dict[int, int]) -> Tuple[Optional[str], float]:
+        """(best label, posterior probability)."""
+        if not feats:
+            return None, 0.0
+        scores = {}
+        for c in self.labels:
+            probs, unseen = self.log_prob[c], self.log_unseen[c]
+            scores[c] = self.log_prior[c] + sum(n * probs.get(f, unseen) for f, n in feats.items())
+        best = max(scores, key=scores.get)
+        top = scores[best]
+        return best, 1.0 / sum(math.exp(s - top) for s in scores.values())
+
+
+class Preclassifier:
+    """Label confident cases locally; ``classify`` returns None for the rest."""
+
+    min_rule_score = 3
+    rule_margin = 2.0
+
+    def __init__(self, categories: List[str], rules: Optional[Dict[str, List[str]]] = None,
+                 model: Optional[NaiveBayesModel] = None, min_confidence: float = PRECLASSIFIER_MIN_CONFIDENCE):
+        rules = DEFAULT_RULES if rules is None else rules
+        self.rules = {c: re.compile("|".join(f"(?:{p})" for p in patterns), re.IGNORECASE)
+                      for c, patterns in rules.items() if c in categories}
+        self.model = model
+        self.min_confidence = min_confidence
+        self.by_rules = 0
+        self.by_model = 0
+
+    def _rule_label(self, summary: str) -> Optional[str]:
+        title, _, body = summary.partition("\n")
+        scores = sorted(((2 * len(rx.findall(title)) + len(rx.findall(body)), c) for c, rx in self.rules.items()),
+                        reverse=True)
+        if not scores or scores[0][0] < self.min_rule_score:
+            return None
+        runner_up = scores[1][0] if len(scores) > 1 else 0
+        return scores[0][1] if scores[0][0] >= self.rule_margin * runner_up else None
+
+    def classify(self, summary: str) -> Optional[str]:
+        label = self._rule_label(summary)
+        if label:
+            self.by_rules += 1
+            return label
+        if self.model is not None:
+            label, confidence = self.model.predict(features(summary))
+            if label and confidence >= self.min_confidence:
+                self.by_model += 1
+                return label
+        return None
+
+    def summary(self) -> dict:
+        return {"rules": self.by_rules, "model": self.by_model}
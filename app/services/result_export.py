@@ -0,0 +1,154 @@
+"""
+Streamed result downloads.
+
+Exports are generated row by row from the job's result index (see
+result_index.py), so even a very large result is never assembled as one
+document, and are compressed on the fly:
+
+  - ``json``: the same nested document as ``/api/result/<job_id>``
+  - ``ndjson``: one conversation per line, with its category / period
+  - ``csv``: one conversation per row
+
+gzip always works; zstd needs the optional ``zstandard`` package.
+"""
+import csv
+import io
+import json
+import zlib
+from typing import Iterable, Iterator, Optional
+
+from .result_index import iter_rows, read_meta
+from ..utils import codec
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+FORMATS = {
+    "json": ("application/json", "json"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+}
+CSV_FIELDS = ("id", "title", "category", "period", "create_time", "update_time", "message_count")
+
+# Hand compressors at least this much text at a time.
+_CHUNK_CHARS = 64 * 1024
+
+
+def available_encodings():
+    return ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+
+def choose_encoding(requested: Optional[str], accept_encoding: str) -> Optional[str]:
+    """
+    Pick the Content-Encoding: an explicit ``requested`` ("gzip", "zstd" or
+    "none") wins, otherwise the best of ours the client accepts. Raises
+    ValueError for an unknown or unavailable encoding.
+    """
+    if requested:
+        if requested == "none":
+            return None
+        if requested not in available_encodings():
+            raise ValueError(f"Unsupported compression: {requested}")
+        return requested
+    accepted = {part.split(";")[0].strip().lower() for part in (accept_encoding or "").split(",")}
+    for encoding in available_encodings():
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+def _buffered(parts: Iterable[str]) -> Iterator[bytes]:
+    buf, size = [], 0
+    for part in parts:
+        buf.append(part)
+        size += len(part)
+        if size >= _CHUNK_CHARS:
+            yield "".join(buf).encode("utf-8")
+            buf, size = [], 0
+    if buf:
+        yield "".join(buf).encode("utf-8")
+
+
+def compress(chunks: Iterable[bytes], encoding: Optional[str]) -> Iterator[bytes]:
+    if encoding is None:
+        yield from chunks
+        return
+    if encoding == "gzip":
+        comp = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    else:
+        comp = zstandard.ZstdCompressor(level=3).compressobj()
+    for chunk in chunks:
+        out = comp.compress(chunk)
+        if out:
+            yield out
+    yield comp.flush()
+
+
+def iter_ndjson(path: str) -> Iterator[str]:
+    for category, period, data in iter_rows(path):
+        conv = codec.loads(data)
+        conv.setdefault("category", category)
+        if period is not None:
+            conv["period"] = period
+        yield codec.dumps_str(conv) + "\n"
+
+
+# Leading characters a spreadsheet would read as the start of a formula.
+_FORMULA_LEAD = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _csv_cell(value):
+    """Text cells that would run as a formula get a leading quote, so they open as text."""
+    if isinstance(value, str) and value.startswith(_FORMULA_LEAD):
+        return "'" + value
+    return value
+
+
+def iter_csv(path: str) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(CSV_FIELDS)
+    for category, period, data in iter_rows(path):
+        conv = codec.loads(data)
+        writer.writerow([_csv_cell(v) for v in (
+            conv.get("id", ""), conv.get("title", ""), category, period or "",
+            conv.get("create_time", ""), conv.get("update_time", ""), conv.get("message_count", ""))])
+        if buf.tell() >= _CHUNK_CHARS:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def iter_json(path: str) -> Iterator[str]:
+    """The nested result document, written group by group (rows are stored grouped)."""
+    meta = read_meta(path)
+    nested = meta["layout"] == "time_periods"
+    yield '{"summary":' + json.dumps(meta["summary"]) + ',"' + meta["layout"] + '":{'
+    period = category = None
+    first_group = True
+    for row_category, row_period, data in iter_rows(path):
+        if first_group or row_period != period or row_category != category:
+            new_period = nested and (first_group or row_period != period)
+            if not first_group:
+                yield "]}" if new_period else "]"
+                yield ","
+            if new_period:
+                yield json.dumps(row_period) + ":{"
+            yield json.dumps(row_category) + ":["
+            period, category, first_group = row_period, row_category, False
+        else:
+            yield ","
+        yield data
+    if not first_group:
+        yield "]}" if nested else "]"
+    yield "}}"
+
+
+_WRITERS = {"json": iter_json, "ndjson": iter_ndjson, "csv": iter_csv}
+
+
+def stream_export(path: str, fmt: str, encoding: Optional[str]) -> Iterator[bytes]:
+    return compress(_buffered(_WRITERS[fmt](path)), encoding)
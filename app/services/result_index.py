@@ -0,0 +1,257 @@
+"""
+Queryable per-job index of a finished result.
+
+When a job finishes its conversations are written once to a small SQLite
+file: one row per conversation in display order (the order of the result
+JSON, with the conv_info as stored), b-tree indexes for the category /
+period / date filters and an FTS5 table over titles. The result's summary is
+kept alongside, so exports can be streamed from the index alone. Pages are then keyset-paginated on that order, so each
+request reads only the rows it returns no matter how large the export was.
+
+Index files live in ``RESULT_INDEX_DIR`` (shared by every process on the
+host, like the SQLite job backend) and are removed by ``sweep`` once they
+are older than the job TTL.
+"""
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+from time import time
+from typing import Iterator, List, Optional, Tuple
+
+from .store import JOB_TTL_SECONDS
+from ..utils import codec
+from ..utils.private_files import private_dir
+
+RESULT_INDEX_DIR = os.getenv("RESULT_INDEX_DIR", os.path.join(tempfile.gettempdir(), "chatgpt_organizer_index"))
+
+# Bumped whenever the schema changes; older index files are rebuilt on demand.
+INDEX_VERSION = 2
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+_FIELDS = ("id", "title", "category", "period", "create_time", "update_time", "message_count")
+_SEARCH_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_build_locks = {}
+_build_locks_lock = threading.Lock()
+
+
+def iter_result_rows(result: dict) -> Iterator[Tuple[str, Optional[str], dict]]:
+    """(category, period or None, conv_info) for every conversation, in display order."""
+    if isinstance(result.get('categories'), dict):
+        for category, convs in result['categories'].items():
+            for conv in convs:
+                yield category, None, conv
+    if isinstance(result.get('time_periods'), dict):
+        for period, buckets in result['time_periods'].items():
+            for bucket, convs in buckets.items():
+                for conv in convs:
+                    yield bucket, period, conv
+
+
+def index_path(job_id: str, index_dir: str = RESULT_INDEX_DIR) -> str:
+    return os.path.join(index_dir, f"{job_id}.sqlite3")
+
+
+def build_index(job_id: str, result: dict, index_dir: str = RESULT_INDEX_DIR) -> str:
+    """Write the index for ``result`` (atomically replacing any old one). Returns its path."""
+    private_dir(index_dir)
+    path = index_path(job_id, index_dir)
+    # mkstemp creates the file 0600.
+    fd, tmp = tempfile.mkstemp(prefix=f".{job_id}.", suffix=".tmp", dir=index_dir)
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(tmp)
+        try:
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(f"PRAGMA user_version={INDEX_VERSION}")
+            conn.execute(
+                "CREATE TABLE conversations ("
+                " pos INTEGER PRIMARY KEY,"
+                " id TEXT, title TEXT, category TEXT, period TEXT,"
+                " create_time TEXT, update_time TEXT, message_count INTEGER,"
+                " data TEXT NOT NULL)"
+            )
+            conn.executemany(
+                "INSERT INTO conversations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((pos, str(c.get('id', '')), str(c.get('title', '')), category, period,
+                  c.get('create_time', 'Unknown'), c.get('update_time', 'Unknown'), c.get('message_count'),
+                  codec.dumps_str(c))
+                 for pos, (category, period, c) in enumerate(iter_result_rows(result))),
+            )
+            conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+                ('summary', json.dumps(result.get('summary', {}))),
+                ('layout', 'time_periods' if isinstance(result.get('time_periods'), dict) else 'categories'),
+            ])
+            conn.execute("CREATE INDEX conversations_category ON conversations(category, pos)")
+            conn.execute("CREATE INDEX conversations_period ON conversations(period, pos)")
+            conn.execute("CREATE INDEX conversations_created ON conversations(create_time)")
+            conn.execute(
+                "CREATE VIRTUAL TABLE titles USING fts5("
+                " title, content='conversations', content_rowid='pos', tokenize='unicode61 remove_diacritics 2')"
+            )
+            conn.execute("INSERT INTO titles(rowid, title) SELECT pos, title FROM conversations")
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return path
+
+
+def _is_current(path: str) -> bool:
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            return conn.execute("PRAGMA user_version").fetchone()[0] == INDEX_VERSION
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+
+
+def ensure_index(job_id: str, load_result, index_dir: str = RESULT_INDEX_DIR) -> Optional[str]:
+    """
+    Path of the job's index, building it from ``load_result()`` if missing
+    or built by an older version. None if there is no result.
+    """
+    path = index_path(job_id, index_dir)
+    if os.path.exists(path) and _is_current(path):
+        return path
+    with _build_locks_lock:
+        lock = _build_locks.setdefault(job_id, threading.Lock())
+    with lock:
+        try:
+            if os.path.exists(path) and _is_current(path):
+                return path
+            result = load_result()
+            if result is None:
+                return None
+            return build_index(job_id, result, index_dir)
+        finally:
+            with _build_locks_lock:
+                _build_locks.pop(job_id, None)
+
+
+def _match_expression(q: str) -> Optional[str]:
+    # Quote every token (so FTS syntax in user input is inert) and prefix-match it.
+    tokens = _SEARCH_TOKEN_RE.findall(q)
+    return " ".join(f'"{t}"*' for t in tokens) or None
+
+
+def query_conversations(path: str, cursor: Optional[int] = None, limit: int = DEFAULT_PAGE_SIZE,
+                        category: Optional[str] = None, period: Optional[str] = None,
+                        since: Optional[str] = None, until: Optional[str] = None,
+                        q: Optional[str] = None) -> dict:
+    """
+    One page of conversations in display order, after ``cursor``.
+
+    ``since`` / ``until`` are inclusive prefixes of "%Y-%m-%d %H:%M"
+    (e.g. "2024-01" or "2024-01-31"). The first page (no cursor) also
+    carries the total number of matches.
+    """
+    limit = max(1, min(MAX_PAGE_SIZE, int(limit)))
+    where: List[str] = []
+    params: list = []
+    if cursor is not None:
+        where.append("c.pos > ?")
+        params.append(int(cursor))
+    if category is not None:
+        where.append("c.category = ?")
+        params.append(category)
+    if period is not None:
+        where.append("c.period = ?")
+        params.append(period)
+    if since:
+        where.append("c.create_time >= ? AND c.create_time != 'Unknown'")
+        params.append(since)
+    if until:
+        # "2024-01-31" must include every minute of that day.
+        where.append("c.create_time <= ? AND c.create_time != 'Unknown'")
+        params.append(until + "\uffff")
+    source = "conversations c"
+    if q:
+        match = _match_expression(q)
+        if match is None:
+            return {"conversations": [], "next_cursor": None, "total": 0}
+        source = "titles JOIN conversations c ON c.pos = titles.rowid"
+        where.append("titles MATCH ?")
+        params.append(match)
+    clause = f" WHERE {' AND '.join(where)}" if where else ""
+
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            f"SELECT c.pos, {', '.join('c.' + f for f in _FIELDS)} FROM {source}{clause}"
+            f" ORDER BY c.pos LIMIT ?",
+            (*params, limit + 1),
+        ).fetchall()
+        page = {
+            "conversations": [dict(zip(_FIELDS, row[1:])) for row in rows[:limit]],
+            "next_cursor": str(rows[limit - 1][0]) if len(rows) > limit else None,
+        }
+        if cursor is None:
+            page["total"] = conn.execute(f"SELECT COUNT(*) FROM {source}{clause}", params).fetchone()[0]
+        return page
+    finally:
+        conn.close()
+
+
+def read_meta(path: str) -> dict:
+    """{"summary": dict, "layout": "categories" | "time_periods"} of an index."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+    finally:
+        conn.close()
+    return {"summary": json.loads(meta.get('summary', '{}')), "layout": meta.get('layout', 'categories')}
+
+
+def iter_rows(path: str, batch_rows: int = 1000) -> Iterator[Tuple[str, Optional[str], str]]:
+    """(category, period, conv_info JSON) for every row in display order, read in batches."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        cur = conn.execute("SELECT category, period, data FROM conversations ORDER BY pos")
+        while True:
+            rows = cur.fetchmany(batch_rows)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        conn.close()
+
+
+def drop_index(job_id: str, index_dir: str = RESULT_INDEX_DIR) -> None:
+    try:
+        os.remove(index_path(job_id, index_dir))
+    except OSError:
+        pass
+
+
+def sweep(max_age_seconds: int = JOB_TTL_SECONDS, index_dir: str = RESULT_INDEX_DIR) -> int:
+    """Remove index files older than ``max_age_seconds`` (their jobs have expired)."""
+    cutoff = time() - max_age_seconds
+    removed = 0
+    try:
+        names = os.listdir(index_dir)
+    except OSError:
+        return 0
+    for name in names:
+        path = os.path.join(index_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
@@ -0,0 +1,72 @@
+"""
+The result documents a finished organize run produces, shared by jobs and
+the CLI so both report the same summary fields.
+
+Kept free of the categorizer and the OpenAI SDK: the builders only take
+the grouped conversations and the stats a run collected.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+def count_conversations_in(result_part: dict, nested: bool) -> int:
+    if nested:
+        return sum(len(convs) for buckets in result_part.values() for convs in buckets.values())
+    return sum(len(convs) for convs in result_part.values())
+
+
+def _generated_at() -> str:
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def time_result(time_periods: Dict[str, Dict[str, List[dict]]], organize_mode: str) -> dict:
+    return {
+        "summary": {
+            "total_conversations": count_conversations_in(time_periods, nested=True),
+            "total_groups": len(time_periods),
+            "generated_at": _generated_at(),
+            "organize_mode": organize_mode
+        },
+        "time_periods": time_periods
+    }
+
+
+def cluster_result(categorized: Dict[str, List[dict]], stats: dict) -> dict:
+    return {
+        "summary": {
+            "total_conversations": count_conversations_in(categorized, nested=False),
+            "total_categories": len(categorized),
+            "generated_at": _generated_at(),
+            "organize_mode": "cluster",
+            "clustering": stats
+        },
+        "categories": categorized
+    }
+
+
+def category_result(categorized: Dict[str, List[dict]], stats: dict, total: Optional[int] = None) -> dict:
+    """
+    ``stats`` as filled in by ``process_conversations``; ``total`` is how many
+    conversations were run (defaults to those in ``categorized``).
+    """
+    if total is None:
+        total = count_conversations_in(categorized, nested=False)
+    summary = {
+        "total_conversations": count_conversations_in(categorized, nested=False),
+        "total_categories": len(categorized),
+        "generated_at": _generated_at(),
+        "organize_mode": "category",
+        "cache": {
+            "hits": stats.get("cache_hits", 0),
+            "misses": stats.get("cache_misses", total)
+        },
+        "usage": stats.get("usage", {}),
+        "batches": stats.get("batches", [])
+    }
+    if 'preclassified' in stats:
+        local = stats['preclassified']
+        summary["preclassified"] = dict(
+            local, fraction=round((local['rules'] + local['model']) / total, 4) if total else 0.0)
+    if 'bulk' in stats:
+        summary["bulk"] = stats['bulk']
+    return {"summary": summary, "categories": categorized}
@@ -1,10 +1,509 @@
-from time import time
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+from time import sleep, time
+
+from ..utils import codec
+from ..utils.private_files import open_private, private_dir, private_file, private_parent
 
-# In-memory stores
-KEY_STORE = {}  # token -> { enc_key: bytes, exp: int }
 KEY_TTL_SECONDS = 600  # 10 minute
 
-JOBS = {}       # job_id -> { status, progress, total, processed, message, result, error }
+# Finished jobs (and their results) are dropped this long after completion.
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", str(6 * 3600)))
+# Completed results above this many (serialized) bytes in total are spilled to disk.
+JOB_MAX_RESIDENT_BYTES = int(os.getenv("JOB_MAX_RESIDENT_BYTES", str(256 * 1024 * 1024)))
+JOB_SPILL_DIR = os.getenv("JOB_SPILL_DIR", os.path.join(tempfile.gettempdir(), "chatgpt_organizer_jobs"))
+SWEEP_INTERVAL_SECONDS = int(os.getenv("SWEEP_INTERVAL_SECONDS", "60"))
+# "memory" (single process) or "sqlite" (shared by every worker process on the host).
+JOB_BACKEND = os.getenv("JOB_BACKEND", "memory")
+# Holds every job's result: defaults to the (private) spill directory.
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(JOB_SPILL_DIR, "jobs.sqlite3"))
+
+FINISHED_STATUSES = ('done', 'error', 'cancelled')
+# Jobs that ended like this are never handed out again for an identical request.
+UNUSABLE_STATUSES = ('error', 'cancelled')
+
+logger = logging.getLogger(__name__)
+
 
 def is_token_expired(rec):
     return rec.get("exp", 0) < int(time())
+
+
+def _reusable(rec, max_age):
+    """Can an identical request attach to this job? (in flight, or finished well within ``max_age``)"""
+    if rec is None or rec.get('status') in UNUSABLE_STATUSES:
+        return False
+    if rec.get('status') == 'done' and max_age is not None:
+        return rec.get('finished_at', 0) >= time() - max_age
+    return True
+
+
+class KeyStore:
+    """token -> { enc_key: bytes, exp: int }, with expiry enforced on read and by sweep()."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def __setitem__(self, tok, rec):
+        with self._lock:
+            self._data[tok] = rec
+
+    def get(self, tok, default=None):
+        with self._lock:
+            rec = self._data.get(tok)
+            if rec is not None and is_token_expired(rec):
+                del self._data[tok]
+                return default
+            return rec if rec is not None else default
+
+    def pop(self, tok, default=None):
+        with self._lock:
+            return self._data.pop(tok, default)
+
+    def __contains__(self, tok):
+        return self.get(tok) is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def sweep(self):
+        now = int(time())
+        with self._lock:
+            expired = [t for t, rec in self._data.items() if rec.get("exp", 0) < now]
+            for t in expired:
+                del self._data[t]
+        return len(expired)
+
+
+class JobStore:
+    """
+    Thread-safe job registry: job_id -> { status, progress, total, processed, message, result, error }.
+
+    Job metadata stays in memory. Completed results are kept resident up to
+    ``max_resident_bytes`` (least recently used first out); beyond that they
+    are written gzip-compressed to ``spill_dir`` and read back on demand.
+    Finished jobs expire ``ttl_seconds`` after completion.
+
+    ``get`` returns a copy; mutate through ``update`` so writes from worker
+    threads happen under the lock.
+    """
+
+    shared = False  # visible to other processes?
+
+    def __init__(self, max_resident_bytes=JOB_MAX_RESIDENT_BYTES, spill_dir=JOB_SPILL_DIR,
+                 ttl_seconds=JOB_TTL_SECONDS):
+        self.max_resident_bytes = max_resident_bytes
+        self.spill_dir = spill_dir
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._jobs = {}
+        self._resident = OrderedDict()  # job_id -> (result, size)
+        self._resident_bytes = 0
+        self._spilled = {}  # job_id -> path
+        self._keys = {}  # dedupe key -> job_id
+
+    # ----- dict-like surface used by the routes -----
+    def __setitem__(self, job_id, record):
+        record = dict(record)
+        result = record.pop('result', None)
+        record.setdefault('created_at', time())
+        record['version'] = 0
+        with self._lock:
+            self._drop_result(job_id)
+            self._jobs[job_id] = record
+            if result is not None:
+                self._store_result(job_id, result)
+            self._changed.notify_all()
+
+    def get(self, job_id, default=None, include_result=True):
+        with self._lock:
+            rec = self._jobs.get(job_id)
+            if rec is None:
+                return default
+            out = dict(rec)
+            out['result'] = self._load_result(job_id) if include_result else None
+            return out
+
+    def __contains__(self, job_id):
+        with self._lock:
+            return job_id in self._jobs
+
+    def __len__(self):
+        with self._lock:
+            return len(self._jobs)
+
+    def pop(self, job_id, default=None):
+        with self._lock:
+            rec = self.get(job_id)
+            if rec is None:
+                return default
+            del self._jobs[job_id]
+            self._drop_result(job_id)
+            return rec
+
+    def update(self, job_id, **fields):
+        """Apply ``fields`` to a job atomically. Returns False for unknown jobs."""
+        with self._lock:
+            rec = self._jobs.get(job_id)
+            if rec is None:
+                return False
+            if 'result' in fields:
+                result = fields.pop('result')
+                self._drop_result(job_id)
+                if result is not None:
+                    self._store_result(job_id, result)
+            rec.update(fields)
+            if rec.get('status') in FINISHED_STATUSES:
+                rec.setdefault('finished_at', time())
+            rec['version'] = rec.get('version', 0) + 1
+            self._changed.notify_all()
+            return True
+
+    def attach(self, key, job_id, max_age=None):
+        """
+        Single-flight: make ``job_id`` the job for ``key`` unless another job
+        already holds it and is still usable (queued, running, or done less
+        than ``max_age`` seconds ago). Returns the job id that holds ``key``.
+        """
+        with self._lock:
+            holder = self._keys.get(key)
+            if holder is not None and holder != job_id and _reusable(self._jobs.get(holder), max_age):
+                return holder
+            self._keys[key] = job_id
+            return job_id
+
+    def wait_for_update(self, job_id, version, timeout):
+        """
+        Block until the job's version differs from ``version`` (or ``timeout``
+        elapses) and return a result-less snapshot; None for unknown jobs.
+        """
+        with self._changed:
+            self._changed.wait_for(
+                lambda: self._jobs.get(job_id, {}).get('version') != version, timeout=timeout)
+            return self.get(job_id, include_result=False)
+
+    # ----- results -----
+    def _store_result(self, job_id, result):
+        raw = codec.dumps(result)
+        self._resident[job_id] = (result, len(raw))
+        self._resident_bytes += len(raw)
+        while self._resident_bytes > self.max_resident_bytes and len(self._resident) > 1:
+            old_id, _ = next(iter(self._resident.items()))
+            self._spill(old_id)
+        if self._resident_bytes > self.max_resident_bytes:
+            # A single result larger than the whole budget goes straight to disk.
+            self._spill(job_id, raw)
+
+    def _spill(self, job_id, raw=None):
+        result, size = self._resident.pop(job_id)
+        self._resident_bytes -= size
+        if raw is None:
+            raw = codec.dumps(result)
+        path = os.path.join(private_dir(self.spill_dir), f"{job_id}.json.gz")
+        with open_private(path) as fh, gzip.GzipFile(fileobj=fh, mode='wb', compresslevel=5) as f:
+            f.write(raw)
+        self._spilled[job_id] = path
+
+    def _load_result(self, job_id):
+        hit = self._resident.get(job_id)
+        if hit is not None:
+            self._resident.move_to_end(job_id)
+            return hit[0]
+        path = self._spilled.get(job_id)
+        if path is None:
+            return None
+        with gzip.open(path, 'rb') as f:
+            return codec.loads(f.read())
+
+    def _drop_result(self, job_id):
+        hit = self._resident.pop(job_id, None)
+        if hit is not None:
+            self._resident_bytes -= hit[1]
+        path = self._spilled.pop(job_id, None)
+        if path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def is_spilled(self, job_id):
+        with self._lock:
+            return job_id in self._spilled
+
+    @property
+    def resident_bytes(self):
+        with self._lock:
+            return self._resident_bytes
+
+    # ----- expiry -----
+    def sweep(self):
+        cutoff = time() - self.ttl_seconds
+        with self._lock:
+            expired = [jid for jid, rec in self._jobs.items()
+                       if rec.get('status') in FINISHED_STATUSES and rec.get('finished_at', 0) < cutoff]
+            for jid in expired:
+                del self._jobs[jid]
+                self._drop_result(jid)
+            self._keys = {k: jid for k, jid in self._keys.items() if jid in self._jobs}
+        return len(expired)
+
+
+class _SQLiteFile:
+    """A SQLite file shared by every process on the host, readable by this user only."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        private_parent(path, JOB_SPILL_DIR)
+        # SQLite gives the -wal and -shm files the database file's permissions.
+        private_file(path)
+
+    def _conn(self):
+        # One connection per thread and per process (connections must not cross a fork).
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+class SQLiteKeyStore(_SQLiteFile):
+    """
+    ``KeyStore`` in the job database, so a token registered through one
+    worker process resolves in every other. Records hold the Fernet-encrypted
+    key exactly as the API stored it; the plaintext never reaches the file.
+    """
+
+    def __init__(self, path=JOB_DB_PATH):
+        super().__init__(path)
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS key_tokens"
+                         " (token TEXT PRIMARY KEY, enc_key BLOB NOT NULL, exp INTEGER NOT NULL)")
+
+    def __setitem__(self, tok, rec):
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO key_tokens (token, enc_key, exp) VALUES (?, ?, ?)",
+                         (tok, rec['enc_key'], rec['exp']))
+
+    def get(self, tok, default=None):
+        row = self._conn().execute("SELECT enc_key, exp FROM key_tokens WHERE token = ?", (tok,)).fetchone()
+        if row is None:
+            return default
+        rec = {'enc_key': bytes(row[0]), 'exp': row[1]}
+        if is_token_expired(rec):
+            self.pop(tok)
+            return default
+        return rec
+
+    def pop(self, tok, default=None):
+        with self._conn() as conn:
+            row = conn.execute("SELECT enc_key, exp FROM key_tokens WHERE token = ?", (tok,)).fetchone()
+            conn.execute("DELETE FROM key_tokens WHERE token = ?", (tok,))
+        return {'enc_key': bytes(row[0]), 'exp': row[1]} if row is not None else default
+
+    def __contains__(self, tok):
+        return self.get(tok) is not None
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM key_tokens").fetchone()[0]
+
+    def sweep(self):
+        with self._conn() as conn:
+            return conn.execute("DELETE FROM key_tokens WHERE exp < ?", (int(time()),)).rowcount
+
+
+class SQLiteJobStore(_SQLiteFile):
+    """
+    Job registry in a SQLite file, so every process on the host (gunicorn
+    workers, job worker processes) sees the same jobs.
+
+    Same surface as ``JobStore``. Results are stored gzip-compressed in a
+    separate table and only decoded when ``get`` asks for them.
+    """
+
+    shared = True
+
+    def __init__(self, path=JOB_DB_PATH, ttl_seconds=JOB_TTL_SECONDS):
+        super().__init__(path)
+        self.ttl_seconds = ttl_seconds
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY,"
+                " record TEXT NOT NULL,"
+                " status TEXT,"
+                " finished_at REAL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS results (job_id TEXT PRIMARY KEY, data BLOB NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS job_keys (key TEXT PRIMARY KEY, job_id TEXT NOT NULL)")
+
+    @staticmethod
+    def _pack(result):
+        return gzip.compress(codec.dumps(result), compresslevel=5)
+
+    @staticmethod
+    def _unpack(blob):
+        return codec.loads(gzip.decompress(blob))
+
+    def __setitem__(self, job_id, record):
+        record = dict(record)
+        result = record.pop('result', None)
+        record.setdefault('created_at', time())
+        record['version'] = 0
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?)",
+                         (job_id, json.dumps(record), record.get('status'), record.get('finished_at')))
+            conn.execute("DELETE FROM results WHERE job_id = ?", (job_id,))
+            if result is not None:
+                conn.execute("INSERT INTO results VALUES (?, ?)", (job_id, self._pack(result)))
+
+    def get(self, job_id, default=None, include_result=True):
+        conn = self._conn()
+        row = conn.execute("SELECT record FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return default
+        out = json.loads(row[0])
+        out['result'] = None
+        if include_result:
+            res = conn.execute("SELECT data FROM results WHERE job_id = ?", (job_id,)).fetchone()
+            if res is not None:
+                out['result'] = self._unpack(res[0])
+        return out
+
+    def __contains__(self, job_id):
+        return self._conn().execute("SELECT 1 FROM jobs WHERE job_id = ?", (job_id,)).fetchone() is not None
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def pop(self, job_id, default=None):
+        rec = self.get(job_id)
+        if rec is None:
+            return default
+        with self._conn() as conn:
+            conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM results WHERE job_id = ?", (job_id,))
+        return rec
+
+    def update(self, job_id, **fields):
+        """Apply ``fields`` to a job atomically (across processes). Returns False for unknown jobs."""
+        # Compress outside the write transaction to keep it short.
+        blob = None
+        has_result = 'result' in fields
+        if has_result:
+            result = fields.pop('result')
+            blob = self._pack(result) if result is not None else None
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT record FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return False
+            rec = json.loads(row[0])
+            rec.update(fields)
+            if rec.get('status') in FINISHED_STATUSES:
+                rec.setdefault('finished_at', time())
+            rec['version'] = rec.get('version', 0) + 1
+            conn.execute("UPDATE jobs SET record = ?, status = ?, finished_at = ? WHERE job_id = ?",
+                         (json.dumps(rec), rec.get('status'), rec.get('finished_at'), job_id))
+            if has_result:
+                conn.execute("DELETE FROM results WHERE job_id = ?", (job_id,))
+                if blob is not None:
+                    conn.execute("INSERT INTO results VALUES (?, ?)", (job_id, blob))
+        return True
+
+    def attach(self, key, job_id, max_age=None):
+        """Like ``JobStore.attach``; atomic across processes."""
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT job_id FROM job_keys WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[0] != job_id:
+                held = conn.execute("SELECT record FROM jobs WHERE job_id = ?", (row[0],)).fetchone()
+                if _reusable(json.loads(held[0]) if held else None, max_age):
+                    return row[0]
+            conn.execute("INSERT OR REPLACE INTO job_keys VALUES (?, ?)", (key, job_id))
+        return job_id
+
+    def wait_for_update(self, job_id, version, timeout, poll_interval=0.2):
+        """Like ``JobStore.wait_for_update``; polls, since writers may be other processes."""
+        deadline = time() + timeout
+        while True:
+            job = self.get(job_id, include_result=False)
+            if job is None or job.get('version') != version or time() >= deadline:
+                return job
+            sleep(min(poll_interval, max(0.0, deadline - time())))
+
+    def sweep(self):
+        cutoff = time() - self.ttl_seconds
+        marks = ",".join("?" * len(FINISHED_STATUSES))
+        with self._conn() as conn:
+            expired = [r[0] for r in conn.execute(
+                f"SELECT job_id FROM jobs WHERE status IN ({marks}) AND finished_at < ?",
+                (*FINISHED_STATUSES, cutoff)).fetchall()]
+            for jid in expired:
+                conn.execute("DELETE FROM jobs WHERE job_id = ?", (jid,))
+                conn.execute("DELETE FROM results WHERE job_id = ?", (jid,))
+            conn.execute("DELETE FROM job_keys WHERE job_id NOT IN (SELECT job_id FROM jobs)")
+        return len(expired)
+
+
+def make_job_store(backend=JOB_BACKEND):
+    """Build the configured job store. Both kinds expose the same dict-like surface."""
+    if backend == "sqlite":
+        return SQLiteJobStore()
+    if backend != "memory":
+        raise ValueError(f"Unknown JOB_BACKEND: {backend!r}")
+    return JobStore()
+
+
+def make_key_store(backend=JOB_BACKEND):
+    """Key tokens must resolve in every process that can serve a request, like jobs."""
+    return SQLiteKeyStore() if backend == "sqlite" else KeyStore()
+
+
+# Shared stores
+KEY_STORE = make_key_store()
+JOBS = make_job_store()
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def start_sweeper(interval=SWEEP_INTERVAL_SECONDS):
+    """Start (once per process) a daemon thread that expires jobs and key tokens."""
+    global _sweeper
+    with _sweeper_lock:
+        if _sweeper is not None and _sweeper.is_alive():
+            return _sweeper
+        def loop():
+            while True:
+                sleep(interval)
+                try:
+                    from . import checkpoints, openai_clients, result_index, uploads
+                    from ..utils import profiler
+                    JOBS.sweep()
+                    KEY_STORE.sweep()
+                    result_index.sweep()
+                    uploads.UPLOADS.sweep()
+                    checkpoints.sweep()
+                    openai_clients.CLIENTS.sweep()
+                    profiler.sweep(JOB_TTL_SECONDS)
+                except Exception as e:
+                    logger.warning("[SWEEPER] error: %s", e)
+
+        _sweeper = threading.Thread(target=loop, name="store-sweeper", daemon=True)
+        _sweeper.start()
+        return _sweeper
@@ -1,12 +1,10 @@
-from datetime import datetime
+from datetime import date, datetime
+
+from .conversation import parse_conversation
 
 def format_timestamp(timestamp):
-    if timestamp:
-        try:
-            return datetime.fromtimestamp(float(timestamp)).strftime('%Y-%m-%d %H:%M')
-        except:
-            return "Unknown"
-    return "Unknown"
+    dt = _local_datetime(timestamp)
+    return _format_dt(dt) if dt else "Unknown"
 
 def pretty_month(dt_str: str) -> str:
     try:
@@ -30,53 +28,111 @@ def extract_messages_from_mapping(mapping):
                 messages.append(msg_data['message'])
     return messages
 
+# Granularity -> (bucket key from a local datetime, label for a bucket key).
+# Keys are integers that order chronologically, so periods and conversations
+# are sorted numerically once instead of formatting and re-parsing strings.
+def _week_start(dt):
+    return dt.toordinal() - dt.weekday()
+
+GRANULARITIES = {
+    "day": (lambda dt: dt.toordinal(),
+            lambda k: date.fromordinal(k).strftime('%Y-%m-%d')),
+    "week": (_week_start,
+             lambda k: f"Week of {date.fromordinal(k).strftime('%Y-%m-%d')}"),
+    "month": (lambda dt: dt.year * 12 + dt.month - 1,
+              lambda k: date(k // 12, k % 12 + 1, 1).strftime('%B %Y')),
+    "quarter": (lambda dt: dt.year * 4 + (dt.month - 1) // 3,
+                lambda k: f"Q{k % 4 + 1} {k // 4}"),
+    "year": (lambda dt: dt.year,
+             lambda k: date(k, 1, 1).strftime('%Y')),
+}
+
+_UNKNOWN_KEY = -1
+
+def _local_datetime(timestamp):
+    if not timestamp:
+        return None
+    try:
+        return datetime.fromtimestamp(float(timestamp))
+    except Exception:
+        return None
+
+def _format_dt(dt) -> str:
+    if dt.year >= 1000:
+        return f"{dt.year}-{dt.month:02d}-{dt.day:02d} {dt.hour:02d}:{dt.minute:02d}"
+    return dt.strftime('%Y-%m-%d %H:%M')
+
+def _minute_key(dt) -> int:
+    # Local wall-clock minute, matching the old sort on the formatted string.
+    return (((dt.toordinal() * 24) + dt.hour) * 60) + dt.minute
+
 def group_conversations_by_date(conversations, mode="month"):
-    result = {}
+    """
+    Group conversations into {period_label: {"All": [conv_info, ...]}}, newest
+    period first and newest conversation first within each period.
+
+    ``mode`` is one of GRANULARITIES ("day", "week", "month", "quarter",
+    "year"); anything else groups by month. ``conversations`` may be any
+    iterable (e.g. export_reader.iter_conversations); only the compact
+    conv_info dicts are kept, never the mappings.
+    """
+    bucket_key, bucket_label = GRANULARITIES.get(mode, GRANULARITIES["month"])
+    buckets = {}  # int key -> [(minute_key, seq, info)]
+    seq = 0
     for conv in conversations:
-        mapping = conv.get('mapping', {}) or {}
-        messages = extract_messages_from_mapping(mapping)
-        create_time = conv.get('create_time')
-        date_str = format_timestamp(create_time)
+        record = parse_conversation(conv, head_size=0)
+        dt = _local_datetime(record.create_time)
         info = {
-            "title": conv.get('title', 'Untitled'),
-            "id": conv.get('id', 'unknown'),
-            "create_time": date_str,
-            "update_time": format_timestamp(conv.get('update_time')),
-            "message_count": len(messages)
+            "title": record.title,
+            "id": record.id,
+            "create_time": _format_dt(dt) if dt else "Unknown",
+            "update_time": format_timestamp(record.update_time),
+            "message_count": record.message_count
         }
-        period = year_only(date_str) if mode == "year" else pretty_month(date_str)
-        result.setdefault(period, {}).setdefault("All", []).append(info)
-
-    # Sort the outer keys (month/year buckets)
-    from datetime import datetime
-
-    def _period_sort_key(p: str, mode: str):
-        if p == 'Unknown':
-            return datetime.min
-        try:
-            if mode == "year":
-                return datetime.strptime(p, "%Y")
-            # mode == "month"
-            return datetime.strptime(p, "%B %Y")
-        except Exception:
-            return datetime.min
-
-    ordered = {}
-    for period in sorted(result.keys(), key=lambda p: _period_sort_key(p, mode), reverse=True):
-        ordered[period] = result[period]
-    result = ordered
-
-    # Sort conversations within each bucket
-    for period in result:
-        for category in result[period]:
-            result[period][category] = sorted(
-                result[period][category],
-                key=lambda c: datetime.strptime(c['create_time'], '%Y-%m-%d %H:%M')
-                if c['create_time'] != 'Unknown' else datetime.min,
-                reverse=True
-            )
+        if dt is None:
+            key, minute = _UNKNOWN_KEY, _UNKNOWN_KEY
+        else:
+            key, minute = bucket_key(dt), _minute_key(dt)
+        # -seq keeps input order among equal times under a descending sort.
+        buckets.setdefault(key, []).append((minute, -seq, info))
+        seq += 1
 
+    result = {}
+    for key in sorted(buckets, reverse=True):
+        label = 'Unknown' if key == _UNKNOWN_KEY else bucket_label(key)
+        entries = buckets[key]
+        entries.sort(key=lambda e: (e[0], e[1]), reverse=True)
+        result[label] = {"All": [info for _, _, info in entries]}
     return result
 
+def _label_sort_key(p: str, mode: str):
+    if p == 'Unknown':
+        return datetime.min
+    try:
+        if mode == "year":
+            return datetime.strptime(p, "%Y")
+        if mode == "day":
+            return datetime.strptime(p, "%Y-%m-%d")
+        if mode == "week":
+            return datetime.strptime(p, "Week of %Y-%m-%d")
+        if mode == "quarter":
+            q, year = p.split()
+            return datetime(int(year), (int(q[1:]) - 1) * 3 + 1, 1)
+        return datetime.strptime(p, "%B %Y")
+    except Exception:
+        return datetime.min
 
-    
\ No newline at end of file
+def sort_time_periods(result, mode="month"):
+    """
+    Order an existing {period: {bucket: [conv_info]}} structure newest first,
+    e.g. after merging (see incremental.py). Conversations compare on their
+    "%Y-%m-%d %H:%M" strings, which order chronologically as plain text.
+    """
+    ordered = {}
+    for period in sorted(result.keys(), key=lambda p: _label_sort_key(p, mode), reverse=True):
+        ordered[period] = {
+            category: sorted(convs, key=lambda c: '' if c['create_time'] == 'Unknown' else c['create_time'],
+                             reverse=True)
+            for category, convs in result[period].items()
+        }
+    return ordered
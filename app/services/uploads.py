@@ -0,0 +1,254 @@
+"""
+Chunked, resumable uploads for large exports.
+
+A client creates an upload session, appends the file in chunks at explicit
+byte offsets and finalizes it; the finished file can then be handed to
+``/api/categorize`` by id instead of being sent again as multipart. Chunks go
+straight to a ``.part`` file on disk, never into memory, and the session's
+state is that file plus a small JSON sidecar, so an interrupted upload can
+be resumed (from any worker process) by asking how many bytes arrived.
+Changes to an upload hold an exclusive ``flock`` on its ``.part`` file, so
+two workers can't both accept a chunk at the same offset.
+
+Exports may be uploaded as plain JSON, gzip or the ChatGPT export zip;
+export_reader reads all three.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+from time import time
+from typing import Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the per-process locks below apply
+    fcntl = None
+
+from .export_reader import detect_format
+from ..utils.private_files import open_private, private_dir
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "chatgpt_organizer_uploads"))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(4 * 1024 ** 3)))
+# Unfinished (or finalized but unused) uploads are removed after this long.
+UPLOAD_TTL_SECONDS = int(os.getenv("UPLOAD_TTL_SECONDS", str(24 * 3600)))
+
+RECOMMENDED_CHUNK_BYTES = 8 * 1024 * 1024
+_COPY_BYTES = 1 << 20
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """A request the upload can't accept; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int = 400, received: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+        self.received = received
+
+
+def _lock(upload_id: str) -> threading.Lock:
+    with _locks_lock:
+        return _locks.setdefault(upload_id, threading.Lock())
+
+
+def _forget(upload_id: str) -> None:
+    with _locks_lock:
+        _locks.pop(upload_id, None)
+
+
+class UploadStore:
+    def __init__(self, directory: str = UPLOAD_DIR, max_bytes: int = UPLOAD_MAX_BYTES,
+                 ttl_seconds: int = UPLOAD_TTL_SECONDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+    # ----- paths & metadata -----
+    def _paths(self, upload_id: str):
+        if not _ID_RE.match(upload_id or ""):
+            raise UploadError("Unknown upload id", 404)
+        base = os.path.join(self.directory, upload_id)
+        return base + ".json", base + ".part"
+
+    def _read_meta(self, upload_id: str) -> dict:
+        meta_path, _ = self._paths(upload_id)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UploadError("Unknown upload id", 404) from None
+
+    def _write_meta(self, upload_id: str, meta: dict) -> None:
+        meta_path, _ = self._paths(upload_id)
+        tmp = meta_path + ".tmp"
+        with open_private(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, meta_path)
+
+    def _status(self, upload_id: str, meta: dict) -> dict:
+        _, part_path = self._paths(upload_id)
+        received = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        return {
+            "upload_id": upload_id,
+            "received": received,
+            "size": meta.get("size"),
+            "finalized": meta.get("finalized", False),
+            "sha256": meta.get("sha256"),
+            "format": meta.get("format"),
+        }
+
+    @contextmanager
+    def _locked(self, upload_id: str):
+        """Hold the upload against other threads and, through its .part file, other processes."""
+        _, part_path = self._paths(upload_id)
+        with _lock(upload_id):
+            try:
+                fd = os.open(part_path, os.O_RDONLY)
+            except FileNotFoundError:
+                # Nothing to append to; what follows reports the missing upload.
+                yield
+                return
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(fd)  # releases the flock
+
+    # ----- API -----
+    def create(self, filename: str = "", size: Optional[int] = None, sha256: Optional[str] = None) -> dict:
+        if size is not None and not (0 < size <= self.max_bytes):
+            raise UploadError(f"size must be between 1 and {self.max_bytes} bytes", 413 if size else 400)
+        if sha256 is not None and not _SHA256_RE.match(sha256):
+            raise UploadError("sha256 must be 64 lowercase hex characters")
+        private_dir(self.directory)
+        upload_id = uuid.uuid4().hex
+        _, part_path = self._paths(upload_id)
+        open_private(part_path).close()
+        meta = {"filename": str(filename)[:255], "size": size, "expected_sha256": sha256,
+                "created_at": time(), "finalized": False}
+        self._write_meta(upload_id, meta)
+        return dict(self._status(upload_id, meta), chunk_bytes=RECOMMENDED_CHUNK_BYTES)
+
+    def status(self, upload_id: str) -> dict:
+        return self._status(upload_id, self._read_meta(upload_id))
+
+    def append(self, upload_id: str, offset: int, stream, chunk_sha256: Optional[str] = None) -> dict:
+        """
+        Write ``stream`` at ``offset``, which must equal the bytes received so
+        far (so a retried or duplicated chunk can't corrupt the file). With
+        ``chunk_sha256`` the chunk is verified and rolled back on mismatch.
+        """
+        with self._locked(upload_id):
+            meta = self._read_meta(upload_id)
+            if meta.get("finalized"):
+                raise UploadError("Upload already finalized", 409)
+            _, part_path = self._paths(upload_id)
+            received = os.path.getsize(part_path)
+            if offset != received:
+                raise UploadError(f"Offset {offset} does not match {received} bytes received", 409, received)
+            limit = meta.get("size") or self.max_bytes
+            digest = hashlib.sha256()
+            written = 0
+            with open(part_path, "r+b") as f:
+                f.seek(offset)
+                try:
+                    while True:
+                        chunk = stream.read(_COPY_BYTES)
+                        if not chunk:
+                            break
+                        written += len(chunk)
+                        if offset + written > limit:
+                            raise UploadError(f"Upload exceeds {limit} bytes", 413, received)
+                        digest.update(chunk)
+                        f.write(chunk)
+                    if chunk_sha256 and digest.hexdigest() != chunk_sha256.lower():
+                        raise UploadError("Chunk checksum mismatch", 400, received)
+                except UploadError:
+                    # A rejected chunk is dropped whole. (A dropped connection keeps the
+                    # bytes that did arrive; the client resumes from status()["received"].)
+                    f.truncate(offset)
+                    raise
+            return self._status(upload_id, meta)
+
+    def finalize(self, upload_id: str, sha256: Optional[str] = None) -> dict:
+        with self._locked(upload_id):
+            meta = self._read_meta(upload_id)
+            if meta.get("finalized"):
+                return self._status(upload_id, meta)
+            _, part_path = self._paths(upload_id)
+            received = os.path.getsize(part_path)
+            if not received:
+                raise UploadError("Upload is empty")
+            if meta.get("size") is not None and received != meta["size"]:
+                raise UploadError(f"Received {received} of {meta['size']} bytes", 409, received)
+            digest = hashlib.sha256()
+            with open(part_path, "rb") as f:
+                for block in iter(lambda: f.read(_COPY_BYTES), b""):
+                    digest.update(block)
+            actual = digest.hexdigest()
+            expected = (sha256 or meta.get("expected_sha256") or "").lower()
+            if expected and actual != expected:
+                raise UploadError("Checksum mismatch", 400, received)
+            meta.update(finalized=True, sha256=actual, format=detect_format(part_path), finalized_at=time())
+            self._write_meta(upload_id, meta)
+            return self._status(upload_id, meta)
+
+    def claim(self, upload_id: str, dest_dir: Optional[str] = None) -> Tuple[str, str]:
+        """
+        Move a finalized upload's file out of the store and return its new
+        path and sha256; the caller owns (and deletes) the file. Each upload
+        can be claimed once.
+        """
+        with self._locked(upload_id):
+            meta = self._read_meta(upload_id)
+            if not meta.get("finalized"):
+                raise UploadError("Upload is not finalized", 409)
+            meta_path, part_path = self._paths(upload_id)
+            fd, dest = tempfile.mkstemp(suffix=".upload", dir=dest_dir or self.directory)
+            os.close(fd)
+            os.replace(part_path, dest)
+            os.remove(meta_path)
+        _forget(upload_id)
+        return dest, meta["sha256"]
+
+    def delete(self, upload_id: str) -> bool:
+        with self._locked(upload_id):
+            found = False
+            for path in self._paths(upload_id):
+                try:
+                    os.remove(path)
+                    found = True
+                except FileNotFoundError:
+                    pass
+        _forget(upload_id)
+        return found
+
+    def sweep(self) -> int:
+        cutoff = time() - self.ttl_seconds
+        removed = 0
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return 0
+        for name in names:
+            upload_id = name.split(".")[0]
+            if not name.endswith(".json") or not _ID_RE.match(upload_id):
+                continue
+            # Appends touch only the .part file, so an upload is idle when both are old.
+            mtimes = [os.path.getmtime(p) for p in self._paths(upload_id) if os.path.exists(p)]
+            if mtimes and max(mtimes) < cutoff and self.delete(upload_id):
+                removed += 1
+        return removed
+
+
+UPLOADS = UploadStore()
@@ -28,14 +28,30 @@ function showToast(msg, isError = false) {
   }, 3000);
 }
 
+const PERIOD_LABELS = {
+  day: 'DAYS',
+  week: 'WEEKS',
+  month: 'MONTHS',
+  quarter: 'QUARTERS',
+  year: 'YEARS'
+};
+
+// Files above this size are sent through the chunked upload API.
+const CHUNKED_UPLOAD_THRESHOLD = 32 * 1024 * 1024;
+
+// Modes whose result is a flat `categories` map rather than `time_periods`.
+const CATEGORY_MODES = ['category', 'cluster'];
+
 // ===== State Management =====
 const state = {
   currentKeyToken: null,
   organizeMode: 'category',
   pollTimer: null,
+  eventSource: null,
   conversationsData: null,
   completedConversations: new Set(),
-  currentJobId: null
+  currentJobId: null,
+  activeJobId: null
 };
 
 // ===== Progress Persistence =====
@@ -108,6 +124,39 @@ window.addEventListener('DOMContentLoaded', () => {
   const progressBar = $('overlayProgress');
   const progressLabel = $('overlayProgressLabel');
   const progressText = $('processingSubtext');
+  const jobControls = $('jobControls');
+  const pauseJobBtn = $('pauseJobBtn');
+  const cancelJobBtn = $('cancelJobBtn');
+
+  async function controlJob(action) {
+    if (!state.activeJobId) return null;
+    const r = await fetch(`/api/jobs/${state.activeJobId}/${action}`, { method: 'POST' });
+    const data = await r.json().catch(() => ({}));
+    if (!r.ok) {
+      showToast(data.error || `Could not ${action} job`, true);
+      return null;
+    }
+    return data;
+  }
+
+  pauseJobBtn?.addEventListener('click', async () => {
+    const resume = pauseJobBtn.dataset.paused === '1';
+    if (await controlJob(resume ? 'resume' : 'pause')) {
+      pauseJobBtn.dataset.paused = resume ? '' : '1';
+      pauseJobBtn.textContent = resume ? '⏸ Pause' : '▶ Resume';
+    }
+  });
+
+  cancelJobBtn?.addEventListener('click', () => controlJob('cancel'));
+
+  function showJobControls(show) {
+    if (!jobControls) return;
+    jobControls.style.display = show ? '' : 'none';
+    if (pauseJobBtn) {
+      pauseJobBtn.dataset.paused = '';
+      pauseJobBtn.textContent = '⏸ Pause';
+    }
+  }
 
   function setProgress(pct, msg) {
     const clampedPct = Math.max(0, Math.min(100, pct || 0));
@@ -147,17 +196,18 @@ window.addEventListener('DOMContentLoaded', () => {
     }
 
     // Cancel any existing job
-    if (state.pollTimer) {
-      clearInterval(state.pollTimer);
-      state.pollTimer = null;
-    }
+    stopProgressUpdates();
 
     overlay?.classList.add('show');
     setProgress(0, 'Starting…');
 
     try {
       const formData = new FormData();
-      formData.append('file', file);
+      if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+        formData.append('upload_id', await uploadInChunks(file, setProgress));
+      } else {
+        formData.append('file', file);
+      }
       formData.append('organize_mode', state.organizeMode);
       
       // Validate and clamp input values
@@ -166,6 +216,9 @@ window.addEventListener('DOMContentLoaded', () => {
       
       formData.append('batch_size', batchSize);
       formData.append('max_concurrency', concurrency);
+      if (state.organizeMode === 'category' && $('bulkInput')?.checked) {
+        formData.append('bulk', '1');
+      }
 
       const headers = (state.organizeMode === 'category' && state.currentKeyToken) 
         ? { 'X-Key-Token': state.currentKeyToken } 
@@ -183,9 +236,10 @@ window.addEventListener('DOMContentLoaded', () => {
       }
 
       const { job_id } = await startRes.json();
-      state.currentJobId = job_id;
+      state.activeJobId = job_id;
+      showJobControls(true);
 
-      await pollUntilDone(job_id, setProgress);
+      await waitUntilDone(job_id, setProgress);
 
       // Fetch final result
       const resultRes = await fetch(`/api/result/${job_id}`);
@@ -195,6 +249,7 @@ window.addEventListener('DOMContentLoaded', () => {
       }
 
       state.conversationsData = await resultRes.json();
+      state.currentJobId = job_id;
       loadProgress();
       renderDashboard();
       showToast('Processing complete!');
@@ -203,6 +258,8 @@ window.addEventListener('DOMContentLoaded', () => {
       console.error('File processing error:', err);
       showToast(err.message, true);
     } finally {
+      state.activeJobId = null;
+      showJobControls(false);
       setTimeout(() => {
         overlay?.classList.remove('show');
         setProgress(0);
@@ -210,6 +267,91 @@ window.addEventListener('DOMContentLoaded', () => {
     }
   }
 
+  // Large exports go up in chunks so a dropped connection resumes where it
+  // stopped instead of starting over.
+  async function uploadInChunks(file, onTick) {
+    const init = await fetch('/api/uploads', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ filename: file.name, size: file.size })
+    });
+    if (!init.ok) {
+      const e = await init.json().catch(() => ({}));
+      throw new Error(e.error || 'Failed to start upload');
+    }
+    const { upload_id: uploadId, chunk_bytes: chunkBytes } = await init.json();
+
+    let offset = 0;
+    let failures = 0;
+    while (offset < file.size) {
+      const chunk = file.slice(offset, offset + chunkBytes);
+      onTick(Math.floor((offset / file.size) * 100), `Uploading… ${Math.floor(offset / 1048576)} MB`);
+      try {
+        const headers = { 'Content-Type': 'application/octet-stream' };
+        if (window.crypto?.subtle) {
+          const digest = await crypto.subtle.digest('SHA-256', await chunk.arrayBuffer());
+          headers['X-Chunk-SHA256'] = Array.from(new Uint8Array(digest))
+            .map(b => b.toString(16).padStart(2, '0')).join('');
+        }
+        const r = await fetch(`/api/uploads/${uploadId}?offset=${offset}`, { method: 'PUT', headers, body: chunk });
+        if (!r.ok) throw new Error(`HTTP ${r.status}`);
+        offset = (await r.json()).received;
+        failures = 0;
+      } catch (err) {
+        if (++failures > 5) throw new Error(`Upload failed: ${err.message}`);
+        await new Promise(r => setTimeout(r, 1000 * failures));
+        // Ask the server how much it actually has and resume from there.
+        const status = await fetch(`/api/uploads/${uploadId}`).then(r => r.json()).catch(() => null);
+        if (status && typeof status.received === 'number') offset = status.received;
+      }
+    }
+
+    const fin = await fetch(`/api/uploads/${uploadId}/finalize`, { method: 'POST' });
+    if (!fin.ok) {
+      const e = await fin.json().catch(() => ({}));
+      throw new Error(e.error || 'Failed to finalize upload');
+    }
+    onTick(0, 'Starting…');
+    return uploadId;
+  }
+
+  // Prefer the server-sent progress stream; fall back to polling only if the
+  // stream can't be opened or drops before the job finishes.
+  function waitUntilDone(jobId, onTick) {
+    if (!window.EventSource) return pollUntilDone(jobId, onTick);
+
+    return new Promise((resolve, reject) => {
+      const es = new EventSource(`/api/progress/${jobId}/stream`);
+      state.eventSource = es;
+      let finished = false;
+
+      es.onmessage = (e) => {
+        let data;
+        try {
+          data = JSON.parse(e.data);
+        } catch (err) {
+          return;
+        }
+        onTick?.(data.progress || 0, data.message || '');
+
+        if (['done', 'error', 'cancelled'].includes(data.status)) {
+          finished = true;
+          stopProgressUpdates();
+          if (data.status === 'done') resolve();
+          else if (data.status === 'cancelled') reject(new Error('Job cancelled'));
+          else reject(new Error(data.error || 'Job failed'));
+        }
+      };
+
+      es.onerror = () => {
+        if (finished) return;
+        console.warn('Progress stream unavailable, falling back to polling');
+        stopProgressUpdates();
+        pollUntilDone(jobId, onTick).then(resolve, reject);
+      };
+    });
+  }
+
   async function pollUntilDone(jobId, onTick, maxRetries = 3) {
     let retries = 0;
     
@@ -228,10 +370,10 @@ window.addEventListener('DOMContentLoaded', () => {
             clearInterval(state.pollTimer);
             state.pollTimer = null;
             resolve();
-          } else if (data.status === 'error') {
+          } else if (data.status === 'error' || data.status === 'cancelled') {
             clearInterval(state.pollTimer);
             state.pollTimer = null;
-            reject(new Error(data.error || 'Job failed'));
+            reject(new Error(data.status === 'cancelled' ? 'Job cancelled' : (data.error || 'Job failed')));
           }
         } catch (e) {
           retries++;
@@ -248,13 +390,19 @@ window.addEventListener('DOMContentLoaded', () => {
   }
 });
 
-// Cleanup on page unload
-window.addEventListener('beforeunload', () => {
+function stopProgressUpdates() {
+  if (state.eventSource) {
+    state.eventSource.close();
+    state.eventSource = null;
+  }
   if (state.pollTimer) {
     clearInterval(state.pollTimer);
     state.pollTimer = null;
   }
-});
+}
+
+// Cleanup on page unload
+window.addEventListener('beforeunload', stopProgressUpdates);
 
 // ===== Data Utilities =====
 function toArrayMaybe(value) {
@@ -293,7 +441,7 @@ function renderDashboard() {
 
   const mode = state.conversationsData?.summary?.organize_mode || state.organizeMode || 'category';
 
-  if (mode === 'category') {
+  if (CATEGORY_MODES.includes(mode)) {
     renderCategoryMode(grid);
   } else {
     renderTimeMode(grid, mode);
@@ -344,7 +492,7 @@ function renderTimeMode(grid, mode) {
     }
   }
 
-  $('groupsLabel').textContent = (mode === 'month') ? 'MONTHS' : 'YEARS';
+  $('groupsLabel').textContent = PERIOD_LABELS[mode] || 'PERIODS';
 }
 
 function createCategoryCard(category, conversations) {
@@ -510,7 +658,7 @@ function updateStats() {
   let totalConvs = 0;
   let totalGroups = 0;
 
-  if (mode === 'category') {
+  if (CATEGORY_MODES.includes(mode)) {
     const categories = state.conversationsData?.categories || {};
     for (const conversations of Object.values(categories)) {
       totalConvs += toArrayMaybe(conversations).length;
@@ -529,7 +677,7 @@ function updateStats() {
     }
     
     totalGroups = Array.isArray(timePeriods) ? timePeriods.length : Object.keys(timePeriods).length;
-    $('groupsLabel').textContent = (mode === 'month') ? 'MONTHS' : 'YEARS';
+    $('groupsLabel').textContent = PERIOD_LABELS[mode] || 'PERIODS';
   }
 
   $('totalConvs').textContent = totalConvs;
@@ -572,10 +720,29 @@ function showPending() {
 
 // ===== Export & Reset =====
 function downloadJSON() {
+  downloadExport('json');
+}
+
+// Streamed, compressed download built by the server from the stored result.
+// Falls back to serializing in the browser when there is no server-side job
+// (e.g. it has expired or the page was reloaded from a saved result).
+function downloadExport(format) {
   if (!state.conversationsData) {
     return showToast('No data yet', true);
   }
 
+  if (state.currentJobId) {
+    const a = document.createElement('a');
+    a.href = `/api/result/${encodeURIComponent(state.currentJobId)}/export?format=${format}`;
+    a.download = `categorized_chats.${format}`;
+    a.click();
+    showToast(`${format.toUpperCase()} download started`);
+    return;
+  }
+
+  if (format !== 'json') {
+    return showToast('This export is no longer available on the server', true);
+  }
   try {
     const str = JSON.stringify(state.conversationsData, null, 2);
     const blob = new Blob([str], { type: 'application/json' });
@@ -593,11 +760,8 @@ function downloadJSON() {
 }
 
 function resetAndUploadNew() {
-  // Cancel any active polling
-  if (state.pollTimer) {
-    clearInterval(state.pollTimer);
-    state.pollTimer = null;
-  }
+  // Cancel any active progress stream or polling
+  stopProgressUpdates();
 
   show($('setupSection'));
   hide($('mainContent'));
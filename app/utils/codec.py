@@ -0,0 +1,174 @@
+"""
+JSON encoding and decoding behind one small interface.
+
+``loads`` / ``dumps`` use orjson when it is installed, msgspec as a second
+choice and the standard library otherwise (``JSON_CODEC=json`` forces the
+standard library, e.g. to compare backends). Output is always compact
+UTF-8 bytes. Anything a fast backend refuses (ints past 64 bits, odd
+subclasses) is retried with the standard library, so switching backends
+never changes what can be serialized.
+
+With msgspec installed, ``decode_export`` also decodes a whole export into
+only the fields the organizer reads (``count_export`` just counts it): conversation ids, titles and times,
+and for each mapping node its message's time and text. Everything else is
+skipped by the parser without ever becoming Python objects. Message parts
+past the first ``SUMMARY_PARTS_PER_MESSAGE`` are kept as raw byte spans.
+
+Hashes that are stored (label cache keys, checkpoint and dedupe keys) keep
+using the standard library directly so they never depend on the backend.
+"""
+import importlib.util
+import json
+import os
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+_AVAILABLE = [name for name in ("orjson", "msgspec") if importlib.util.find_spec(name) is not None]
+_REQUESTED = os.getenv("JSON_CODEC", "").lower()
+if _REQUESTED == "json":
+    BACKEND = "json"
+elif _REQUESTED in _AVAILABLE:
+    BACKEND = _REQUESTED
+else:
+    BACKEND = _AVAILABLE[0] if _AVAILABLE else "json"
+TYPED_DECODING = "msgspec" in _AVAILABLE and _REQUESTED != "json"
+
+
+def _stdlib_default(obj):
+    # numpy scalars and the like.
+    if hasattr(obj, "item"):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _stdlib_dumps(obj, sort_keys=False, default=None) -> bytes:
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, sort_keys=sort_keys,
+                      default=default or _stdlib_default).encode("utf-8")
+
+
+if BACKEND == "orjson":
+    import orjson
+
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def loads(data: Union[bytes, str]) -> Any:
+        return orjson.loads(data)
+
+    def dumps(obj, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+        try:
+            return orjson.dumps(obj, default=default or _stdlib_default,
+                                option=_OPTIONS | orjson.OPT_SORT_KEYS if sort_keys else _OPTIONS)
+        except TypeError:
+            return _stdlib_dumps(obj, sort_keys, default)
+
+elif BACKEND == "msgspec":
+    import msgspec
+
+    _decoder = msgspec.json.Decoder()
+    _encoders: Dict[Any, Any] = {}
+
+    def loads(data: Union[bytes, str]) -> Any:
+        return _decoder.decode(data)
+
+    def dumps(obj, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+        if sort_keys:
+            # msgspec can't sort keys.
+            return _stdlib_dumps(obj, sort_keys, default)
+        encoder = _encoders.get(default)
+        if encoder is None:
+            encoder = _encoders[default] = msgspec.json.Encoder(enc_hook=default or _stdlib_default)
+        try:
+            return encoder.encode(obj)
+        except (TypeError, OverflowError):
+            return _stdlib_dumps(obj, sort_keys, default)
+
+else:
+    def loads(data: Union[bytes, str]) -> Any:
+        return json.loads(data)
+
+    def dumps(obj, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+        return _stdlib_dumps(obj, sort_keys, default)
+
+
+def dumps_str(obj, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> str:
+    return dumps(obj, sort_keys, default).decode("utf-8")
+
+
+if TYPED_DECODING:
+    import msgspec
+
+    from ..services.conversation import SUMMARY_PARTS_PER_MESSAGE
+
+    # UNSET keeps "missing" apart from null, so .get() defaults behave as with a full decode.
+    _Field = Union[Any, msgspec.UnsetType]
+    _UNSET = msgspec.UNSET
+
+    class _Content(msgspec.Struct):
+        parts: Union[List[msgspec.Raw], msgspec.UnsetType] = _UNSET
+
+    class _Message(msgspec.Struct):
+        create_time: _Field = _UNSET
+        content: Union[str, _Content, None, msgspec.UnsetType] = _UNSET
+        text: Union[msgspec.Raw, msgspec.UnsetType] = _UNSET
+        message: Union[msgspec.Raw, msgspec.UnsetType] = _UNSET
+
+    class _Node(msgspec.Struct):
+        message: Union[_Message, None, msgspec.UnsetType] = _UNSET
+
+    class _Conversation(msgspec.Struct):
+        id: _Field = _UNSET
+        title: _Field = _UNSET
+        create_time: _Field = _UNSET
+        update_time: _Field = _UNSET
+        mapping: Union[Dict[str, _Node], None, msgspec.UnsetType] = _UNSET
+
+    class _Skipped(msgspec.Struct):
+        pass
+
+    _export_decoder = msgspec.json.Decoder(Union[List[_Conversation], _Conversation])
+    _count_decoder = msgspec.json.Decoder(Union[List[_Skipped], _Skipped])
+    _raw_decoder = msgspec.json.Decoder()
+
+    def _message_dict(msg: _Message) -> dict:
+        out = {}
+        if msg.create_time is not _UNSET:
+            out["create_time"] = msg.create_time
+        if isinstance(msg.content, _Content):
+            out["content"] = {} if msg.content.parts is _UNSET else {
+                "parts": [_raw_decoder.decode(p) for p in msg.content.parts[:SUMMARY_PARTS_PER_MESSAGE]]}
+        elif msg.content is not _UNSET:
+            out["content"] = msg.content
+        for key in ("text", "message"):
+            raw = getattr(msg, key)
+            if raw is not _UNSET:
+                out[key] = _raw_decoder.decode(raw)
+        return out
+
+    def _conversation_dict(conv: _Conversation) -> dict:
+        out = {k: getattr(conv, k) for k in ("id", "title", "create_time", "update_time")
+               if getattr(conv, k) is not _UNSET}
+        if conv.mapping is None:
+            out["mapping"] = None
+        elif conv.mapping is not _UNSET:
+            out["mapping"] = {node_id: {} if node.message is _UNSET else
+                              {"message": _message_dict(node.message) if node.message is not None else None}
+                              for node_id, node in conv.mapping.items()}
+        return out
+
+    def decode_export(data: bytes) -> Iterator[dict]:
+        """
+        Decode an export's bytes into conversations holding only the fields
+        the organizer reads. Raises ``ValueError`` (msgspec's errors are
+        subclasses) for malformed input or unexpected field types.
+
+        The whole export is validated up front; the small structs are turned
+        into plain dicts one conversation at a time as they are consumed.
+        """
+        decoded = _export_decoder.decode(data)
+        if isinstance(decoded, _Conversation):
+            decoded = [decoded]
+        return (_conversation_dict(conv) for conv in decoded)
+
+    def count_export(data: bytes) -> int:
+        """The number of conversations in an export's bytes; their fields are skipped, not decoded."""
+        decoded = _count_decoder.decode(data)
+        return 1 if isinstance(decoded, _Skipped) else len(decoded)
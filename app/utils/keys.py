@@ -1,25 +1,35 @@
 import os
 from cryptography.fernet import Fernet
 
-DEFAULT_KEY_PATH = os.getenv("SERVER_ENC_KEY_PATH", os.path.join(os.getcwd(), "server_secret.key"))
+from .private_files import INSTANCE_DIR, open_private, private_file, private_parent
+
+DEFAULT_KEY_DIR = INSTANCE_DIR
+DEFAULT_KEY_PATH = os.getenv("SERVER_ENC_KEY_PATH", os.path.join(DEFAULT_KEY_DIR, "server_secret.key"))
+
 
 def load_or_create_fernet_key() -> bytes:
     env_key = os.getenv("SERVER_ENC_KEY")
     if env_key:
         return env_key.encode() if isinstance(env_key, str) else env_key
+    private_parent(DEFAULT_KEY_PATH, DEFAULT_KEY_DIR)
     if os.path.exists(DEFAULT_KEY_PATH):
+        private_file(DEFAULT_KEY_PATH)
         with open(DEFAULT_KEY_PATH, "rb") as f:
             key = f.read().strip()
             if key:
                 return key
     key = Fernet.generate_key()
-    os.makedirs(os.path.dirname(DEFAULT_KEY_PATH) or ".", exist_ok=True)
-    with open(DEFAULT_KEY_PATH, "wb") as f:
+    tmp = f"{DEFAULT_KEY_PATH}.{os.getpid()}.tmp"
+    with open_private(tmp) as f:
         f.write(key)
     try:
-        os.chmod(DEFAULT_KEY_PATH, 0o600)
-    except Exception:
-        pass
+        # Publish the key whole and only once: workers starting together must agree on one key.
+        os.link(tmp, DEFAULT_KEY_PATH)
+    except FileExistsError:
+        with open(DEFAULT_KEY_PATH, "rb") as f:
+            key = f.read().strip() or key
+    finally:
+        os.unlink(tmp)
     return key
 
 FERNET = Fernet(load_or_create_fernet_key())
@@ -0,0 +1,54 @@
+"""
+Logging setup for the app's loggers (``app.*``).
+
+Messages that can repeat many times a second (job progress, per-batch API
+errors) pass ``extra={"throttle": key}``; ``ThrottleFilter`` lets at most
+one record per key through every ``LOG_THROTTLE_SECONDS``.
+"""
+import logging
+import os
+import sys
+import threading
+from time import monotonic
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_THROTTLE_SECONDS = float(os.getenv("LOG_THROTTLE_SECONDS", "5"))
+
+_MAX_THROTTLE_KEYS = 10000
+_configure_lock = threading.Lock()
+
+
+class ThrottleFilter(logging.Filter):
+    def __init__(self, interval: float = LOG_THROTTLE_SECONDS):
+        super().__init__()
+        self.interval = interval
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "throttle", None)
+        if key is None:
+            return True
+        now = monotonic()
+        with self._lock:
+            last = self._last.get(key)
+            if last is not None and now - last < self.interval:
+                return False
+            if len(self._last) >= _MAX_THROTTLE_KEYS:
+                self._last = {k: t for k, t in self._last.items() if now - t < self.interval}
+            self._last[key] = now
+        return True
+
+
+def configure_logging(level: str = LOG_LEVEL) -> logging.Logger:
+    """Give the ``app`` logger a stderr handler (once per process) and return it."""
+    logger = logging.getLogger("app")
+    with _configure_lock:
+        if not any(isinstance(f, ThrottleFilter) for h in logger.handlers for f in h.filters):
+            handler = logging.StreamHandler(sys.stderr)
+            handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+            handler.addFilter(ThrottleFilter())
+            logger.addHandler(handler)
+            logger.propagate = False
+        logger.setLevel(level)
+    return logger
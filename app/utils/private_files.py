@@ -0,0 +1,61 @@
+"""
+Directories and files that hold users' data (results, uploads, checkpoints,
+the label cache) or secrets (the server key).
+
+They default to the shared temp directory, so they are created readable by
+this user only: directories 0700, files 0600. A directory that already
+exists must belong to this user (otherwise another local user could have
+planted it) and is tightened to 0700 if it was created more openly.
+"""
+import os
+
+PRIVATE_DIR_MODE = 0o700
+PRIVATE_FILE_MODE = 0o600
+# Default home of the server key and the label cache: kept out of the working tree's root (and out of git).
+INSTANCE_DIR = os.path.join(os.getcwd(), "instance")
+
+
+def private_dir(path: str) -> str:
+    """Create ``path`` (0700) if needed and check it is ours. Returns ``path``."""
+    os.makedirs(path, mode=PRIVATE_DIR_MODE, exist_ok=True)
+    st = os.stat(path)
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        raise PermissionError(f"{path} is owned by another user; refusing to store data in it")
+    if st.st_mode & 0o077:
+        os.chmod(path, PRIVATE_DIR_MODE)
+    return path
+
+
+def private_parent(path: str, default_dir: str) -> str:
+    """
+    Create ``path``'s directory: with ``private_dir`` when it is
+    ``default_dir`` (a directory this app owns), otherwise 0700 if missing,
+    leaving an existing configured parent (e.g. /tmp) alone. Returns ``path``.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if directory == os.path.abspath(default_dir):
+        private_dir(directory)
+    else:
+        os.makedirs(directory, mode=PRIVATE_DIR_MODE, exist_ok=True)
+    return path
+
+
+def open_private(path: str, mode: str = "wb", **kwargs):
+    """``open`` for writing (``w`` or ``a`` modes) that creates the file 0600."""
+    flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if mode.startswith("a") else os.O_TRUNC)
+    if "+" in mode:
+        flags = (flags & ~os.O_WRONLY) | os.O_RDWR
+    fd = os.open(path, flags, PRIVATE_FILE_MODE)
+    try:
+        return os.fdopen(fd, mode, **kwargs)
+    except Exception:
+        os.close(fd)
+        raise
+
+
+def private_file(path: str) -> str:
+    """Create ``path`` empty (0600) if it doesn't exist, or tighten it to 0600. Returns ``path``."""
+    os.close(os.open(path, os.O_WRONLY | os.O_CREAT, PRIVATE_FILE_MODE))
+    if os.stat(path).st_mode & 0o077:
+        os.chmod(path, PRIVATE_FILE_MODE)
+    return path
@@ -0,0 +1,165 @@
+"""
+Opt-in sampling profiler for jobs.
+
+``StackSampler`` wakes every ``interval`` seconds, reads one thread's
+current stack from ``sys._current_frames()`` and counts it. Nothing is
+traced between samples, so the job itself runs at full speed. Profiles are
+written in the collapsed-stack format ("frame;frame;frame count" per line)
+that flamegraph.pl and speedscope read.
+
+Enabled with ``JOB_PROFILING=1``; a job is then profiled when it is started
+with ``profile=1``.
+
+``RssSampler`` (always on, Linux only) samples the process's resident
+memory the same way for the duration of every job, so the job metrics can
+report the peak while the job ran rather than the process's lifetime peak.
+"""
+import os
+import sys
+import tempfile
+import threading
+from collections import Counter
+from time import time
+from typing import Optional
+
+JOB_PROFILING = os.getenv("JOB_PROFILING", "0").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "chatgpt_organizer_profiles"))
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_MS", "10")) / 1000.0
+
+RSS_INTERVAL_SECONDS = 0.1
+
+_MAX_DEPTH = 128
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss_bytes() -> Optional[int]:
+    """Resident memory of this process now, or None where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Count the stacks of one thread (by default the caller's) until stopped."""
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = PROFILE_INTERVAL_SECONDS):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            labels = []
+            while frame is not None and len(labels) < _MAX_DEPTH:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+
+    def start(self) -> "StackSampler":
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+
+def profile_path(job_id: str, profile_dir: str = PROFILE_DIR) -> str:
+    return os.path.join(profile_dir, f"{job_id}.folded")
+
+
+def save_profile(job_id: str, sampler: StackSampler, profile_dir: str = PROFILE_DIR) -> str:
+    os.makedirs(profile_dir, exist_ok=True)
+    path = profile_path(job_id, profile_dir)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(sampler.collapsed())
+    os.replace(tmp, path)
+    return path
+
+
+def sweep(max_age_seconds: int, profile_dir: str = PROFILE_DIR) -> int:
+    """Remove profiles older than ``max_age_seconds``."""
+    cutoff = time() - max_age_seconds
+    removed = 0
+    try:
+        names = os.listdir(profile_dir)
+    except OSError:
+        return 0
+    for name in names:
+        path = os.path.join(profile_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+class RssSampler:
+    """
+    Peak resident memory of this process between ``start`` and ``stop``.
+    Other jobs running in the same process at the time are included; the
+    growth over the starting value is the closer estimate of one job's own.
+    """
+
+    def __init__(self, interval: float = RSS_INTERVAL_SECONDS):
+        self.interval = interval
+        self.start_bytes: Optional[int] = None
+        self.peak_bytes: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = current_rss_bytes()
+        if rss is not None and (self.peak_bytes is None or rss > self.peak_bytes):
+            self.peak_bytes = rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self) -> "RssSampler":
+        self.start_bytes = self.peak_bytes = current_rss_bytes()
+        if self.start_bytes is not None:
+            self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._sample()
+
+    @property
+    def growth_bytes(self) -> Optional[int]:
+        if self.start_bytes is None or self.peak_bytes is None:
+            return None
+        return self.peak_bytes - self.start_bytes
@@ -0,0 +1,221 @@
+"""Minimal local stand-in for the OpenAI chat completions, files and batches endpoints."""
+import json
+import re
+from email.parser import BytesParser
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenAIServer:
+    """
+    Answers POST /v1/chat/completions with one answer per "[n]" conversation
+    in the user prompt: the number of the category from the system prompt's
+    numbered list, or a code named under "new" for any other category.
+
+    - latency: seconds to sleep before answering each request
+    - rate_limit_first: number of initial requests answered with HTTP 429
+    - category_for: callable(summary_text) -> category name
+    - drop_last_when_larger_than: if set, batches bigger than this get one
+      answer too few (simulates a truncated/mismatched reply)
+
+    Batch jobs (POST /v1/files with purpose "batch", then POST /v1/batches)
+    answer every line of the uploaded JSONL the same way. A batch reports
+    "in_progress" for ``batch_polls`` retrievals, then ``batch_final_status``
+    (with an output file only if that is "completed").
+    """
+    def __init__(self, latency=0.0, rate_limit_first=0, category_for=None, drop_last_when_larger_than=None,
+                 batch_polls=1, batch_final_status="completed"):
+        self.latency = latency
+        self.rate_limit_first = rate_limit_first
+        self.category_for = category_for or (lambda text: "Programming & Development")
+        self.drop_last_when_larger_than = drop_last_when_larger_than
+        self.batch_polls = batch_polls
+        self.batch_final_status = batch_final_status
+        self.files = {}
+        self.batches = {}
+        self.completions = 0
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _completion(self, body):
+        messages = body.get("messages", [])
+        system = "\n".join(m.get("content", "") for m in messages if m.get("role") == "system")
+        prompt = "\n".join(m.get("content", "") for m in messages if m.get("role") != "system")
+        numbers = {name: int(n) for n, name in re.findall(r"^(\d+)\. (.+)$", system, re.M)}
+        blocks = re.split(r"^\[\d+\] ", prompt, flags=re.M)[1:]
+        answers, new = [], {}
+        for block in blocks:
+            category = self.category_for(block)
+            if category in numbers:
+                answers.append(numbers[category])
+            else:
+                code = next((c for c, name in new.items() if name == category), None) or chr(ord("a") + len(new))
+                new[code] = category
+                answers.append(code)
+        if self.drop_last_when_larger_than is not None and len(answers) > self.drop_last_when_larger_than:
+            answers = answers[:-1]
+        reply = {"c": answers, "new": new} if new else {"c": answers}
+        prompt_chars = len(system) + len(prompt)
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": json.dumps(reply)},
+            }],
+            "usage": {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(json.dumps(reply)) // 4,
+                      "total_tokens": 0},
+        }
+
+    def _upload(self, content_type, raw):
+        message = BytesParser().parsebytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + raw)
+        fields = {part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+                  for part in message.get_payload()}
+        with self._lock:
+            file_id = f"file-{len(self.files) + 1}"
+            self.files[file_id] = fields.get("file") or b""
+        return {"id": file_id, "object": "file", "bytes": len(self.files[file_id]), "created_at": int(time.time()),
+                "filename": "requests.jsonl", "purpose": fields.get("purpose", b"").decode(), "status": "processed"}
+
+    def _create_batch(self, body):
+        lines = [json.loads(line) for line in self.files[body["input_file_id"]].splitlines() if line.strip()]
+        with self._lock:
+            batch_id = f"batch_{len(self.batches) + 1}"
+            self.batches[batch_id] = {"id": batch_id, "object": "batch", "endpoint": body["endpoint"],
+                                      "input_file_id": body["input_file_id"],
+                                      "completion_window": body["completion_window"], "status": "validating",
+                                      "created_at": int(time.time()), "output_file_id": None, "error_file_id": None,
+                                      "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+                                      "polls": 0, "lines": lines}
+        return self._batch_view(batch_id)
+
+    def _batch_view(self, batch_id):
+        return {k: v for k, v in self.batches[batch_id].items() if k not in ("polls", "lines")}
+
+    def _retrieve_batch(self, batch_id):
+        batch = self.batches[batch_id]
+        if batch["status"] in ("completed", "failed", "expired", "cancelled"):
+            return self._batch_view(batch_id)
+        counts = batch["request_counts"]
+        if batch["polls"] < self.batch_polls:
+            batch["status"] = "in_progress"
+            counts["completed"] = counts["total"] * batch["polls"] // (self.batch_polls + 1)
+            batch["polls"] += 1
+            return self._batch_view(batch_id)
+        batch["status"] = self.batch_final_status
+        if self.batch_final_status == "completed":
+            out = []
+            for i, line in enumerate(batch["lines"]):
+                self.completions += 1
+                out.append(json.dumps({"id": f"batch_req_{i}", "custom_id": line["custom_id"], "error": None,
+                                       "response": {"status_code": 200, "request_id": f"req_{i}",
+                                                    "body": self._completion(line["body"])}}))
+            with self._lock:
+                file_id = f"file-{len(self.files) + 1}"
+                self.files[file_id] = ("\n".join(out) + "\n").encode("utf-8")
+            batch["output_file_id"] = file_id
+            counts["completed"] = counts["total"]
+        return self._batch_view(batch_id)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, like the real API, so connection reuse can be measured.
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload, headers=None):
+                raw = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def _send_bytes(self, raw):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                raw = self.rfile.read(length)
+                path = self.path.rstrip("/")
+                with server._lock:
+                    server.requests += 1
+                    n = server.requests
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    if server.latency:
+                        time.sleep(server.latency)
+                    if n <= server.rate_limit_first:
+                        self._send(429, {"error": {"message": "Rate limit", "type": "rate_limit"}},
+                                   {"retry-after-ms": "10"})
+                        return
+                    if path.endswith("/files"):
+                        self._send(200, server._upload(self.headers.get("Content-Type", ""), raw))
+                        return
+                    body = json.loads(raw or b"{}")
+                    if path.endswith("/chat/completions"):
+                        with server._lock:
+                            server.completions += 1
+                        self._send(200, server._completion(body))
+                    elif path.endswith("/batches"):
+                        self._send(200, server._create_batch(body))
+                    elif path.endswith("/cancel") and path.split("/")[-2] in server.batches:
+                        server.batches[path.split("/")[-2]]["status"] = "cancelled"
+                        self._send(200, server._batch_view(path.split("/")[-2]))
+                    else:
+                        self._send(404, {"error": {"message": "Not found"}})
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+            def do_GET(self):
+                parts = self.path.rstrip("/").split("/")
+                if parts[-2] == "batches" and parts[-1] in server.batches:
+                    self._send(200, server._retrieve_batch(parts[-1]))
+                elif parts[-1] == "content" and parts[-2] in server.files:
+                    self._send_bytes(server.files[parts[-2]])
+                else:
+                    self._send(404, {"error": {"message": "Not found"}})
+
+            def do_DELETE(self):
+                file_id = self.path.rstrip("/").split("/")[-1]
+                if server.files.pop(file_id, None) is None:
+                    self._send(404, {"error": {"message": "Not found"}})
+                else:
+                    self._send(200, {"id": file_id, "object": "file", "deleted": True})
+
+        return Handler
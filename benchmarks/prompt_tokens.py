@@ -0,0 +1,119 @@
+"""
+Compare the tokens each categorization batch costs under the compact
+prompt protocol against the earlier full-name prompt.
+
+    python -m benchmarks.prompt_tokens --size 1000 --batch-size 25
+
+The earlier protocol cut every message part at 300 characters and the
+summary at 2000, repeated the category list and instructions in every
+user prompt and had the model spell out each category name. The compact
+one trims summaries to a token budget, keeps the numbered categories and the
+instructions once in a system prompt and gets back category numbers. Both sides are estimated with
+the same ~4 characters/token rule; answers are taken from the synthetic
+conversations' topics, with "cooking" standing in for a category the
+model has to propose.
+"""
+import argparse
+import json
+import sys
+
+from app.services.chatgpt_categorizer import ChatGPTCategorizer, system_prompt
+from app.services.conversation import (SUMMARY_HEAD_MESSAGES, _message_texts, estimate_tokens,
+                                       parse_conversation)
+
+from .synthetic_export import iter_export
+
+LEGACY_SYSTEM_PROMPT = "You are a precise conversation categorizer. Output strict JSON only."
+TOPIC_CATEGORIES = {
+    "programming": "Programming & Development",
+    "writing": "Writing & Content Creation",
+    "learning": "Learning & Education",
+    "business": "Business & Strategy",
+    "data": "Data Science & ML",
+    "personal": "Personal Advice",
+    "cooking": "Cooking & Recipes",
+}
+
+
+def legacy_summary(title, messages):
+    parts = [f"Title: {title}"]
+    for msg in messages[:SUMMARY_HEAD_MESSAGES]:
+        parts.extend(text[:300] for text in _message_texts(msg))
+    return '\n'.join(parts)[:2000]
+
+
+def legacy_user_prompt(summaries, categories):
+    batch_text = "\n---\n".join(f"Conversation {idx + 1}:\n{summary}\n" for idx, summary in enumerate(summaries))
+    return f"""Categorize each ChatGPT conversation into ONE of these categories:
+
+Categories: {', '.join(categories)}
+
+{batch_text}
+
+Respond ONLY as JSON with this exact shape and never use "Uncategorized" category:
+{{"categories": ["Programming & Development", "Writing & Content Creation", "..."]}}
+
+- The array length MUST equal the number of conversations.
+- If none fits, propose a new single category name at that position.
+"""
+
+
+def compact_answer(labels, categories):
+    numbers = {c: i for i, c in enumerate(categories, 1)}
+    answers, new = [], {}
+    for label in labels:
+        if label in numbers:
+            answers.append(numbers[label])
+            continue
+        code = next((c for c, name in new.items() if name == label), None) or chr(ord("a") + len(new))
+        new[code] = label
+        answers.append(code)
+    return json.dumps({"c": answers, "new": new} if new else {"c": answers})
+
+
+def compare(size=1000, batch_size=25, seed=0, max_turns=40):
+    categories = ChatGPTCategorizer(api_key="sk-benchmark-key").default_categories
+    prefix = system_prompt(tuple(categories))
+    totals = {"legacy": {"prompt_tokens": 0, "completion_tokens": 0},
+              "compact": {"prompt_tokens": 0, "completion_tokens": 0}}
+    batch = []
+
+    def flush():
+        legacy = [s for s, _, _ in batch]
+        compact = [s for _, s, _ in batch]
+        labels = [label for _, _, label in batch]
+        totals["legacy"]["prompt_tokens"] += (estimate_tokens(LEGACY_SYSTEM_PROMPT) +
+                                              estimate_tokens(legacy_user_prompt(legacy, categories)))
+        totals["legacy"]["completion_tokens"] += estimate_tokens(json.dumps({"categories": labels}))
+        totals["compact"]["prompt_tokens"] += (estimate_tokens(prefix) +
+                                               estimate_tokens(ChatGPTCategorizer._build_user_prompt(compact)))
+        totals["compact"]["completion_tokens"] += estimate_tokens(compact_answer(labels, categories))
+        batch.clear()
+
+    for conv in iter_export(size, seed=seed, max_turns=max_turns):
+        record = parse_conversation(conv)
+        batch.append((legacy_summary(record.title, record.head), record.summary, TOPIC_CATEGORIES[conv["topic"]]))
+        if len(batch) == batch_size:
+            flush()
+    if batch:
+        flush()
+
+    for key in ("prompt_tokens", "completion_tokens"):
+        old, new = totals["legacy"][key], totals["compact"][key]
+        totals[f"{key}_saved"] = round(1 - new / old, 3) if old else None
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Estimate prompt/completion tokens per protocol.")
+    parser.add_argument("--size", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=25)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-turns", type=int, default=40)
+    args = parser.parse_args(argv)
+    print(json.dumps(compare(args.size, args.batch_size, args.seed, args.max_turns), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+"""
+Time and memory-profile the organizer pipeline on synthetic exports.
+
+    python -m benchmarks.run --sizes 1000 10000 --output bench.json
+    python -m benchmarks.run --sizes 1000 --compare bench.json
+
+Each benchmark runs once for wall time and, unless ``--no-memory`` is
+given, once more under tracemalloc for peak Python heap. Results are
+written as JSON so runs from different versions can be compared; with
+``--compare`` the run exits non-zero if any benchmark got slower than
+``--tolerance``.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Keep benchmark runs from touching the user's label cache, and from having a
+# repeated upload of the same export attach to the job an earlier pass started.
+os.environ.setdefault("LABEL_CACHE_PATH", "")
+os.environ.setdefault("JOB_DEDUPE_SECONDS", "0")
+
+from .fake_openai import FakeOpenAIServer  # noqa: E402
+from .synthetic_export import write_export  # noqa: E402
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS.append((name, fn))
+        return fn
+    return register
+
+
+class Context:
+    def __init__(self, path, size, args):
+        self.path = path
+        self.size = size
+        self.args = args
+
+
+def _stream(ctx):
+    from app.services.export_reader import iter_conversations
+    return iter_conversations(ctx.path)
+
+
+@benchmark("parse_stream")
+def bench_parse(ctx):
+    from app.services.export_reader import count_conversations
+    return lambda: count_conversations(ctx.path)
+
+
+@benchmark("parse_stream_typed")
+def bench_parse_typed(ctx):
+    """Opted in to msgspec's typed decoding of the whole export (the incremental decoder without msgspec)."""
+    from app.services import export_reader
+
+    def run():
+        limit = export_reader.TYPED_DECODE_MAX_BYTES
+        export_reader.TYPED_DECODE_MAX_BYTES = 1 << 40
+        try:
+            return export_reader.count_conversations(ctx.path)
+        finally:
+            export_reader.TYPED_DECODE_MAX_BYTES = limit
+    return run
+
+
+def _result(ctx):
+    from app.services.time_grouping import group_conversations_by_date
+    return {"summary": {"organize_mode": "month"}, "time_periods": group_conversations_by_date(_stream(ctx), "month")}
+
+
+@benchmark("serialize_result")
+def bench_serialize(ctx):
+    from app.utils import codec
+    result = _result(ctx)
+    return lambda: len(codec.dumps(result))
+
+
+@benchmark("serialize_result_stdlib")
+def bench_serialize_stdlib(ctx):
+    result = _result(ctx)
+    return lambda: len(json.dumps(result, separators=(",", ":")).encode("utf-8"))
+
+
+@benchmark("upload_categorize_request")
+def bench_upload(ctx):
+    from app import create_app
+    from app.services.store import FINISHED_STATUSES, JOBS
+    client = create_app().test_client()
+
+    def run():
+        with open(ctx.path, "rb") as f:
+            resp = client.post("/api/categorize", data={"organize_mode": "month", "file": (f, "conversations.json")},
+                               content_type="multipart/form-data")
+        if resp.json.get("deduplicated"):
+            raise RuntimeError("the upload attached to an earlier job; run with JOB_DEDUPE_SECONDS=0")
+        job_id = resp.json["job_id"]
+        # The job itself runs on the worker pool (possibly queued first); wait until it
+        # finishes so it doesn't bleed into the next benchmark.
+        while JOBS.get(job_id, include_result=False)["status"] not in FINISHED_STATUSES:
+            time.sleep(0.01)
+        return resp.status_code
+
+    return run
+
+
+@benchmark("group_conversations_by_date")
+def bench_group(ctx):
+    from app.services.time_grouping import group_conversations_by_date
+    return lambda: group_conversations_by_date(_stream(ctx), mode="month")
+
+
+@benchmark("cluster")
+def bench_cluster(ctx):
+    from app.services.clustering import ConversationClusterer
+    return lambda: ConversationClusterer().cluster(_stream(ctx))
+
+
+def _timed_per_conversation(ctx, fn):
+    """Time only ``fn`` across the stream (parsing excluded). Returns a runner."""
+    def run():
+        spent = 0.0
+        for conv in _stream(ctx):
+            start = time.perf_counter()
+            fn(conv)
+            spent += time.perf_counter() - start
+        return spent
+    return run
+
+
+@benchmark("extract_messages_from_mapping")
+def bench_extract_messages(ctx):
+    cat = _categorizer(None)
+    return _timed_per_conversation(ctx, lambda conv: cat.extract_messages_from_mapping(conv.get("mapping") or {}))
+
+
+@benchmark("extract_conversation_summary")
+def bench_summary(ctx):
+    cat = _categorizer(None)
+
+    def summarize(conv):
+        messages = cat.extract_messages_from_mapping(conv.get("mapping") or {})
+        cat.extract_conversation_summary(conv.get("title", "Untitled"), messages)
+
+    return _timed_per_conversation(ctx, summarize)
+
+
+@benchmark("parse_conversation")
+def bench_parse_conversation(ctx):
+    from app.services.conversation import parse_conversation
+    return _timed_per_conversation(ctx, lambda conv: parse_conversation(conv).summary)
+
+
+@benchmark("process_export")
+def bench_process_export(ctx):
+    def run():
+        server = FakeOpenAIServer(latency=ctx.args.latency).start()
+        try:
+            cat = _categorizer(server.base_url)
+            cat.process_export(ctx.path, batch_size=ctx.args.batch_size, max_concurrency=ctx.args.concurrency)
+            return server.requests
+        finally:
+            server.stop()
+    return run
+
+
+def _categorizer(base_url):
+    from app.services.chatgpt_categorizer import ChatGPTCategorizer
+    return ChatGPTCategorizer(api_key="sk-benchmark-key", base_url=base_url)
+
+
+def _measure(run, with_memory):
+    start = time.perf_counter()
+    value = run()
+    seconds = time.perf_counter() - start
+    # Per-conversation benchmarks return their own (parse-excluded) timing.
+    if isinstance(value, float):
+        seconds = value
+    peak_mb = None
+    if with_memory:
+        tracemalloc.start()
+        try:
+            run()
+            peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        finally:
+            tracemalloc.stop()
+    return seconds, peak_mb
+
+
+def _codec_backend():
+    from app.utils import codec
+    return codec.BACKEND + (" +typed" if codec.TYPED_DECODING else "")
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def run_all(args):
+    selected = [(n, fn) for n, fn in BENCHMARKS if not args.only or n in args.only]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            path = os.path.join(tmp, f"conversations_{size}.json")
+            write_export(path, size, seed=args.seed, max_turns=args.max_turns)
+            ctx = Context(path, size, args)
+            for name, make in selected:
+                if name == "process_export" and size > args.max_api_size:
+                    continue
+                seconds, peak_mb = _measure(make(ctx), not args.no_memory)
+                row = {
+                    "name": name,
+                    "size": size,
+                    "file_mb": round(os.path.getsize(path) / (1024 * 1024), 2),
+                    "seconds": round(seconds, 4),
+                    "conversations_per_second": round(size / seconds, 1) if seconds else None,
+                    "peak_mb": round(peak_mb, 2) if peak_mb is not None else None,
+                }
+                results.append(row)
+                print(f"{name:<32} n={size:<7} {row['seconds']:>9.3f}s  "
+                      f"peak={row['peak_mb'] if row['peak_mb'] is not None else '-'} MB", file=sys.stderr)
+    return {
+        "meta": {
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "latency": args.latency,
+            "batch_size": args.batch_size,
+            "concurrency": args.concurrency,
+            "json_codec": _codec_backend(),
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, tolerance):
+    """Print per-benchmark ratios; return the rows slower than ``1 + tolerance``."""
+    base = {(r["name"], r["size"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for row in current["results"]:
+        old = base.get((row["name"], row["size"]))
+        if not old or not old["seconds"]:
+            continue
+        ratio = row["seconds"] / old["seconds"]
+        print(f"{row['name']:<32} n={row['size']:<7} {ratio:6.2f}x time", file=sys.stderr)
+        if ratio > 1 + tolerance:
+            regressions.append(row)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ChatGPT organizer pipeline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--only", nargs="*", help="benchmark names to run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-turns", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake OpenAI latency per request (s)")
+    parser.add_argument("--batch-size", type=int, default=25)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--max-api-size", type=int, default=10000,
+                        help="skip process_export above this many conversations")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--output", help="write JSON results here (default: stdout)")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    report = run_all(args)
+    out = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(out)
+    else:
+        print(out)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed beyond {args.tolerance:.0%}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
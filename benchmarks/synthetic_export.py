@@ -0,0 +1,124 @@
+"""
+Deterministic synthetic ``conversations.json`` exports for benchmarking.
+
+Conversations follow the real export shape: a ``mapping`` tree rooted at a
+message-less node, a chain of user/assistant turns with occasional
+regenerated branches, and ``content.parts`` text drawn from a handful of
+topic vocabularies so categorizers have something to separate.
+
+    python -m benchmarks.synthetic_export 10000 -o /tmp/conversations.json
+"""
+import argparse
+import json
+import random
+import uuid
+
+TOPICS = {
+    "programming": "python function error traceback import class module debug sql query api flask "
+                   "javascript react bug compile test refactor git branch docker deploy".split(),
+    "writing": "essay draft paragraph blog post headline tone rewrite story chapter outline "
+               "grammar edit newsletter copy audience narrative".split(),
+    "learning": "explain concept history physics chemistry lesson quiz study exam theorem proof "
+                "biology definition homework lecture".split(),
+    "business": "strategy market revenue pricing startup pitch investor customer churn growth "
+                "roadmap okr competitor funnel".split(),
+    "data": "dataset model training regression pandas numpy feature accuracy neural embedding "
+            "cluster classification tensor gradient".split(),
+    "personal": "advice relationship friend stress sleep habit motivation routine family decision "
+                "feel anxious gift plan".split(),
+    "cooking": "recipe dinner chicken pasta oven bake vegetarian spice sauce dessert grocery "
+               "meal prep flour".split(),
+}
+FILLER = "the a to and of in for with on is it this that how can you please i my".split()
+
+EPOCH_START = 1672531200  # 2023-01-01
+EPOCH_SPAN = 3 * 365 * 24 * 3600
+
+
+def _text(rng, vocab, words):
+    return " ".join(rng.choice(vocab) if rng.random() < 0.4 else rng.choice(FILLER) for _ in range(words))
+
+
+def make_conversation(rng, index, max_turns=40, branch_rate=0.08, words_per_message=60):
+    topic = rng.choice(list(TOPICS))
+    vocab = TOPICS[topic]
+    create_time = EPOCH_START + rng.random() * EPOCH_SPAN
+    root_id = "client-created-root"
+    mapping = {root_id: {"id": root_id, "message": None, "parent": None, "children": []}}
+
+    parent = root_id
+    t = create_time
+    turns = rng.randint(2, max_turns)
+    for turn in range(turns):
+        role = "user" if turn % 2 == 0 else "assistant"
+        siblings = 2 if role == "assistant" and rng.random() < branch_rate else 1
+        chosen = None
+        for _ in range(siblings):
+            node_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            t += rng.uniform(1, 120)
+            mapping[node_id] = {
+                "id": node_id,
+                "message": {
+                    "id": node_id,
+                    "author": {"role": role, "name": None, "metadata": {}},
+                    "create_time": t,
+                    "update_time": None,
+                    "content": {"content_type": "text",
+                                "parts": [_text(rng, vocab, rng.randint(words_per_message // 3, words_per_message))]},
+                    "status": "finished_successfully",
+                    "end_turn": role == "assistant",
+                    "weight": 1.0,
+                    "metadata": {"model_slug": "gpt-4o", "finish_details": {"type": "stop"}},
+                    "recipient": "all",
+                },
+                "parent": parent,
+                "children": [],
+            }
+            mapping[parent]["children"].append(node_id)
+            chosen = node_id
+        parent = chosen
+
+    return {
+        "title": f"{rng.choice(vocab).title()} {rng.choice(vocab)} question #{index}",
+        "create_time": create_time,
+        "update_time": t,
+        "mapping": mapping,
+        "moderation_results": [],
+        "current_node": parent,
+        "id": str(uuid.UUID(int=rng.getrandbits(128))),
+        # Not part of real exports: ground truth for judging categorizers.
+        "topic": topic,
+    }
+
+
+def iter_export(n, seed=0, **kwargs):
+    rng = random.Random(seed)
+    for i in range(n):
+        yield make_conversation(rng, i, **kwargs)
+
+
+def write_export(path, n, seed=0, **kwargs):
+    """Write an export of ``n`` conversations to ``path`` without building it in memory."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for i, conv in enumerate(iter_export(n, seed=seed, **kwargs)):
+            if i:
+                f.write(",")
+            json.dump(conv, f)
+        f.write("]")
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("count", type=int)
+    parser.add_argument("-o", "--output", default="conversations.json")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-turns", type=int, default=40)
+    args = parser.parse_args(argv)
+    write_export(args.output, args.count, seed=args.seed, max_turns=args.max_turns)
+    print(args.output)
+
+
+if __name__ == "__main__":
+    main()
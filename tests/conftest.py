@@ -10,3 +10,10 @@ def app():
 @pytest.fixture
 def client(app):
     return app.test_client()
+
+@pytest.fixture
+def fake_openai():
+    from benchmarks.fake_openai import FakeOpenAIServer
+    server = FakeOpenAIServer().start()
+    yield server
+    server.stop()
@@ -23,3 +23,216 @@ def test_categorize_year_ok(client):
     # Immediately check progress endpoint exists
     prog = client.get(f"/api/progress/{job_id}")
     assert prog.status_code == 200
+
+def _wait_for_result(client, job_id, timeout=5.0):
+    import time
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        prog = client.get(f"/api/progress/{job_id}").json
+        if prog["status"] in ("done", "error", "cancelled"):
+            break
+        time.sleep(0.02)
+    return client.get(f"/api/result/{job_id}")
+
+def test_categorize_incremental_merges_delta(client):
+    old = [{"id":"1","title":"X","create_time":1704067200,"update_time":1704067200,"mapping":{}}]
+    new = old + [{"id":"2","title":"Y","create_time":1706745600,"update_time":1706745600,"mapping":{}}]
+    first = client.post("/api/categorize", data={
+        "organize_mode": "month",
+        "file": (io.BytesIO(json.dumps(old).encode("utf-8")), "export.json")
+    }, content_type="multipart/form-data")
+    first_result = _wait_for_result(client, first.json["job_id"])
+    assert first_result.status_code == 200
+
+    second = client.post("/api/categorize", data={
+        "organize_mode": "month",
+        "previous_job_id": first.json["job_id"],
+        "file": (io.BytesIO(json.dumps(new).encode("utf-8")), "export.json")
+    }, content_type="multipart/form-data")
+    result = _wait_for_result(client, second.json["job_id"]).json
+    assert result["summary"]["incremental"] == {
+        "previous_conversations": 1, "new": 1, "updated": 0, "unchanged": 1
+    }
+    assert result["summary"]["total_conversations"] == 2
+    ids = [c["id"] for buckets in result["time_periods"].values() for convs in buckets.values() for c in convs]
+    assert ids == ["2", "1"]
+
+def test_progress_stream_pushes_final_state(client):
+    sample_json = json.dumps([{"id":"1","title":"X","create_time":1704067200,"mapping":{}}]).encode("utf-8")
+    resp = client.post("/api/categorize", data={
+        "organize_mode": "year",
+        "file": (io.BytesIO(sample_json), "export.json")
+    }, content_type="multipart/form-data")
+    job_id = resp.json["job_id"]
+
+    stream = client.get(f"/api/progress/{job_id}/stream")
+    assert stream.status_code == 200
+    assert stream.mimetype == "text/event-stream"
+    events = [json.loads(line[len("data: "):]) for line in stream.get_data(as_text=True).splitlines()
+              if line.startswith("data: ")]
+    assert events[-1]["status"] == "done"
+    assert events[-1]["progress"] == 100
+
+def test_progress_stream_unknown_job(client):
+    assert client.get("/api/progress/nope/stream").status_code == 404
+
+def test_categorize_cluster_mode_needs_no_key(client):
+    from benchmarks.synthetic_export import iter_export
+    export = json.dumps(list(iter_export(60, seed=1, max_turns=4))).encode("utf-8")
+    resp = client.post("/api/categorize", data={
+        "organize_mode": "cluster",
+        "file": (io.BytesIO(export), "export.json")
+    }, content_type="multipart/form-data")
+    assert resp.status_code == 200
+    result = _wait_for_result(client, resp.json["job_id"]).json
+    assert result["summary"]["organize_mode"] == "cluster"
+    assert result["summary"]["total_conversations"] == 60
+    assert sum(len(convs) for convs in result["categories"].values()) == 60
+
+def test_result_conversations_paginates_and_filters(client):
+    convs = [{"id": str(i), "title": f"{'Python' if i % 3 == 0 else 'Recipe'} note {i}",
+              "create_time": 1704067200 + i * 86400 * 10, "update_time": 1704067200, "mapping": {}}
+             for i in range(30)]
+    resp = client.post("/api/categorize", data={
+        "organize_mode": "month",
+        "file": (io.BytesIO(json.dumps(convs).encode("utf-8")), "export.json")
+    }, content_type="multipart/form-data")
+    job_id = resp.json["job_id"]
+    full = _wait_for_result(client, job_id).json
+
+    seen, cursor = [], None
+    while True:
+        url = f"/api/result/{job_id}/conversations?limit=7" + (f"&cursor={cursor}" if cursor else "")
+        page = client.get(url).json
+        if cursor is None:
+            assert page["total"] == 30
+        seen += [c["id"] for c in page["conversations"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    # Stored (newest-first) order, not the key-sorted order of the JSON response.
+    assert seen == [str(i) for i in reversed(range(30))]
+
+    found = client.get(f"/api/result/{job_id}/conversations?q=pyth").json
+    assert found["total"] == 10
+    assert all(c["title"].startswith("Python") for c in found["conversations"])
+
+    period = next(iter(full["time_periods"]))
+    in_period = client.get(f"/api/result/{job_id}/conversations", query_string={"period": period}).json
+    assert in_period["total"] == len(full["time_periods"][period]["All"])
+
+    ranged = client.get(f"/api/result/{job_id}/conversations?since=2024-02-01&until=2024-02-29").json
+    assert ranged["conversations"] and all(c["create_time"].startswith("2024-02") for c in ranged["conversations"])
+
+    assert client.get("/api/result/nope/conversations").status_code == 404
+    assert client.get(f"/api/result/{job_id}/conversations?cursor=x").status_code == 400
+
+def test_result_export_formats(client):
+    import csv
+    import gzip
+
+    convs = [{"id": str(i), "title": f"Chat, \"{i}\"", "create_time": 1704067200 + i * 86400 * 20,
+              "update_time": 1704067200, "mapping": {}} for i in range(12)]
+    convs[0]["title"] = '=HYPERLINK("http://example.invalid")'
+    convs[1]["title"] = "-1+2"
+    resp = client.post("/api/categorize", data={
+        "organize_mode": "quarter",
+        "file": (io.BytesIO(json.dumps(convs).encode("utf-8")), "export.json")
+    }, content_type="multipart/form-data")
+    job_id = resp.json["job_id"]
+    full = _wait_for_result(client, job_id).json
+
+    exported = client.get(f"/api/result/{job_id}/export?format=json&compression=gzip")
+    assert exported.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(exported.data)) == full
+
+    lines = client.get(f"/api/result/{job_id}/export?format=ndjson&compression=none").data.decode().splitlines()
+    assert len(lines) == 12
+    assert {json.loads(line)["period"] for line in lines} == set(full["time_periods"])
+
+    negotiated = client.get(f"/api/result/{job_id}/export?format=csv", headers={"Accept-Encoding": "gzip"})
+    assert negotiated.headers["Content-Encoding"] == "gzip"
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(negotiated.data).decode("utf-8"))))
+    assert sorted(r["title"] for r in rows) == sorted("'" + c["title"] if c["title"][0] in "=-" else c["title"]
+                                                      for c in convs)
+    assert 'filename="categorized_chats.csv"' in negotiated.headers["Content-Disposition"]
+
+    assert client.get(f"/api/result/{job_id}/export?format=xml").status_code == 400
+    assert client.get(f"/api/result/{job_id}/export?compression=brotli").status_code == 400
+
+def test_chunked_upload_resumes_and_feeds_categorize(client):
+    import hashlib
+    import zipfile
+
+    convs = [{"id": str(i), "title": f"T{i}", "create_time": 1704067200 + i, "mapping": {}} for i in range(40)]
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("conversations.json", json.dumps(convs))
+    payload = buf.getvalue()
+    digest = hashlib.sha256(payload).hexdigest()
+
+    created = client.post("/api/uploads", json={"filename": "export.zip", "size": len(payload), "sha256": digest})
+    assert created.status_code == 201
+    upload_id = created.json["upload_id"]
+    half = len(payload) // 2
+
+    first = client.put(f"/api/uploads/{upload_id}?offset=0", data=payload[:half])
+    assert first.json["received"] == half
+    # A bad chunk is rejected whole and a stale offset is refused; neither corrupts the file.
+    bad = client.put(f"/api/uploads/{upload_id}?offset={half}", data=payload[half:],
+                     headers={"X-Chunk-SHA256": "0" * 64})
+    assert bad.status_code == 400
+    stale = client.put(f"/api/uploads/{upload_id}?offset=0", data=payload[:half])
+    assert stale.status_code == 409 and stale.json["received"] == half
+
+    # Resume from what the server says it has.
+    received = client.get(f"/api/uploads/{upload_id}").json["received"]
+    client.put(f"/api/uploads/{upload_id}?offset={received}", data=payload[received:],
+               headers={"X-Chunk-SHA256": hashlib.sha256(payload[received:]).hexdigest()})
+    final = client.post(f"/api/uploads/{upload_id}/finalize", json={})
+    assert final.status_code == 200
+    assert (final.json["sha256"], final.json["format"]) == (digest, "zip")
+
+    job = client.post("/api/categorize", data={"organize_mode": "year", "upload_id": upload_id})
+    assert job.status_code == 200
+    result = _wait_for_result(client, job.json["job_id"]).json
+    assert result["summary"]["total_conversations"] == 40
+    # Claimed uploads are consumed.
+    assert client.get(f"/api/uploads/{upload_id}").status_code == 404
+
+
+def test_chunked_upload_checksum_mismatch(client):
+    upload_id = client.post("/api/uploads", json={"sha256": "a" * 64}).json["upload_id"]
+    client.put(f"/api/uploads/{upload_id}?offset=0", data=b"[]")
+    assert client.post(f"/api/uploads/{upload_id}/finalize").status_code == 400
+    assert client.post("/api/categorize", data={"organize_mode": "year", "upload_id": upload_id}).status_code == 409
+    assert client.delete(f"/api/uploads/{upload_id}").status_code == 204
+    assert client.get("/api/uploads/../etc").status_code == 404
+
+def test_job_control_endpoints(client):
+    sample = json.dumps([{"id": "1", "title": "X", "create_time": 1704067200, "mapping": {}}]).encode("utf-8")
+    job_id = client.post("/api/categorize", data={
+        "organize_mode": "year",
+        "file": (io.BytesIO(sample), "export.json")
+    }, content_type="multipart/form-data").json["job_id"]
+    assert _wait_for_result(client, job_id).status_code == 200
+
+    assert client.post("/api/jobs/nope/cancel").status_code == 404
+    assert client.post(f"/api/jobs/{job_id}/restart").status_code == 404
+    assert client.post(f"/api/jobs/{job_id}/cancel").status_code == 409
+
+
+def test_identical_uploads_attach_to_one_job(client):
+    sample = json.dumps([{"id": "1", "title": "Twice", "create_time": 1704067200, "mapping": {}}]).encode("utf-8")
+
+    def submit(mode="month"):
+        return client.post("/api/categorize", data={
+            "organize_mode": mode,
+            "file": (io.BytesIO(sample), "export.json")
+        }, content_type="multipart/form-data").json
+
+    first, second = submit(), submit()
+    assert second == {"job_id": first["job_id"], "deduplicated": True}
+    assert _wait_for_result(client, first["job_id"]).status_code == 200
+    assert submit()["job_id"] == first["job_id"]  # recently completed
+    assert submit(mode="year")["job_id"] != first["job_id"]
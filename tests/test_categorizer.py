@@ -0,0 +1,269 @@
+import json
+import os
+
+import pytest
+
+from app.services.chatgpt_categorizer import ChatGPTCategorizer, _BatchMismatch, system_prompt
+
+
+def _write_export(tmp_path, n):
+    convs = []
+    for i in range(n):
+        convs.append({
+            "id": str(i),
+            "title": f"Conv {i}",
+            "create_time": 1704067200 + i * 3600,
+            "mapping": {"a": {"message": {"create_time": 1, "content": {"parts": [f"hello {i}"]}}}},
+        })
+    path = tmp_path / "conversations.json"
+    path.write_text(json.dumps(convs), encoding="utf-8")
+    return str(path)
+
+
+def test_process_export_runs_batches_concurrently(tmp_path, fake_openai):
+    fake_openai.latency = 0.1
+    fake_openai.category_for = lambda text: "Even" if int(text.split("Conv ")[1].split()[0]) % 2 == 0 else "Odd"
+    path = _write_export(tmp_path, 40)
+    seen = []
+    cat = ChatGPTCategorizer(api_key="sk-test-key", base_url=fake_openai.base_url)
+    result = cat.process_export(path, batch_size=5, max_concurrency=4,
+                                progress_cb=lambda done, total: seen.append((done, total)))
+
+    assert fake_openai.requests == 8
+    assert fake_openai.max_in_flight > 1
+    assert sorted(result) == ["Even", "Odd"]
+    assert all(int(c["id"]) % 2 == 0 for c in result["Even"])
+    assert len(result["Even"]) + len(result["Odd"]) == 40
+    assert seen[-1] == (40, 40)
+
+
+def test_rate_limited_batches_are_retried(tmp_path, fake_openai):
+    fake_openai.rate_limit_first = 2
+    path = _write_export(tmp_path, 10)
+    cat = ChatGPTCategorizer(api_key="sk-test-key", base_url=fake_openai.base_url)
+    result = cat.process_export(path, batch_size=5, max_concurrency=2)
+
+    assert "Uncategorized" not in result
+    assert len(result["Programming & Development"]) == 10
+
+
+def test_cached_labels_skip_the_model(tmp_path, fake_openai):
+    from app.services.label_cache import LabelCache
+
+    path = _write_export(tmp_path, 12)
+    cache = LabelCache(str(tmp_path / "labels.sqlite3"))
+    cat = ChatGPTCategorizer(api_key="sk-test-key", base_url=fake_openai.base_url)
+
+    first_stats = {}
+    first = cat.process_export(path, batch_size=5, cache=cache, stats=first_stats)
+    assert (first_stats["cache_hits"], first_stats["cache_misses"]) == (0, 12)
+    assert fake_openai.requests == 3
+
+    second_stats = {}
+    second = cat.process_export(path, batch_size=5, cache=cache, stats=second_stats)
+    assert (second_stats["cache_hits"], second_stats["cache_misses"]) == (12, 0)
+    assert fake_openai.requests == 3
+    assert second == first
+
+
+def test_batches_respect_token_budget(tmp_path, fake_openai):
+    path = _write_export(tmp_path, 30)
+    cat = ChatGPTCategorizer(api_key="sk-test-key", base_url=fake_openai.base_url)
+    overhead = cat.prompt_overhead_tokens(cat.default_categories)
+    stats = {}
+    # Room for roughly 4 summaries per request even though batch_size allows 25.
+    cat.process_export(path, batch_size=25, token_budget=overhead + 50, stats=stats)
+
+    sizes = [b["size"] for b in stats["batches"]]
+    assert sum(sizes) == 30
+    assert max(sizes) < 25
+    assert stats["usage"]["requests"] == len(sizes)
+    assert all(b["ok"] and b["latency_ms"] is not None for b in stats["batches"])
+
+
+def test_mismatched_reply_is_split_and_retried(tmp_path, fake_openai):
+    fake_openai.drop_last_when_larger_than = 2
+    path = _write_export(tmp_path, 8)
+    cat = ChatGPTCategorizer(api_key="sk-test-key", base_url=fake_openai.base_url)
+    stats = {}
+    result = cat.process_export(path, batch_size=8, max_concurrency=1, stats=stats)
+
+    assert "Uncategorized" not in result
+    assert len(result["Programming & Development"]) == 8
+    # 8 -> 4+4 -> 2+2+2+2
+    assert [b["size"] for b in stats["batches"]] == [8, 4, 2, 2, 4, 2, 2]
+    assert stats["usage"]["failed_requests"] == 3
+
+
+def test_checkpoint_resumes_after_interruption(tmp_path, fake_openai):
+    from app.services.checkpoints import JobCheckpoint, checkpoint_key, file_sha256
+
+    path = _write_export(tmp_path, 20)
+    cat = ChatGPTCategorizer(api_key="sk-test-key", base_url=fake_openai.base_url)
+    key = checkpoint_key(file_sha256(path), cat.default_categories)
+    directory = str(tmp_path / "checkpoints")
+    calls = []
+
+    def crash_on_third_batch():
+        calls.append(1)
+        if len(calls) == 3:
+            raise RuntimeError("worker died")
+
+    first = JobCheckpoint(key, directory)
+    try:
+        cat.process_export(path, batch_size=5, max_concurrency=1, checkpoint=first,
+                           control_cb=crash_on_third_batch)
+    except RuntimeError:
+        pass
+    first.close()
+    assert fake_openai.requests == 2
+    # Labels of users' conversations: readable by the server's user only.
+    assert os.stat(directory).st_mode & 0o777 == 0o700
+    assert os.stat(first.path).st_mode & 0o777 == 0o600
+
+    resumed = JobCheckpoint(key, directory)
+    assert len(resumed.labels) == 10 and resumed.batches == 2
+    stats = {}
+    result = cat.process_export(path, batch_size=5, max_concurrency=1, checkpoint=resumed, stats=stats)
+    assert fake_openai.requests == 4
+    assert stats["resumed"] == 10
+    assert resumed.summary() == {"resumed_batches": 2, "batches": 4}
+    assert [c["id"] for c in result["Programming & Development"]] == [str(i) for i in range(19, -1, -1)]
+
+
+def test_pooled_client_reuses_connections_across_jobs(tmp_path, fake_openai):
+    from app.services.openai_clients import ClientRegistry
+
+    registry = ClientRegistry(ttl_seconds=60, base_url=fake_openai.base_url)
+    path = _write_export(tmp_path, 10)
+    usages = []
+    for _ in range(2):
+        with registry.lease("token-a", "sk-test-key") as client:
+            stats = {}
+            ChatGPTCategorizer(api_key="sk-test-key", client=client).process_export(
+                path, batch_size=5, max_concurrency=1, stats=stats)
+            usages.append(stats["usage"])
+
+    assert usages[0]["connections_opened"] == 1
+    assert usages[1]["connections_opened"] == 0
+    totals = registry.stats()
+    assert totals["clients"] == 1
+    assert (totals["requests"], totals["reused_requests"]) == (4, 3)
+
+    registry.ttl_seconds = 0
+    assert registry.sweep() == 1
+    assert registry.stats()["clients"] == 0
+
+
+def test_compact_answers_map_numbers_and_new_codes_back_to_names():
+    categories = ["Alpha", "Beta"]
+    decode = ChatGPTCategorizer._decode_answers
+    reply = json.dumps({"c": [2, "1", "a", "Gamma", "a"], "new": {"a": "Delta"}})
+    assert decode(reply, categories, 5) == ["Beta", "Alpha", "Delta", "Gamma", "Delta"]
+    for bad in ({"c": [3]}, {"c": [True]}, {"c": [1, 2]}, {"categories": ["Alpha"]}):
+        with pytest.raises(_BatchMismatch):
+            decode(json.dumps(bad), categories, 1)
+    # Undefined codes are never stored as category names; existing names that look like codes are fine.
+    for undefined in (["a"], ["c7"]):
+        with pytest.raises(_BatchMismatch, match="did not name"):
+            decode(json.dumps({"c": undefined, "new": {"b": "Delta"}}), categories, 1)
+    assert decode(json.dumps({"c": ["ml"]}), ["ml"], 1) == ["ml"]
+    assert system_prompt(("Alpha", "Beta")) is system_prompt(("Alpha", "Beta"))
+    assert "1. Alpha\n2. Beta" in system_prompt(("Alpha", "Beta"))
+
+
+def test_compact_protocol_costs_fewer_tokens_than_legacy_prompt():
+    from benchmarks.prompt_tokens import compare
+
+    totals = compare(size=100, batch_size=25)
+    assert totals["compact"]["prompt_tokens"] < totals["legacy"]["prompt_tokens"]
+    assert totals["completion_tokens_saved"] > 0.5
+
+
+def _bulk_categorizer(fake_openai):
+    from app.services.bulk_categorizer import BulkCategorizer
+
+    cat = BulkCategorizer(api_key="sk-test-key", base_url=fake_openai.base_url)
+    cat.poll_seconds = 0.01
+    return cat
+
+
+def test_bulk_mode_submits_one_batch_job_and_maps_answers_back(tmp_path, fake_openai):
+    from app.services.export_reader import iter_conversations
+
+    fake_openai.batch_polls = 2
+    fake_openai.category_for = lambda text: "Even" if int(text.split("Conv ")[1].split()[0]) % 2 == 0 \
+        else "Programming & Development"
+    phases, stats = [], {}
+    result = _bulk_categorizer(fake_openai).process_conversations(
+        iter_conversations(_write_export(tmp_path, 12)), batch_size=5, stats=stats,
+        phase_cb=lambda name, info: phases.append(name))
+
+    assert sorted(c["title"] for c in result["Even"]) == sorted(f"Conv {i}" for i in range(0, 12, 2))
+    assert len(result["Programming & Development"]) == 6
+    assert phases == ["preparing", "submitting", "remote", "remote", "remote", "ingesting"]
+    assert len(fake_openai.batches) == 1 and fake_openai.completions == 3
+    assert stats["bulk"] == {"batch_id": "batch_1", "status": "completed", "requests": 3, "conversations": 12,
+                             "fallback_requests": 0}
+    assert fake_openai.files == {}  # request and output files are deleted from the provider
+
+
+def test_bulk_mode_resends_unusable_answers_synchronously(tmp_path, fake_openai):
+    from app.services.export_reader import iter_conversations
+
+    fake_openai.drop_last_when_larger_than = 2
+    cat = _bulk_categorizer(fake_openai)
+    cat.fallback_max_fraction = 1.0
+    stats = {}
+    result = cat.process_conversations(iter_conversations(_write_export(tmp_path, 8)), batch_size=4, stats=stats)
+
+    assert len(result["Programming & Development"]) == 8
+    assert stats["bulk"]["fallback_requests"] == 2
+    # Two batch lines, then each mismatched batch of 4 re-sent as 4 -> 2+2.
+    assert fake_openai.completions == 2 + 6
+
+
+def test_bulk_mode_fails_instead_of_resending_a_failed_batch_at_full_price(tmp_path, fake_openai):
+    from app.services.export_reader import iter_conversations
+
+    fake_openai.batch_final_status = "expired"
+    with pytest.raises(RuntimeError, match="3 of 3 requests"):
+        _bulk_categorizer(fake_openai).process_conversations(
+            iter_conversations(_write_export(tmp_path, 12)), batch_size=5)
+    assert fake_openai.completions == 0
+    assert fake_openai.files == {}
+
+
+@pytest.mark.parametrize("failing", ["create", "retrieve"])
+def test_bulk_mode_deletes_the_uploaded_requests_when_the_batch_fails(tmp_path, fake_openai, failing):
+    from app.services.export_reader import iter_conversations
+
+    cat = _bulk_categorizer(fake_openai)
+
+    def boom(*args, **kwargs):
+        raise RuntimeError("provider unavailable")
+
+    setattr(cat._client.batches, failing, boom)
+    with pytest.raises(RuntimeError):
+        cat.process_conversations(iter_conversations(_write_export(tmp_path, 6)), batch_size=5)
+    assert len(fake_openai.files) == 0 and fake_openai.requests >= 1
+
+
+def test_concurrent_jobs_on_one_export_keep_separate_checkpoints(tmp_path):
+    from app.services.checkpoints import JobCheckpoint
+
+    directory = str(tmp_path / "checkpoints")
+    first, second = JobCheckpoint("k", directory, job_id="job-1"), JobCheckpoint("k", directory, job_id="job-2")
+    first.record([(0, "A")])
+    second.record([(1, "B")])
+    assert first.path != second.path
+
+    first.discard()  # the first job finishes while the second still runs
+    assert not os.path.exists(first.path)
+    second.record([(2, "C")])
+    second.close()  # ...until the second is interrupted
+
+    resumed = JobCheckpoint("k", directory, job_id="job-3")
+    assert resumed.labels == {1: "B", 2: "C"}
+    resumed.discard()
+    assert os.listdir(directory) == []
@@ -0,0 +1,66 @@
+import csv
+import json
+import subprocess
+import sys
+
+from app import cli
+
+
+def _write_export(path, n):
+    convs = [{"id": f"{path.stem}-{i}", "title": f"Conv {i}", "create_time": 1704067200 + i * 86400 * 40,
+              "update_time": 1704067200 + i * 86400 * 40, "mapping": {}} for i in range(n)]
+    path.write_text(json.dumps(convs))
+    return str(path)
+
+
+def test_organizes_several_exports_in_parallel(tmp_path):
+    (tmp_path / "b").mkdir()
+    first = _write_export(tmp_path / "conversations.json", 12)
+    second = _write_export(tmp_path / "b" / "conversations.json", 5)
+    out = tmp_path / "out"
+
+    assert cli.main([first, second, "--mode", "year", "-o", str(out), "--workers", "2"]) == 0
+
+    a = json.loads((out / "conversations.year.json").read_text())
+    b = json.loads((out / "conversations-2.year.json").read_text())
+    assert a["summary"]["total_conversations"] == 12
+    assert b["summary"]["total_conversations"] == 5
+    assert list(b["time_periods"]) == ["2024"]
+
+
+def test_writes_csv_and_reports_failures(tmp_path):
+    good = _write_export(tmp_path / "good.json", 3)
+    bad = tmp_path / "bad.json"
+    bad.write_text("{not json")
+
+    assert cli.main([good, str(bad), "--mode", "month", "--format", "csv", "-o", str(tmp_path),
+                     "--workers", "1"]) == 1
+    with open(tmp_path / "good.month.csv", newline="") as fh:
+        rows = list(csv.DictReader(fh))
+    assert [r["id"] for r in rows] == ["good-2", "good-1", "good-0"]
+    assert not (tmp_path / "bad.month.csv").exists()
+
+
+def test_category_mode_uses_the_categorizer(monkeypatch, tmp_path, fake_openai):
+    from app.services import label_cache
+
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test-key")
+    monkeypatch.setenv("OPENAI_BASE_URL", fake_openai.base_url)
+    monkeypatch.setattr(label_cache, "DEFAULT_CACHE_PATH", "")
+    path = _write_export(tmp_path / "export.json", 7)
+
+    assert cli.main([path, "--mode", "category", "--batch-size", "5", "-o", str(tmp_path)]) == 0
+    result = json.loads((tmp_path / "export.category.json").read_text())
+    summary = result["summary"]
+    assert summary["total_conversations"] == 7
+    assert summary["cache"] == {"hits": 0, "misses": 7}
+    assert "fraction" in summary["preclassified"]
+    assert fake_openai.requests == 2
+
+
+def test_time_modes_do_not_import_the_web_or_api_stack(tmp_path):
+    path = _write_export(tmp_path / "export.json", 2)
+    code = ("import sys; from app import cli; cli.main([sys.argv[1], '--mode', 'year', '-o', sys.argv[2]]); "
+            "loaded = {'flask', 'flask_limiter', 'cryptography', 'openai', 'numpy'} & set(sys.modules); "
+            "assert not loaded, loaded")
+    subprocess.run([sys.executable, "-c", code, path, str(tmp_path)], check=True)
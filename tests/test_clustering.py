@@ -0,0 +1,30 @@
+from collections import Counter
+
+from app.services.clustering import UNCLUSTERED, ConversationClusterer
+from benchmarks.synthetic_export import iter_export
+
+
+def test_clusters_separate_topics():
+    convs = list(iter_export(700, seed=4, max_turns=6))
+    topic = {c["id"]: c["topic"] for c in convs}
+    stats = {}
+    result = ConversationClusterer(n_clusters=7).cluster(iter(convs), stats=stats)
+
+    assert sum(len(v) for v in result.values()) == 700
+    assert stats["clusters"] == 7 and stats["unclustered"] == 0
+    # Each cluster should be dominated by one synthetic topic.
+    purity = sum(Counter(topic[c["id"]] for c in v).most_common(1)[0][1] for v in result.values()) / 700
+    assert purity > 0.9
+    assert all(" / " in label for label in result)
+
+
+def test_conversations_without_terms_are_uncategorized():
+    convs = [
+        {"id": "1", "title": "Python flask error", "mapping": {}},
+        {"id": "2", "title": "Python flask traceback", "mapping": {}},
+        {"id": "3", "title": "", "mapping": {}},
+    ]
+    result = ConversationClusterer().cluster(convs)
+    assert [c["id"] for c in result[UNCLUSTERED]] == ["3"]
+    assert sum(len(v) for v in result.values()) == 3
+    assert ConversationClusterer().cluster([]) == {}
@@ -0,0 +1,36 @@
+import json
+
+import numpy as np
+import pytest
+
+from app.services.conversation import parse_conversation
+from app.utils import codec
+from benchmarks.synthetic_export import iter_export, write_export
+
+
+def test_dumps_round_trips_and_falls_back_for_what_fast_backends_refuse():
+    doc = {"title": "Café ☕", "n": [1, 2.5, None, True], "big": 2 ** 70, "np": np.float64(0.25)}
+    raw = codec.dumps(doc)
+    assert isinstance(raw, bytes) and b", " not in raw and b": " not in raw
+    assert json.loads(raw) == {"title": "Café ☕", "n": [1, 2.5, None, True], "big": 2 ** 70, "np": 0.25}
+    assert codec.loads(codec.dumps_str({"b": 1, "a": 2}, sort_keys=True)) == {"a": 2, "b": 1}
+    assert codec.dumps_str({"b": 1, "a": 2}, sort_keys=True) == '{"a":2,"b":1}'
+
+
+def test_typed_export_decoding_matches_full_decode(monkeypatch, tmp_path):
+    pytest.importorskip("msgspec")
+    from app.services import export_reader
+    from app.services.export_reader import iter_conversations
+
+    monkeypatch.setattr(export_reader, "TYPED_DECODE_MAX_BYTES", 1 << 30)
+
+    path = tmp_path / "conversations.json"
+    write_export(str(path), 40, seed=5)
+    edge = [{"id": 1, "mapping": {"a": {}, "b": {"message": None}, "c": {"message": {}},
+                                  "d": {"message": {"content": "hi", "create_time": None}}}},
+            {"title": None, "mapping": None}]
+    for full, typed in zip(list(iter_export(40, seed=5)) + edge,
+                           list(iter_conversations(str(path))) + list(codec.decode_export(json.dumps(edge).encode()))):
+        a, b = parse_conversation(full), parse_conversation(typed)
+        assert (a.id, a.title, a.create_time, a.update_time, a.message_count, a.summary) == \
+            (b.id, b.title, b.create_time, b.update_time, b.message_count, b.summary)
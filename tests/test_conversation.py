@@ -0,0 +1,47 @@
+import random
+
+from app.services.chatgpt_categorizer import ChatGPTCategorizer
+from app.services.conversation import parse_conversation, summarize
+from benchmarks.synthetic_export import iter_export
+
+
+def test_parse_conversation_matches_full_sort():
+    cat = ChatGPTCategorizer(api_key="sk-test-key")
+    rng = random.Random(1)
+    for conv in iter_export(50, seed=3, max_turns=30):
+        # Shuffle node order and add ties/missing times so the heap has to do real work.
+        nodes = list(conv["mapping"].items())
+        rng.shuffle(nodes)
+        for _, node in nodes[:5]:
+            if node["message"]:
+                node["message"]["create_time"] = None
+        conv["mapping"] = dict(nodes)
+
+        messages = cat.extract_messages_from_mapping(conv["mapping"])
+        record = parse_conversation(conv)
+        assert record.message_count == len(messages)
+        assert record.head == messages[:5]
+        assert record.summary == cat.extract_conversation_summary(conv["title"], messages)
+
+
+def test_parse_conversation_keeps_mapping_order_when_times_incomparable():
+    mapping = {str(i): {"message": {"create_time": t, "content": {"parts": [str(i)]}}}
+               for i, t in enumerate([5, "late", 1, 3, 2, 4])}
+    record = parse_conversation({"id": "x", "mapping": mapping})
+    assert record.message_count == 6
+    assert [m["content"]["parts"][0] for m in record.head] == ["0", "1", "2", "3", "4"]
+    assert parse_conversation({"mapping": None}, head_size=0).message_count == 0
+
+
+def test_summary_shares_token_budget_between_parts():
+    messages = [{"content": {"parts": ["short question?"]}},
+                {"content": {"parts": ["x" * 5000]}},
+                {"content": {"parts": ["line one\n\n    line   two " + "y" * 5000]}}]
+    summary = summarize("A  title", messages, max_tokens=100)
+    head, short, long_a, long_b = summary.split("\n")
+
+    assert head == "Title: A title"
+    assert short == "short question?"  # kept whole; its leftover goes to the long parts
+    assert long_b.startswith("line one line two y")
+    assert abs(len(long_a) - len(long_b)) <= 1
+    assert len(summary) <= 100 * 4
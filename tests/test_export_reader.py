@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+from app.services.export_reader import count_conversations, iter_conversations
+
+
+def _conv(i):
+    return {"id": str(i), "title": f"T{i} with \"quotes\" and ] brackets,", "create_time": 1704067200 + i,
+            "mapping": {"n": {"message": {"content": {"parts": ["x" * 500]}}}}}
+
+
+def test_iter_conversations_small_chunks(tmp_path):
+    convs = [_conv(i) for i in range(50)]
+    path = tmp_path / "conversations.json"
+    path.write_text(json.dumps(convs, indent=2), encoding="utf-8")
+    assert list(iter_conversations(str(path), chunk_chars=7)) == convs
+    assert count_conversations(str(path)) == 50
+
+
+def test_iter_conversations_single_object_and_empty_array(tmp_path):
+    path = tmp_path / "one.json"
+    path.write_text(json.dumps(_conv(1)), encoding="utf-8")
+    assert list(iter_conversations(str(path))) == [_conv(1)]
+    path.write_text(" [ ] ", encoding="utf-8")
+    assert list(iter_conversations(str(path))) == []
+
+
+def test_iter_conversations_truncated(tmp_path):
+    path = tmp_path / "bad.json"
+    path.write_text(json.dumps([_conv(1), _conv(2)])[:-20], encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(iter_conversations(str(path), chunk_chars=16))
+
+
+def test_iter_conversations_reads_gzip_and_export_zip(tmp_path):
+    import gzip
+    import zipfile
+
+    convs = [_conv(i) for i in range(20)]
+    raw = json.dumps(convs).encode("utf-8")
+    gz = tmp_path / "conversations.json.gz"
+    gz.write_bytes(gzip.compress(raw))
+    assert list(iter_conversations(str(gz), chunk_chars=64)) == convs
+
+    zipped = tmp_path / "export.zip"
+    with zipfile.ZipFile(zipped, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("chat.html", "<html></html>")
+        zf.writestr("backup/conversations.json", b"[]")
+        zf.writestr("conversations.json", raw)
+    assert list(iter_conversations(str(zipped))) == convs
+
+    no_member = tmp_path / "other.zip"
+    with zipfile.ZipFile(no_member, "w") as zf:
+        zf.writestr("user.json", "{}")
+    with pytest.raises(ValueError, match="conversations.json"):
+        list(iter_conversations(str(no_member)))
+
+
+def _peak_bytes(fn):
+    import tracemalloc
+
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_memory_stays_flat_with_msgspec_installed(monkeypatch, tmp_path):
+    pytest.importorskip("msgspec")
+    from app.services import export_reader
+    from app.utils import codec
+    from benchmarks.synthetic_export import write_export
+
+    path = tmp_path / "conversations.json"
+    write_export(str(path), 1000, seed=3)
+    size = path.stat().st_size
+
+    # Typed decoding is opt-in: by default even msgspec installs stream.
+    assert _peak_bytes(lambda: sum(1 for _ in iter_conversations(str(path)))) < size / 10
+    assert _peak_bytes(lambda: count_conversations(str(path))) < size / 10
+
+    # Opted in, the export is held once (not the whole limit), and counting skips
+    # the elements instead of decoding the export a second time.
+    monkeypatch.setattr(export_reader, "TYPED_DECODE_MAX_BYTES", 1 << 30)
+    monkeypatch.setattr(codec, "decode_export", lambda data: pytest.fail("counted by decoding"))
+    assert count_conversations(str(path)) == 1000
+    assert _peak_bytes(lambda: count_conversations(str(path))) < size * 1.5
@@ -0,0 +1,199 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from app.services import jobs
+from app.services.store import JOBS
+
+
+def _record():
+    return {'status': 'queued', 'progress': 0, 'processed': 0, 'total': 1,
+            'message': 'Queued', 'result': None, 'error': None}
+
+
+def _wait(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_scheduler_runs_by_priority_and_publishes_positions(monkeypatch, tmp_path):
+    started, release = [], threading.Event()
+
+    def fake_process_job(job_id, *args, **kwargs):
+        started.append(job_id)
+        release.wait(5)
+        JOBS.update(job_id, status='done')
+
+    monkeypatch.setattr(jobs, "process_job", fake_process_job)
+    scheduler = jobs.JobScheduler(max_running=1)
+    for job_id in ("s-first", "s-low", "s-high"):
+        JOBS[job_id] = _record()
+    scheduler.submit("s-first", None, str(tmp_path / "a"), priority='normal')
+    assert _wait(lambda: started == ["s-first"])
+    scheduler.submit("s-low", None, str(tmp_path / "b"), priority='low')
+    scheduler.submit("s-high", None, str(tmp_path / "c"), priority='high')
+
+    assert scheduler.queued() == ["s-high", "s-low"]
+    assert scheduler.queued_count() == 2
+    assert JOBS.get("s-high")["queue_position"] == 1
+    assert JOBS.get("s-low")["queue_position"] == 2
+
+    release.set()
+    assert _wait(lambda: len(started) == 3)
+    assert started == ["s-first", "s-high", "s-low"]
+
+
+def test_cancel_queued_job_removes_it_and_its_upload(monkeypatch, tmp_path):
+    release = threading.Event()
+    monkeypatch.setattr(jobs, "process_job", lambda job_id, *a, **k: release.wait(5))
+    monkeypatch.setattr(jobs, "SCHEDULER", jobs.JobScheduler(max_running=1))
+    upload = tmp_path / "upload.json"
+    upload.write_text("[]")
+    JOBS["c-running"] = _record()
+    JOBS["c-queued"] = _record()
+    jobs.submit_job("c-running", None, str(tmp_path / "other"))
+    jobs.submit_job("c-queued", None, str(upload))
+
+    jobs.cancel_job("c-queued")
+    release.set()
+    assert JOBS.get("c-queued")["status"] == 'cancelled'
+    assert not upload.exists()
+    assert jobs.SCHEDULER.queued() == []
+
+
+def test_check_job_control_pauses_until_resumed_then_cancels():
+    JOBS["p-job"] = dict(_record(), status='processing')
+    jobs.check_job_control("p-job")  # no request: returns at once
+
+    jobs.pause_job("p-job")
+    outcome = []
+
+    def worker():
+        try:
+            jobs.check_job_control("p-job")
+            outcome.append("resumed")
+            jobs.check_job_control("p-job")
+        except jobs.JobCancelled:
+            outcome.append("cancelled")
+
+    t = threading.Thread(target=worker)
+    t.start()
+    assert _wait(lambda: JOBS.get("p-job")["status"] == 'paused')
+    assert not outcome
+    jobs.resume_job("p-job")
+    assert _wait(lambda: outcome == ["resumed"])
+    assert JOBS.get("p-job")["status"] == 'processing'
+
+    jobs.cancel_job("p-job")
+    t.join(5)
+    assert outcome == ["resumed"]  # the second check ran before the cancel
+    with pytest.raises(jobs.JobCancelled):
+        jobs.check_job_control("p-job")
+
+
+def test_job_cancelled_before_it_starts_ends_cancelled(tmp_path):
+    upload = tmp_path / "upload.json"
+    upload.write_text("[]")
+    JOBS["early-cancel"] = dict(_record(), control='cancel')
+    jobs.process_job("early-cancel", None, str(upload), "year", None, 25, 1)
+    assert JOBS.get("early-cancel")["status"] == 'cancelled'
+    assert not upload.exists()
+
+
+def _bulk_upload(monkeypatch, tmp_path, fake_openai):
+    from app.services.bulk_categorizer import BulkCategorizer
+
+    monkeypatch.setenv("OPENAI_BASE_URL", fake_openai.base_url)
+    monkeypatch.setattr(BulkCategorizer, "poll_seconds", 0.02)
+    monkeypatch.setattr(jobs, "get_label_cache", lambda: None)
+    monkeypatch.setattr(jobs, "CHECKPOINTS_ENABLED", False)
+    fake_openai.batch_polls = 10 ** 6  # remote until the test lets it finish
+    upload = tmp_path / "upload.json"
+    upload.write_text(json.dumps([{"id": str(i), "title": f"Bulk {i}", "create_time": 1704067200,
+                                   "mapping": {}} for i in range(7)]))
+    return str(upload)
+
+
+def test_bulk_job_gives_its_slot_back_while_the_batch_runs(monkeypatch, tmp_path, fake_openai, client):
+    upload = _bulk_upload(monkeypatch, tmp_path, fake_openai)
+    other = tmp_path / "other.json"
+    other.write_text("[]")
+    scheduler = jobs.JobScheduler(max_running=1)
+    JOBS["bulk-job"], JOBS["year-job"] = _record(), _record()
+
+    scheduler.submit("bulk-job", "sk-test-key", upload, "category", None, 5, 2, bulk=True)
+    assert _wait(lambda: JOBS.get("bulk-job")["status"] == 'waiting')
+    scheduler.submit("year-job", None, str(other), "year", None, 25, 1, priority='high')
+    assert _wait(lambda: JOBS.get("year-job")["status"] == 'done')
+    assert JOBS.get("bulk-job")["status"] == 'waiting' and scheduler.batches.waiting() == ["bulk-job"]
+
+    fake_openai.batch_polls = 0
+    assert _wait(lambda: JOBS.get("bulk-job")["status"] == 'done')
+    job = JOBS.get("bulk-job")
+    assert job["result"]["summary"]["total_conversations"] == 7
+    assert job["result"]["summary"]["bulk"]["requests"] == 2
+    progress = client.get("/api/progress/bulk-job").json
+    assert progress["phase"] == "ingesting"
+    assert progress["remote"]["status"] == "completed"
+    assert fake_openai.files == {}
+    assert jobs.take_job_key("bulk-job") is None
+
+
+def test_cancelling_a_waiting_bulk_job_cancels_its_batch(monkeypatch, tmp_path, fake_openai):
+    upload = _bulk_upload(monkeypatch, tmp_path, fake_openai)
+    scheduler = jobs.JobScheduler(max_running=1)
+    JOBS["bulk-cancel"] = _record()
+
+    scheduler.submit("bulk-cancel", "sk-test-key", upload, "category", None, 5, 2, bulk=True)
+    assert _wait(lambda: JOBS.get("bulk-cancel")["status"] == 'waiting')
+    workdir = JOBS.get("bulk-cancel")["parked"]["workdir"]
+    JOBS.update("bulk-cancel", control='cancel')
+    scheduler.batches.wake()
+
+    assert _wait(lambda: JOBS.get("bulk-cancel")["status"] == 'cancelled')
+    assert fake_openai.batches["batch_1"]["status"] == "cancelled"
+    assert fake_openai.files == {}
+    assert not os.path.exists(workdir)
+    assert scheduler.batches.waiting() == []
+
+
+def test_category_job_decrypts_the_key_held_for_it(monkeypatch, tmp_path, fake_openai):
+    from app.services.store import KEY_STORE
+    from app.utils.keys import FERNET
+
+    monkeypatch.setenv("OPENAI_BASE_URL", fake_openai.base_url)
+    monkeypatch.setattr(jobs, "get_label_cache", lambda: None)
+    monkeypatch.setattr(jobs, "CHECKPOINTS_ENABLED", False)
+    KEY_STORE["held-token"] = {"enc_key": FERNET.encrypt(b"sk-test-key"), "exp": int(time.time()) + 60}
+    upload = tmp_path / "upload.json"
+    upload.write_text(json.dumps([{"id": "1", "title": "Held", "create_time": 1704067200, "mapping": {}}]))
+    JOBS["held-job"] = _record()
+
+    assert jobs.hold_job_key("held-job", "held-token")
+    KEY_STORE.pop("held-token")  # the user's token may expire while the job queues
+    jobs.process_job("held-job", None, str(upload), "category", None, 5, 1)
+
+    assert JOBS.get("held-job")["status"] == 'done'
+    assert fake_openai.requests == 1
+    assert jobs.take_job_key("held-job") is None  # used once, then dropped
+
+
+def test_upload_benchmark_runs_a_job_every_pass(tmp_path):
+    import subprocess
+    import sys
+
+    env = {k: v for k, v in os.environ.items() if k != "JOB_DEDUPE_SECONDS"}
+    out = tmp_path / "bench.json"
+    # The timed pass and the tracemalloc pass post the same export; a deduplicated
+    # second upload makes the benchmark fail instead of timing a no-op.
+    subprocess.run([sys.executable, "-m", "benchmarks.run", "--sizes", "20", "--only", "upload_categorize_request",
+                    "--output", str(out)], check=True, env=env, capture_output=True,
+                   cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert json.loads(out.read_text())["results"][0]["name"] == "upload_categorize_request"
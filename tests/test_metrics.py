@@ -0,0 +1,129 @@
+import io
+import json
+import logging
+import threading
+import time
+
+import pytest
+
+from app.utils.logs import ThrottleFilter
+from app.utils.metrics import Registry
+from app.utils.profiler import StackSampler
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests.", ("outcome",))
+    latency = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    registry.gauge("queued", "Queued jobs.", function=lambda: 3)
+    requests.inc(outcome="ok")
+    requests.inc(2, outcome="failed")
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE latency_seconds histogram" in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert "latency_seconds_count 3" in lines
+    assert 'requests_total{outcome="failed"} 2' in lines
+    assert "queued 3" in lines
+
+
+def _metrics_client(monkeypatch, token=""):
+    from app import create_app
+    from app.config import Config
+
+    monkeypatch.setattr(Config, "METRICS_ENABLED", True)
+    monkeypatch.setattr(Config, "METRICS_TOKEN", token)
+    return create_app().test_client()
+
+
+def test_metrics_endpoint_is_off_by_default_and_guarded(monkeypatch, client):
+    assert client.get("/metrics").status_code == 404
+
+    local = _metrics_client(monkeypatch)
+    assert local.get("/metrics").status_code == 200  # the test client is 127.0.0.1
+    assert local.get("/metrics", environ_base={"REMOTE_ADDR": "203.0.113.7"}).status_code == 403
+
+    guarded = _metrics_client(monkeypatch, token="scrape-secret")
+    assert guarded.get("/metrics").status_code == 403
+    assert guarded.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 403
+    assert guarded.get("/metrics", environ_base={"REMOTE_ADDR": "203.0.113.7"},
+                       headers={"Authorization": "Bearer scrape-secret"}).status_code == 200
+
+
+def test_metrics_endpoint_reports_routes_and_jobs(monkeypatch):
+    from app.services.jobs import JOB_DURATION
+
+    client = _metrics_client(monkeypatch)
+
+    finished_before = JOB_DURATION.count(organize_mode="year", status="done")
+    # A title no other test uses, so the request isn't deduplicated onto an earlier job.
+    sample = json.dumps([{"id": "1", "title": "Metrics", "create_time": 1704067200, "mapping": {}}]).encode("utf-8")
+    job_id = client.post("/api/categorize", data={
+        "organize_mode": "year",
+        "file": (io.BytesIO(sample), "export.json")
+    }, content_type="multipart/form-data").json["job_id"]
+    # The scheduler records a job just after it returns.
+    deadline = time.time() + 5
+    while JOB_DURATION.count(organize_mode="year", status="done") == finished_before and time.time() < deadline:
+        time.sleep(0.02)
+    assert client.get(f"/api/progress/{job_id}").json["status"] == "done"
+
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{blueprint="api",route="/api/categorize",method="POST",status="200"}' \
+        in body
+    assert 'job_duration_seconds_count{organize_mode="year",status="done"}' in body
+    assert "jobs_queued 0" in body
+    assert 'job_rss_growth_bytes{organize_mode="year"}' in body
+
+
+def test_throttle_filter_passes_one_record_per_key_and_interval():
+    throttle = ThrottleFilter(interval=60)
+
+    def record(key):
+        rec = logging.LogRecord("app", logging.INFO, __file__, 1, "msg", (), None)
+        if key:
+            rec.throttle = key
+        return rec
+
+    assert throttle.filter(record("progress:a"))
+    assert not throttle.filter(record("progress:a"))
+    assert throttle.filter(record("progress:b"))
+    assert throttle.filter(record(None)) and throttle.filter(record(None))
+
+
+def test_stack_sampler_collects_collapsed_stacks():
+    done = threading.Event()
+
+    def busy_wait_here():
+        while not done.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=busy_wait_here)
+    worker.start()
+    sampler = StackSampler(thread_id=worker.ident, interval=0.002).start()
+    time.sleep(0.1)
+    sampler.stop()
+    done.set()
+    worker.join()
+
+    assert sampler.samples > 0
+    assert "busy_wait_here (test_metrics.py:" in sampler.collapsed()
+
+
+def test_rss_sampler_reports_the_peak_within_its_window():
+    from app.utils.profiler import RssSampler, current_rss_bytes
+
+    if current_rss_bytes() is None:
+        pytest.skip("needs /proc")
+    sampler = RssSampler(interval=0.005).start()
+    block = bytearray(64 * 1024 * 1024)
+    block[::4096] = b"x" * len(block[::4096])  # touch every page
+    time.sleep(0.05)
+    del block
+    sampler.stop()
+
+    assert sampler.growth_bytes >= 48 * 1024 * 1024
@@ -0,0 +1,83 @@
+from app.services.chatgpt_categorizer import ChatGPTCategorizer
+from app.services.label_cache import LabelCache
+from app.services.preclassifier import NaiveBayesModel, Preclassifier, features
+
+CATEGORIES = ['Programming & Development', 'Data Science & ML', 'Personal Advice', 'Business & Strategy']
+
+
+def test_rules_label_only_clear_cases():
+    pre = Preclassifier(CATEGORIES)
+    assert pre.classify("Title: Python traceback in Flask\nWhy does my SQL import fail?") == \
+        'Programming & Development'
+    # Python and pandas/numpy: too close to call, leave it to the model.
+    assert pre.classify("Title: Python pandas question\nnumpy regression with python") is None
+    assert pre.classify("Title: Weekend plans\nWhat should I do on Saturday?") is None
+    assert pre.summary() == {"rules": 1, "model": 0}
+    # Rules only apply to categories in the job's list.
+    assert Preclassifier(['Cooking']).classify("Title: Python traceback\nflask sql") is None
+
+
+def test_model_trained_from_cache_counts(tmp_path):
+    cache = LabelCache(str(tmp_path / "labels.sqlite3"))
+    training = [("Personal Advice", f"Title: feeling stuck {i}\nadvice about my sleep habit and routine")
+                for i in range(30)]
+    training += [("Business & Strategy", f"Title: pitch deck {i}\ninvestor roadmap and funnel metrics")
+                 for i in range(30)]
+    cache.add_term_counts((label, features(text)) for label, text in training)
+
+    docs, _ = cache.term_counts()
+    assert docs == {"Personal Advice": 30, "Business & Strategy": 30}
+    model = NaiveBayesModel.from_cache(cache, CATEGORIES)
+    assert model.labels == ["Personal Advice", "Business & Strategy"]
+
+    pre = Preclassifier(CATEGORIES, rules={}, model=model)
+    assert pre.classify("Title: sleep\nmy routine and habit keep slipping") == "Personal Advice"
+    assert pre.classify("Title: hello\nunrelated words entirely") is None
+    assert pre.summary() == {"rules": 0, "model": 1}
+
+
+def test_preclassified_conversations_skip_the_model(tmp_path, fake_openai):
+    convs = [{"id": str(i), "title": f"Python traceback {i}",
+              "mapping": {"a": {"message": {"content": {"parts": ["flask sql error"]}}}}} for i in range(6)]
+    convs += [{"id": str(i), "title": f"Weekend {i}",
+               "mapping": {"a": {"message": {"content": {"parts": ["what should I do"]}}}}} for i in range(6, 10)]
+    fake_openai.category_for = lambda text: "Personal Advice"
+    cache = LabelCache(str(tmp_path / "labels.sqlite3"))
+    cat = ChatGPTCategorizer(api_key="sk-test-key", base_url=fake_openai.base_url)
+    stats = {}
+    result = cat.process_conversations(convs, batch_size=5, cache=cache, stats=stats,
+                                       preclassifier=Preclassifier(cat.default_categories))
+
+    assert [c["id"] for c in result["Programming & Development"]] == [str(i) for i in range(6)]
+    assert len(result["Personal Advice"]) == 4
+    assert stats["preclassified"] == {"rules": 6, "model": 0}
+    assert sum(b["size"] for b in stats["batches"]) == 4
+    # Only model answers are cached and counted for training.
+    assert len(cache) == 4
+    assert cache.term_counts()[0] == {"Personal Advice": 4}
+
+
+def test_trained_model_is_reused_until_counts_change(tmp_path):
+    cache = LabelCache(str(tmp_path / "labels.sqlite3"))
+    samples = [("Personal Advice", features(f"sleep routine habit {i}")) for i in range(25)]
+    samples += [("Business & Strategy", features(f"investor pitch funnel {i}")) for i in range(25)]
+    cache.add_term_counts(samples)
+
+    model = NaiveBayesModel.from_cache(cache, CATEGORIES)
+    assert NaiveBayesModel.from_cache(cache, CATEGORIES) is model
+    cache.add_term_counts([("Personal Advice", features("more sleep"))])
+    assert NaiveBayesModel.from_cache(cache, CATEGORIES) is not model
+
+
+def test_eviction_drops_counts_of_labels_no_longer_cached(tmp_path):
+    cache = LabelCache(str(tmp_path / "labels.sqlite3"))
+    cache.put_many([("k1", "Personal Advice"), ("k2", "Cooking")])
+    cache.add_term_counts([("Personal Advice", features("sleep")), ("Cooking", features("pasta"))])
+    generation = cache.generation()
+
+    cache._conn.execute("UPDATE labels SET accessed_at = 0 WHERE key = 'k1'")
+    cache.max_entries = 1  # "k1" goes, and with it the last "Personal Advice" entry
+    cache.evict()
+
+    assert cache.term_counts() == ({"Cooking": 1}, {"Cooking": features("pasta")})
+    assert cache.generation() > generation
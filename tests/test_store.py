@@ -0,0 +1,218 @@
+import stat
+from time import time
+
+from app.services.store import JobStore, KeyStore
+
+
+def _record():
+    return {'status': 'processing', 'progress': 0, 'processed': 0, 'total': 1,
+            'message': 'Queued', 'result': None, 'error': None}
+
+
+def test_results_spill_to_disk_beyond_budget(tmp_path):
+    jobs = JobStore(max_resident_bytes=200, spill_dir=str(tmp_path), ttl_seconds=60)
+    for jid in ("a", "b"):
+        jobs[jid] = _record()
+        jobs.update(jid, status='done', result={"categories": {"X": [{"id": jid, "title": "t" * 120}]}})
+
+    assert jobs.is_spilled("a")
+    assert not jobs.is_spilled("b")
+    assert jobs.resident_bytes <= 200
+    assert jobs.get("a")["result"]["categories"]["X"][0]["id"] == "a"
+    assert jobs.get("a", include_result=False)["result"] is None
+
+
+def test_sweep_expires_finished_jobs_and_spill_files(tmp_path):
+    jobs = JobStore(max_resident_bytes=0, spill_dir=str(tmp_path), ttl_seconds=0)
+    jobs["old"] = _record()
+    jobs["running"] = _record()
+    jobs.update("old", status='done', result={"time_periods": {}}, finished_at=time() - 10)
+
+    assert jobs.sweep() == 1
+    assert "old" not in jobs and "running" in jobs
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_key_store_expires_tokens():
+    keys = KeyStore()
+    keys["live"] = {"enc_key": b"x", "exp": int(time()) + 60}
+    keys["dead"] = {"enc_key": b"x", "exp": int(time()) - 1}
+    assert keys.sweep() == 1
+    assert keys.get("live") is not None
+    assert keys.get("dead") is None
+
+
+def _mark_done_in_child(db_path, job_id):
+    from app.services.store import SQLiteJobStore
+    SQLiteJobStore(db_path).update(job_id, status='done', progress=100, result={"categories": {"A": []}})
+
+
+def test_sqlite_store_is_shared_across_processes(tmp_path):
+    import multiprocessing
+
+    from app.services.store import SQLiteJobStore
+
+    db_path = str(tmp_path / "jobs.sqlite3")
+    jobs = SQLiteJobStore(db_path, ttl_seconds=60)
+    jobs["j1"] = _record()
+    assert jobs.get("j1")["status"] == 'processing'
+
+    proc = multiprocessing.get_context("spawn").Process(target=_mark_done_in_child, args=(db_path, "j1"))
+    proc.start()
+    proc.join(30)
+    assert proc.exitcode == 0
+
+    job = jobs.get("j1")
+    assert job["status"] == 'done' and job["progress"] == 100
+    assert job["result"] == {"categories": {"A": []}}
+    assert jobs.get("j1", include_result=False)["result"] is None
+    assert jobs.update("missing", status='done') is False
+
+
+def test_attach_is_single_flight_on_both_backends(tmp_path):
+    from app.services.store import SQLiteJobStore
+
+    for jobs in (JobStore(spill_dir=str(tmp_path)), SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))):
+        jobs["first"] = _record()
+        jobs["second"] = _record()
+        assert jobs.attach("k", "first", max_age=60) == "first"
+        assert jobs.attach("k", "second", max_age=60) == "first"  # in flight
+
+        jobs.update("first", status='done', finished_at=time() - 120)
+        assert jobs.attach("k", "second", max_age=60) == "second"  # finished too long ago
+
+        jobs["third"] = _record()
+        jobs.update("second", status='cancelled')
+        assert jobs.attach("k", "third", max_age=60) == "third"  # never reuse a cancelled job
+
+
+def test_spill_files_are_private(tmp_path):
+    spill_dir = tmp_path / "spill"
+    jobs = JobStore(max_resident_bytes=0, spill_dir=str(spill_dir), ttl_seconds=60)
+    jobs["p"] = _record()
+    jobs.update("p", status='done', result={"categories": {"X": [{"id": "p", "title": "secret"}]}})
+
+    assert jobs.is_spilled("p")
+    assert stat.S_IMODE(spill_dir.stat().st_mode) == 0o700
+    assert [stat.S_IMODE(p.stat().st_mode) for p in spill_dir.iterdir()] == [0o600]
+    assert jobs.get("p")["result"]["categories"]["X"][0]["title"] == "secret"
+
+
+def test_sqlite_store_file_is_private(tmp_path):
+    from app.services.store import SQLiteJobStore
+
+    db_path = tmp_path / "data" / "jobs.sqlite3"
+    jobs = SQLiteJobStore(str(db_path), ttl_seconds=60)
+    jobs["s"] = _record()
+
+    assert stat.S_IMODE(db_path.parent.stat().st_mode) == 0o700
+    assert {p.name: stat.S_IMODE(p.stat().st_mode) for p in db_path.parent.iterdir()} == {
+        "jobs.sqlite3": 0o600, "jobs.sqlite3-wal": 0o600, "jobs.sqlite3-shm": 0o600}
+
+
+def test_sqlite_key_store_resolves_tokens_from_any_instance(tmp_path):
+    from app.services.store import SQLiteKeyStore
+
+    db_path = str(tmp_path / "jobs.sqlite3")
+    registered, other = SQLiteKeyStore(db_path), SQLiteKeyStore(db_path)
+    registered["live"] = {"enc_key": b"ciphertext", "exp": int(time()) + 60}
+    registered["dead"] = {"enc_key": b"old", "exp": int(time()) - 1}
+
+    assert other.get("live") == {"enc_key": b"ciphertext", "exp": registered.get("live")["exp"]}
+    assert "live" in other and len(other) == 2
+    assert other.sweep() == 1
+    assert other.pop("live")["enc_key"] == b"ciphertext"
+    assert registered.get("live") is None
+
+
+def test_result_index_directory_is_private(tmp_path):
+    import os
+
+    from app.services.result_index import build_index
+
+    index_dir = tmp_path / "index"
+    index_dir.mkdir(mode=0o755)
+    os.chmod(index_dir, 0o755)
+    path = build_index("j", {"categories": {"A": [{"id": "1", "title": "t"}]}}, index_dir=str(index_dir))
+
+    assert stat.S_IMODE(index_dir.stat().st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_uploads_are_private(tmp_path):
+    import os
+
+    from app.services.uploads import UploadStore
+
+    uploads = UploadStore(directory=str(tmp_path / "uploads"))
+    upload_id = uploads.create(filename="conversations.json")["upload_id"]
+
+    assert stat.S_IMODE(os.stat(uploads.directory).st_mode) == 0o700
+    assert {p.name: stat.S_IMODE(p.stat().st_mode) for p in (tmp_path / "uploads").iterdir()} == {
+        f"{upload_id}.json": 0o600, f"{upload_id}.part": 0o600}
+
+
+def test_server_key_is_generated_private(monkeypatch, tmp_path):
+    import os
+
+    from app.utils import keys
+
+    key_dir = tmp_path / "instance"
+    monkeypatch.delenv("SERVER_ENC_KEY", raising=False)
+    monkeypatch.setattr(keys, "DEFAULT_KEY_DIR", str(key_dir))
+    monkeypatch.setattr(keys, "DEFAULT_KEY_PATH", str(key_dir / "server_secret.key"))
+
+    key = keys.load_or_create_fernet_key()
+
+    assert keys.load_or_create_fernet_key() == key
+    assert stat.S_IMODE(os.stat(key_dir).st_mode) == 0o700
+    assert {p.name: stat.S_IMODE(p.stat().st_mode) for p in key_dir.iterdir()} == {"server_secret.key": 0o600}
+
+
+def test_label_cache_is_private(tmp_path):
+    from app.services.label_cache import LabelCache
+
+    cache_dir = tmp_path / "cache"
+    cache = LabelCache(str(cache_dir / "labels.sqlite3"))
+    cache.put_many([("k", "Alpha")])
+
+    assert stat.S_IMODE(cache_dir.stat().st_mode) == 0o700
+    assert {p.name: stat.S_IMODE(p.stat().st_mode) for p in cache_dir.iterdir()} == {
+        "labels.sqlite3": 0o600, "labels.sqlite3-wal": 0o600, "labels.sqlite3-shm": 0o600}
+
+
+def test_upload_chunks_are_serialized_across_processes(tmp_path):
+    import io
+    import os
+    import threading
+
+    import pytest
+
+    fcntl = pytest.importorskip("fcntl")
+    from app.services.uploads import UploadError, UploadStore
+
+    uploads = UploadStore(directory=str(tmp_path / "uploads"))
+    upload_id = uploads.create()["upload_id"]
+    part = os.path.join(uploads.directory, f"{upload_id}.part")
+    results = []
+
+    def append_at_zero():
+        try:
+            results.append(uploads.append(upload_id, 0, io.BytesIO(b"abc")))
+        except UploadError as e:
+            results.append(e)
+
+    # Another worker process holds the upload: this one waits instead of writing beside it.
+    with open(part, "rb") as other:
+        fcntl.flock(other, fcntl.LOCK_EX)
+        worker = threading.Thread(target=append_at_zero)
+        worker.start()
+        worker.join(0.2)
+        assert worker.is_alive() and results == []
+        with open(part, "ab") as f:
+            f.write(b"xyz")  # the other worker's chunk at offset 0
+    worker.join(5)
+
+    assert [e.status for e in results] == [409]
+    with open(part, "rb") as f:
+        assert f.read() == b"xyz"
@@ -16,3 +16,28 @@ def test_group_by_year():
     ]
     grouped = group_conversations_by_date(conversations, mode="year")
     assert isinstance(grouped, dict)
+
+def test_group_newest_first_with_unknown_last():
+    conversations = [
+        {"id":"1","title":"A","create_time":1704067200,"mapping":{}},
+        {"id":"2","title":"B","create_time":None,"mapping":{}},
+        {"id":"3","title":"C","create_time":1735603200,"mapping":{"n":{"message":{"content":"hi"}}, "r":{"message":None}}},
+        {"id":"4","title":"D","create_time":1735603260,"mapping":{}},
+    ]
+    grouped = group_conversations_by_date(conversations, mode="year")
+    assert list(grouped)[-1] == "Unknown"
+    newest = grouped[list(grouped)[0]]["All"]
+    assert [c["id"] for c in newest][:2] == ["4", "3"]
+    assert newest[1]["message_count"] == 1
+
+def test_group_by_extra_granularities():
+    conversations = [
+        {"id":"1","title":"A","create_time":1704196800,"mapping":{}},  # early Jan 2024
+        {"id":"2","title":"B","create_time":1720000000,"mapping":{}},  # July 2024
+    ]
+    quarters = group_conversations_by_date(conversations, mode="quarter")
+    assert list(quarters) == ["Q3 2024", "Q1 2024"]
+    weeks = group_conversations_by_date(conversations, mode="week")
+    assert all(label.startswith("Week of ") for label in weeks)
+    days = group_conversations_by_date(conversations, mode="day")
+    assert len(days) == 2